@@ -0,0 +1,448 @@
+"""Admission control: per-client token buckets, provider rate limits and a fair queue.
+
+One chat request can fan out into two Gemini calls and up to four Amadeus
+calls, so three layers keep a single noisy client from spending the shared
+provider quota:
+
+- each client (its IP, or the ``ADMISSION_CLIENT_HEADER`` set by a trusted
+  proxy) has a token bucket of ``CLIENT_RATE_PER_MINUTE`` requests with
+  bursts of ``CLIENT_BURST``; an empty bucket is answered with 429 straight
+  away;
+- at most ``ADMISSION_MAX_ACTIVE`` chat requests run at once per worker. The
+  others wait in a fair queue: higher priority first, round-robin between
+  clients within a priority, each waiter with a deadline
+  (``ADMISSION_QUEUE_TIMEOUT``). A full queue (``ADMISSION_QUEUE_MAX``, or
+  ``ADMISSION_QUEUE_PER_CLIENT`` waiters of one client) or a missed deadline
+  sheds the request with 429 and a Retry-After estimate instead of piling up;
+- every upstream call takes a token from its provider's bucket
+  (``AMADEUS_RATE_PER_SECOND``, ``GEMINI_RATE_PER_SECOND``; 0 = unlimited),
+  waiting at most until the admitted request's deadline
+  (``ADMISSION_REQUEST_DEADLINE``) before failing with
+  ``ProviderThrottledError``.
+
+Token buckets live in a backend (``RATE_LIMIT_BACKEND``): ``memory`` (per
+process) or ``sqlite`` (``RATE_LIMIT_SQLITE_PATH``), shared by every worker
+on the machine so the client and provider limits hold for the deployment as
+a whole; the default follows ``STATE_BACKEND`` (see state.py). SQLite
+takes run on the store's own thread, so waiting for the database write
+lock never blocks the event loop. The queue and the active-request slots
+are per worker.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from state import STATE_BACKEND, StoreThread, connect_sqlite, state_path
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+CLIENT_RATE_PER_MINUTE = float(os.getenv("CLIENT_RATE_PER_MINUTE", "30"))
+CLIENT_BURST = float(os.getenv("CLIENT_BURST", "10"))
+# e.g. "X-Forwarded-For" or "X-Client-Id" behind a proxy that sets it; empty = the peer IP
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "")
+ADMISSION_HIGH_PRIORITY_CLIENTS = {c.strip() for c in os.getenv("ADMISSION_HIGH_PRIORITY_CLIENTS", "").split(",")
+                                   if c.strip()}
+ADMISSION_MAX_ACTIVE = int(os.getenv("ADMISSION_MAX_ACTIVE", "64"))
+ADMISSION_QUEUE_MAX = int(os.getenv("ADMISSION_QUEUE_MAX", "256"))
+ADMISSION_QUEUE_PER_CLIENT = int(os.getenv("ADMISSION_QUEUE_PER_CLIENT", "4"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+ADMISSION_REQUEST_DEADLINE = float(os.getenv("ADMISSION_REQUEST_DEADLINE", "30"))
+# how long a provider call outside any request (background work) may wait for a token
+PROVIDER_WAIT_MAX = float(os.getenv("PROVIDER_WAIT_MAX", "5"))
+PROVIDER_RATES = {
+    "amadeus": (float(os.getenv("AMADEUS_RATE_PER_SECOND", "10")), float(os.getenv("AMADEUS_BURST", "10"))),
+    "gemini": (float(os.getenv("GEMINI_RATE_PER_SECOND", "10")), float(os.getenv("GEMINI_BURST", "10"))),
+}
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", STATE_BACKEND)
+RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", state_path("ratelimit.sqlite3"))
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "10000"))
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+# deadline (event loop time) of the admitted request the current task works for
+_request_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def provider_deadline(seconds: float):
+    """Provider calls made inside (background work) wait at most ``seconds`` for a rate-limit token"""
+    token = _request_deadline.set(asyncio.get_running_loop().time() + seconds)
+    try:
+        yield
+    finally:
+        _request_deadline.reset(token)
+
+
+class Overloaded(RuntimeError):
+    """Request shed by admission control; answered with 429 and Retry-After."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"{reason}, retry after {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ProviderThrottledError(Overloaded):
+    """No provider token became available before the request's deadline."""
+
+
+# --- Token bucket backends ---
+
+class MemoryBuckets:
+    """Token buckets in a dict; full buckets are dropped once there are too many."""
+
+    name = "memory"
+
+    def __init__(self, max_buckets: int = RATE_LIMIT_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets: Dict[str, Tuple[float, float, float, float]] = {}  # tokens, updated, rate, burst
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """Take ``cost`` tokens; 0.0 when granted, else seconds until they are available"""
+        now = time.time()
+        tokens, updated, _, _ = self._buckets.get(key, (burst, now, rate, burst))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        granted = tokens >= cost
+        if granted:
+            tokens -= cost
+        self._buckets[key] = (tokens, now, rate, burst)
+        if len(self._buckets) > self.max_buckets:
+            self._prune(now)
+        return 0.0 if granted else (cost - tokens) / rate
+
+    def _prune(self, now: float):
+        full = [key for key, (tokens, updated, rate, burst) in self._buckets.items()
+                if tokens + (now - updated) * rate >= burst]
+        for key in full:
+            del self._buckets[key]
+
+    def size(self) -> int:
+        return len(self._buckets)
+
+
+class SQLiteBuckets:
+    """Token buckets in a SQLite file, shared between worker processes."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = RATE_LIMIT_SQLITE_PATH, idle_expiry: float = 3600):
+        self.path = path
+        self.idle_expiry = idle_expiry
+        self._takes = 0
+        self._lock = threading.Lock()
+        self._io = StoreThread("ratelimit")
+        self._db = connect_sqlite(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        # Recounted at prunes and tracked between them, so stats() never queries from the loop
+        self._count = self._db.execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        return await self._io.run(self._take, key, rate, burst, cost)
+
+    def _take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        with self._lock:
+            # BEGIN IMMEDIATE: read-modify-write under the database write lock, so workers never double-spend
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._db.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                granted = tokens >= cost
+                if granted:
+                    tokens -= cost
+                self._db.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                                 (key, tokens, now))
+                if row is None:
+                    self._count += 1
+                self._takes += 1
+                if self._takes % 1000 == 0:
+                    self._db.execute("DELETE FROM buckets WHERE updated_at < ?", (now - self.idle_expiry,))
+                    self._count = self._db.execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return 0.0 if granted else (cost - tokens) / rate
+
+    def size(self) -> int:
+        return self._count
+
+
+def create_buckets(kind: str = RATE_LIMIT_BACKEND):
+    if kind == "sqlite":
+        return SQLiteBuckets(RATE_LIMIT_SQLITE_PATH)
+    if kind != "memory":
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {kind}")
+    return MemoryBuckets()
+
+
+# --- Fair queue ---
+
+@dataclass(eq=False)
+class Ticket:
+    client: str
+    priority: int
+    deadline: float  # event loop time by which the request's provider calls must have started
+    enqueued_at: float
+    future: Optional[asyncio.Future] = None
+    admitted: bool = False
+    released: bool = False
+    started_at: float = 0.0
+
+
+class FairQueue:
+    """Waiting tickets: best priority first, round-robin between clients within a priority."""
+
+    def __init__(self):
+        self._classes: Dict[int, "OrderedDict[str, Deque[Ticket]]"] = {}
+        self._per_client: Dict[str, int] = defaultdict(int)
+        self.size = 0
+
+    def push(self, ticket: Ticket):
+        clients = self._classes.setdefault(ticket.priority, OrderedDict())
+        clients.setdefault(ticket.client, deque()).append(ticket)
+        self._per_client[ticket.client] += 1
+        self.size += 1
+
+    def pop(self) -> Optional[Ticket]:
+        for priority in sorted(self._classes):
+            clients = self._classes[priority]
+            client, waiting = next(iter(clients.items()))
+            ticket = waiting.popleft()
+            if waiting:
+                clients.move_to_end(client)  # next turn goes to the next client
+            else:
+                del clients[client]
+                if not clients:
+                    del self._classes[priority]
+            self._forget(ticket)
+            return ticket
+        return None
+
+    def remove(self, ticket: Ticket):
+        waiting = self._classes.get(ticket.priority, {}).get(ticket.client)
+        if waiting and ticket in waiting:
+            waiting.remove(ticket)
+            if not waiting:
+                del self._classes[ticket.priority][ticket.client]
+                if not self._classes[ticket.priority]:
+                    del self._classes[ticket.priority]
+            self._forget(ticket)
+
+    def _forget(self, ticket: Ticket):
+        self.size -= 1
+        self._per_client[ticket.client] -= 1
+        if not self._per_client[ticket.client]:
+            del self._per_client[ticket.client]
+
+    def queued_for(self, client: str) -> int:
+        return self._per_client.get(client, 0)
+
+    def depth_by_priority(self) -> Dict[str, int]:
+        names = {value: name for name, value in PRIORITIES.items()}
+        return {names.get(p, str(p)): sum(len(q) for q in clients.values()) for p, clients in self._classes.items()}
+
+
+# --- Request admission ---
+
+class AdmissionController:
+    """Client rate limits plus a bounded number of active requests with a fair wait queue."""
+
+    def __init__(self, buckets, enabled: bool = ADMISSION_ENABLED, max_active: int = ADMISSION_MAX_ACTIVE,
+                 queue_max: int = ADMISSION_QUEUE_MAX, queue_per_client: int = ADMISSION_QUEUE_PER_CLIENT,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.buckets = buckets
+        self.enabled = enabled
+        self.max_active = max_active
+        self.queue_max = queue_max
+        self.queue_per_client = queue_per_client
+        self.queue_timeout = queue_timeout
+        self.queue = FairQueue()
+        self.active = 0
+        self.max_queued = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected: Dict[str, int] = defaultdict(int)
+        self.total_queue_wait_s = 0.0
+        self.service_s = 1.0  # moving average of request duration, for Retry-After estimates
+
+    def client_id(self, request) -> str:
+        """Rate-limit key of an HTTP request (the peer IP unless ADMISSION_CLIENT_HEADER is set)"""
+        if ADMISSION_CLIENT_HEADER:
+            value = request.headers.get(ADMISSION_CLIENT_HEADER, "").split(",")[0].strip()
+            if value:
+                return value
+        return request.client.host if request.client else "unknown"
+
+    def priority_of(self, client: str, requested: Optional[str] = None) -> int:
+        """Clients may lower their own priority; "high" is reserved for ADMISSION_HIGH_PRIORITY_CLIENTS"""
+        if client in ADMISSION_HIGH_PRIORITY_CLIENTS:
+            return PRIORITIES["high"]
+        return PRIORITIES["low"] if requested == "low" else PRIORITIES["normal"]
+
+    def retry_after(self) -> float:
+        """Rough time until a queued request would start: queue length x average duration / slots"""
+        return max(1.0, self.service_s * (self.queue.size + 1) / max(1, self.max_active))
+
+    def _reject(self, reason: str, retry_after: float):
+        self.rejected[reason] += 1
+        raise Overloaded(reason, retry_after)
+
+    async def admit(self, client: str, priority: int = PRIORITIES["normal"]) -> Ticket:
+        """Wait for an active-request slot; raises Overloaded (-> 429) when the request is shed
+
+        Also sets the request deadline for provider calls made later in the
+        calling task and in the tasks it creates.
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        ticket = Ticket(client, priority, now + ADMISSION_REQUEST_DEADLINE, now)
+        _request_deadline.set(ticket.deadline)
+        if not self.enabled:
+            return ticket
+        if CLIENT_RATE_PER_MINUTE > 0:
+            wait = await self.buckets.take(f"client:{client}", CLIENT_RATE_PER_MINUTE / 60, CLIENT_BURST)
+            if wait:
+                self._reject("client_rate", wait)
+        if self.active < self.max_active and not self.queue.size:
+            return self._start(ticket, loop)
+        if self.queue.size >= self.queue_max:
+            self._reject("queue_full", self.retry_after())
+        if self.queue.queued_for(client) >= self.queue_per_client:
+            self._reject("client_queue_full", self.retry_after())
+
+        ticket.future = loop.create_future()
+        self.queue.push(ticket)
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queue.size)
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not ticket.future.done():
+                self.queue.remove(ticket)
+                ticket.future.cancel()
+                self._reject("queue_timeout", self.retry_after())
+        except asyncio.CancelledError:
+            # client went away while waiting: give back a slot that was granted meanwhile
+            if ticket.future.done() and not ticket.future.cancelled():
+                ticket.admitted = True
+                self.release(ticket)
+            else:
+                self.queue.remove(ticket)
+                ticket.future.cancel()
+            raise
+        self.total_queue_wait_s += loop.time() - ticket.enqueued_at
+        ticket.admitted = True
+        ticket.started_at = loop.time()
+        return ticket
+
+    def _start(self, ticket: Ticket, loop) -> Ticket:
+        self.active += 1
+        self.admitted += 1
+        ticket.admitted = True
+        ticket.started_at = loop.time()
+        return ticket
+
+    def release(self, ticket: Ticket):
+        """Free the ticket's slot (idempotent) and hand it to the next waiter"""
+        if not ticket.admitted or ticket.released:
+            return
+        ticket.released = True
+        if not self.enabled:
+            return
+        elapsed = asyncio.get_running_loop().time() - ticket.started_at
+        self.service_s = 0.9 * self.service_s + 0.1 * elapsed
+        self.active -= 1
+        while self.active < self.max_active:
+            waiter = self.queue.pop()
+            if waiter is None:
+                break
+            if waiter.future.done():
+                continue
+            self.active += 1
+            self.admitted += 1
+            waiter.future.set_result(True)
+
+    @asynccontextmanager
+    async def slot(self, client: str, priority: int = PRIORITIES["normal"]):
+        ticket = await self.admit(client, priority)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "backend": self.buckets.name,
+            "buckets": self.buckets.size(),
+            "client_rate_per_minute": CLIENT_RATE_PER_MINUTE,
+            "client_burst": CLIENT_BURST,
+            "max_active": self.max_active,
+            "active": self.active,
+            "queued": self.queue.size,
+            "queued_by_priority": self.queue.depth_by_priority(),
+            "max_queued": self.max_queued,
+            "admitted": self.admitted,
+            "waited_in_queue": self.queued,
+            "avg_queue_wait_ms": round(self.total_queue_wait_s / self.queued * 1000, 1) if self.queued else 0.0,
+            "avg_request_s": round(self.service_s, 3),
+            "rejected": dict(self.rejected),
+        }
+
+
+# --- Provider rate limits ---
+
+class ProviderLimiter:
+    """Global per-provider token buckets taken before every upstream call."""
+
+    def __init__(self, buckets, rates: Dict[str, Tuple[float, float]] = PROVIDER_RATES,
+                 enabled: bool = ADMISSION_ENABLED):
+        self.buckets = buckets
+        self.rates = rates
+        self.enabled = enabled
+        self.waits: Dict[str, int] = defaultdict(int)
+        self.waited_s: Dict[str, float] = defaultdict(float)
+        self.throttled: Dict[str, int] = defaultdict(int)
+
+    async def acquire(self, provider: str):
+        rate, burst = self.rates.get(provider, (0.0, 0.0))
+        if not self.enabled or rate <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = _request_deadline.get() or loop.time() + PROVIDER_WAIT_MAX
+        while True:
+            wait = await self.buckets.take(f"provider:{provider}", rate, burst)
+            if not wait:
+                return
+            if loop.time() + wait > deadline:
+                self.throttled[provider] += 1
+                raise ProviderThrottledError(f"{provider} rate limit", wait)
+            self.waits[provider] += 1
+            self.waited_s[provider] += wait
+            await asyncio.sleep(wait)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            provider: {
+                "rate_per_second": rate,
+                "burst": burst,
+                "waits": self.waits.get(provider, 0),
+                "waited_s": round(self.waited_s.get(provider, 0.0), 3),
+                "throttled": self.throttled.get(provider, 0),
+            }
+            for provider, (rate, burst) in self.rates.items()
+        }
+
+
+rate_buckets = create_buckets()
+admission = AdmissionController(rate_buckets)
+provider_limiter = ProviderLimiter(rate_buckets)
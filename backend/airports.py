@@ -0,0 +1,243 @@
+"""Airport / city code index built from the bundled airports.csv.
+
+Each row is one airport: IATA code, city code (``TYO`` for NRT and HND),
+country, English city name, airport name, and ``|``-separated English
+aliases and Thai names. The first airport listed for a city is its primary
+airport, used when a flight is asked for by city name.
+
+The index keeps the rows as parallel tuples sorted by airport code and the
+names as one sorted tuple with a parallel array of row numbers, so lookups
+are ``bisect`` calls (a few microseconds) and a few hundred places take
+well under 100 KB. ``resolve`` accepts a code, an English or Thai name
+or alias, and falls back to fuzzy matching (one or two edits) for typos
+such as "Tokio"; ``find_mentions`` finds the places named in free text.
+Point ``AIRPORTS_DATA`` at a larger CSV with the same columns to extend it.
+"""
+import csv
+import os
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+AIRPORTS_DATA = os.getenv("AIRPORTS_DATA", os.path.join(os.path.dirname(os.path.abspath(__file__)), "airports.csv"))
+
+# Place names that are also everyday English words: resolvable, but not picked out of free text
+FREE_TEXT_EXCLUDED = {"nice", "male", "nan"}
+
+CODE_RE = re.compile(r"^[A-Z]{3}$")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+class Place(NamedTuple):
+    airport: str   # airport code to search flights with
+    city: str      # city code for hotels and car rentals
+    name: str      # English city name
+    country: str
+
+
+def normalize_name(text: str) -> str:
+    """Lower-case, accents and punctuation removed from Latin names, single spaces"""
+    text = text.strip().lower()
+    stripped = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    if stripped.isascii():  # Thai vowels and tone marks are combining characters; keep them
+        text = re.sub(r"[^a-z0-9]+", " ", stripped.replace("'", ""))
+    return " ".join(text.split())
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Edit distance counting a swap of neighbouring letters as one edit, or ``limit + 1`` once it exceeds ``limit``"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if before is not None and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+class AirportIndex:
+    """Sorted-array index over airports, their city codes and their names."""
+
+    def __init__(self, rows: Iterable[Dict[str, str]]):
+        rows = [row for row in rows if row.get("iata")]
+        file_order = [row["iata"].upper() for row in rows]
+        rows.sort(key=lambda row: row["iata"].upper())
+        self.codes = tuple(row["iata"].upper() for row in rows)
+        self.city_codes = tuple(row["city_code"].upper() for row in rows)
+        self.countries = tuple(row.get("country", "") for row in rows)
+        self.city_names = tuple(row["city"] for row in rows)
+        self.airport_names = tuple(row.get("airport", "") for row in rows)
+
+        # city code -> its airports, primary (first in the file) first
+        city_airports: Dict[str, List[str]] = {}
+        for code in file_order:
+            city_airports.setdefault(self.city_codes[self._find_code(code)], []).append(code)
+        self.cities = tuple(sorted(city_airports))
+        self.city_airports = tuple(tuple(city_airports[city]) for city in self.cities)
+
+        # The city name belongs to the city's primary airport; aliases and Thai names to their own row
+        names: Dict[str, int] = {}
+        for row in rows:
+            code = row["iata"].upper()
+            row_id = self._find_code(code)
+            own = [a for a in (row.get("aliases") or "").split("|") + (row.get("thai") or "").split("|") if a]
+            primary = self.city_airports[self._find_city(self.city_codes[row_id])][0]
+            if code == primary:
+                own.append(row["city"])
+            for name in own:
+                names.setdefault(normalize_name(name), row_id)
+        ordered = sorted(names.items())
+        self.names = tuple(name for name, _ in ordered)
+        self.name_rows = array("H", (row_id for _, row_id in ordered))
+        # reversed names in a second sorted array so fuzzy lookups also find typos in the first letter
+        reversed_names = sorted((name[::-1], i) for i, name in enumerate(self.names))
+        self.reversed_names = tuple(name for name, _ in reversed_names)
+        self.reversed_ids = array("H", (i for _, i in reversed_names))
+
+        self.max_words = max((len(n.split()) for n in self.names if n.isascii()), default=1)
+        # first character -> lengths of Thai names starting with it, longest first
+        thai_lengths: Dict[str, set] = {}
+        for n in self.names:
+            if not n.isascii():
+                thai_lengths.setdefault(n[0], set()).add(len(n))
+        self.thai_lengths = {c: tuple(sorted(lengths, reverse=True)) for c, lengths in thai_lengths.items()}
+
+    @classmethod
+    def load(cls, path: str = AIRPORTS_DATA) -> "AirportIndex":
+        with open(path, encoding="utf-8", newline="") as f:
+            return cls(csv.DictReader(f))
+
+    # --- codes ---
+
+    @staticmethod
+    def _bisect(values: Tuple[str, ...], key: str) -> int:
+        i = bisect_left(values, key)
+        return i if i < len(values) and values[i] == key else -1
+
+    def _find_code(self, code: str) -> int:
+        return self._bisect(self.codes, code)
+
+    def _find_city(self, code: str) -> int:
+        return self._bisect(self.cities, code)
+
+    def _place(self, row_id: int) -> Place:
+        return Place(self.codes[row_id], self.city_codes[row_id], self.city_names[row_id], self.countries[row_id])
+
+    def is_airport(self, code: str) -> bool:
+        return self._find_code(code) >= 0
+
+    def is_city(self, code: str) -> bool:
+        return self._find_city(code) >= 0
+
+    def is_valid_code(self, code: str) -> bool:
+        return self.is_airport(code) or self.is_city(code)
+
+    def airports_in(self, city_code: str) -> Tuple[str, ...]:
+        i = self._find_city(city_code)
+        return self.city_airports[i] if i >= 0 else ()
+
+    def city_of(self, code: str) -> Optional[str]:
+        """City code of an airport code (a city code maps to itself)"""
+        i = self._find_code(code)
+        if i >= 0:
+            return self.city_codes[i]
+        return code if self.is_city(code) else None
+
+    def by_code(self, code: str) -> Optional[Place]:
+        """Place for an airport code, or a city code (with its primary airport)"""
+        code = code.upper()
+        i = self._find_code(code)
+        if i >= 0:
+            return self._place(i)
+        airports = self.airports_in(code)
+        if airports:
+            return self._place(self._find_code(airports[0]))._replace(city=code)
+        return None
+
+    # --- names ---
+
+    def by_name(self, name: str) -> Optional[Place]:
+        i = self._bisect(self.names, name.lower())
+        if i < 0:
+            i = self._bisect(self.names, normalize_name(name))
+        return self._place(self.name_rows[i]) if i >= 0 else None
+
+    def _neighbours(self, values: Tuple[str, ...], prefix: str) -> range:
+        start = bisect_left(values, prefix)
+        end = bisect_left(values, prefix + "￿")
+        return range(start, end)
+
+    def fuzzy(self, name: str) -> Optional[Place]:
+        """Closest name within one edit (two for names of 9+ characters), sharing its first or last letters"""
+        key = normalize_name(name)
+        if len(key) < 4:
+            return None
+        limit = 1 if len(key) < 9 else 2
+        candidates = set(self._neighbours(self.names, key[0]))
+        candidates.update(self.reversed_ids[i] for i in self._neighbours(self.reversed_names, key[::-1][:2]))
+        best, best_distance = None, limit + 1
+        for i in sorted(candidates):
+            distance = edit_distance(key, self.names[i], limit)
+            if distance < best_distance:
+                best, best_distance = i, distance
+        return self._place(self.name_rows[best]) if best is not None else None
+
+    def resolve(self, text: str) -> Optional[Place]:
+        """Place for a code, name, alias or near-miss spelling; None when unknown"""
+        if not text or not isinstance(text, str):
+            return None
+        text = text.strip()
+        if CODE_RE.match(text.upper()) and text.isascii():
+            place = self.by_code(text)
+            if place is not None:
+                return place
+        return self.by_name(text) or self.fuzzy(text)
+
+    def find_mentions(self, message: str) -> List[Tuple[int, int, Place]]:
+        """Places named in free text as (start, end, place); longest name wins, no fuzzy matching"""
+        lowered = message.lower()
+        mentions = []
+        words = list(_WORD_RE.finditer(lowered))
+        i = 0
+        while i < len(words):
+            for n in range(min(self.max_words, len(words) - i), 0, -1):
+                name = " ".join(w.group(0) for w in words[i:i + n])
+                j = self._bisect(self.names, name)
+                if j >= 0 and name not in FREE_TEXT_EXCLUDED:
+                    mentions.append((words[i].start(), words[i + n - 1].end(), self._place(self.name_rows[j])))
+                    i += n
+                    break
+            else:
+                i += 1
+        position = 0
+        while position < len(lowered):
+            lengths = self.thai_lengths.get(lowered[position])
+            if lengths is None:
+                position += 1
+                continue
+            for length in lengths:
+                if position + length > len(lowered):
+                    continue
+                j = self._bisect(self.names, lowered[position:position + length])
+                if j >= 0:
+                    mentions.append((position, position + length, self._place(self.name_rows[j])))
+                    position += length
+                    break
+            else:
+                position += 1
+        return sorted(mentions)
+
+    def stats(self) -> Dict[str, int]:
+        return {"airports": len(self.codes), "cities": len(self.cities), "names": len(self.names)}
+
+
+airport_index = AirportIndex.load()
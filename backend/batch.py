@@ -0,0 +1,376 @@
+"""Batch chat for partner integrations that submit many trip requests at once.
+
+``POST /api/chat/batch`` takes up to ``BATCH_MAX_ITEMS`` messages and streams
+one NDJSON line per message as it finishes, then a summary line.
+``POST /api/chat/batch/jobs`` runs the same batch in the background and
+returns a job id to poll with ``GET /api/chat/batch/jobs/{job_id}``.
+
+A batch is cheaper than the same messages sent one by one:
+
+- messages are processed ``BATCH_CONCURRENCY`` at a time (``run_batch``);
+- identical messages share one intent analysis (``SharedTasks``), so a
+  hundred copies of the same request cost one Gemini plan at most;
+- identical searches share one upstream call through the result cache,
+  which coalesces in-flight lookups and serves the rest as hits;
+- replies use the template reply; Gemini writes a reply only for
+  messages without search results (``reply_mode="llm"`` asks for Gemini
+  replies throughout).
+
+Jobs run ``BATCH_MAX_RUNNING_JOBS`` at a time per worker; finished jobs are
+kept for ``BATCH_JOB_TTL`` seconds and at most ``BATCH_MAX_JOBS`` are held.
+A job runs in the worker that accepted it. With ``BATCH_JOB_BACKEND=sqlite``
+(default: ``STATE_BACKEND``, see state.py) its status and results are also
+written to ``BATCH_JOB_SQLITE_PATH``, so any worker answers a status poll,
+and a cancel sent to another worker is picked up by the owner at its next
+result.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from state import STATE_BACKEND, StoreThread, connect_sqlite, state_path
+from telemetry import log
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_RUNNING_JOBS = int(os.getenv("BATCH_MAX_RUNNING_JOBS", "2"))
+BATCH_JOB_TTL = int(os.getenv("BATCH_JOB_TTL", "3600"))
+BATCH_MAX_JOBS = int(os.getenv("BATCH_MAX_JOBS", "100"))
+BATCH_JOB_BACKEND = os.getenv("BATCH_JOB_BACKEND", STATE_BACKEND)
+BATCH_JOB_SQLITE_PATH = os.getenv("BATCH_JOB_SQLITE_PATH", state_path("batch_jobs.sqlite3"))
+
+FINISHED = ("done", "failed", "cancelled")
+
+
+def dedupe_key(message: str) -> str:
+    """Messages that differ only in case or spacing share their intent analysis"""
+    return " ".join(message.lower().split())
+
+
+class SharedTasks:
+    """One task per key: the first caller starts ``factory()``, later callers await the same result."""
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.shared = 0
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(factory())
+        else:
+            self.shared += 1
+        # shield: a cancelled item must not cancel the work other items are waiting for
+        return await asyncio.shield(task)
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def cancel(self):
+        for task in self._tasks.values():
+            task.cancel()
+
+
+async def run_batch(items: Sequence[Any], process: Callable[[int, Any], Awaitable[Dict[str, Any]]],
+                    concurrency: int = BATCH_CONCURRENCY) -> AsyncIterator[Dict[str, Any]]:
+    """Yield ``process(index, item)`` results in completion order, ``concurrency`` items at a time.
+
+    An item that raises yields ``{"index", "status": "error", "error"}`` instead of ending the batch.
+    """
+    finished: asyncio.Queue = asyncio.Queue()
+    pending = iter(enumerate(items))
+
+    async def worker():
+        for index, item in pending:
+            try:
+                result = await process(index, item)
+            except Exception as e:
+                log.warning("⚠️ Batch item %d failed: %s", index, e)
+                result = {"index": index, "status": "error", "error": str(e)}
+            finished.put_nowait(result)
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, min(concurrency, len(items))))]
+    try:
+        for _ in range(len(items)):
+            yield await finished.get()
+    finally:
+        for task in workers:
+            task.cancel()  # client ปิดการเชื่อมต่อ หรือ job ถูกยกเลิก
+
+
+class BatchJob:
+    __slots__ = ("job_id", "total", "status", "results", "summary", "error", "created_at", "finished_at", "task")
+
+    def __init__(self, total: int):
+        self.job_id = uuid.uuid4().hex
+        self.total = total
+        self.status = "queued"
+        self.results: List[Dict[str, Any]] = []
+        self.summary: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def progress(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "total": self.total,
+            "completed": len(self.results),
+            "errors": sum(1 for r in self.results if r.get("status") != "ok"),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "summary": self.summary,
+        }
+
+    def view(self, offset: int = 0, limit: int = 100) -> Dict[str, Any]:
+        """Status, progress and ``limit`` results from ``offset`` (in completion order)"""
+        return job_view(self.progress(), self.results[offset:offset + limit], offset)
+
+
+def job_view(progress: Dict[str, Any], results: List[Dict[str, Any]], offset: int) -> Dict[str, Any]:
+    end = offset + len(results)
+    more = end < progress["completed"] or progress["status"] not in FINISHED
+    return dict(progress, results=results, next_offset=end if more else None)
+
+
+class SQLiteJobLog:
+    """Batch job progress and results in a SQLite file, shared between worker processes.
+
+    Queries run on the log's own thread, in the order they were made, so a
+    job's writes never overtake each other and never block the event loop.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = BATCH_JOB_SQLITE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._io = StoreThread("batch")
+        self._db = connect_sqlite(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS batch_jobs ("
+            " job_id TEXT PRIMARY KEY, progress TEXT NOT NULL, finished_at REAL,"
+            " cancel_requested INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS batch_results ("
+            " job_id TEXT NOT NULL, seq INTEGER NOT NULL, result TEXT NOT NULL, PRIMARY KEY (job_id, seq))"
+        )
+
+    @staticmethod
+    def _progress(job: BatchJob) -> str:
+        # serialized on the event loop: the job keeps changing while the write waits for the thread
+        return json.dumps(job.progress(), ensure_ascii=False)
+
+    async def save(self, job: BatchJob):
+        await self._io.run(self._save, job.job_id, self._progress(job), job.finished_at)
+
+    def _save(self, job_id: str, progress: str, finished_at: Optional[float]):
+        with self._lock:
+            self._write_progress(job_id, progress, finished_at)
+
+    def _write_progress(self, job_id: str, progress: str, finished_at: Optional[float]):
+        self._db.execute(
+            "INSERT INTO batch_jobs (job_id, progress, finished_at) VALUES (?, ?, ?)"
+            " ON CONFLICT (job_id) DO UPDATE SET progress = excluded.progress, finished_at = excluded.finished_at",
+            (job_id, progress, finished_at),
+        )
+
+    async def add_result(self, job: BatchJob, result: Dict[str, Any]) -> bool:
+        """Store the job's latest result; True when another worker asked to cancel the job"""
+        return await self._io.run(self._add_result, job.job_id, len(job.results) - 1,
+                                  json.dumps(result, ensure_ascii=False), self._progress(job), job.finished_at)
+
+    def _add_result(self, job_id: str, seq: int, result: str, progress: str, finished_at: Optional[float]) -> bool:
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO batch_results (job_id, seq, result) VALUES (?, ?, ?)",
+                             (job_id, seq, result))
+            self._write_progress(job_id, progress, finished_at)
+            row = self._db.execute("SELECT cancel_requested FROM batch_jobs WHERE job_id = ?",
+                                   (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    async def view(self, job_id: str, offset: int, limit: int, ttl: float) -> Optional[Dict[str, Any]]:
+        return await self._io.run(self._view, job_id, offset, limit, ttl)
+
+    def _view(self, job_id: str, offset: int, limit: int, ttl: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT progress, finished_at FROM batch_jobs WHERE job_id = ?",
+                                   (job_id,)).fetchone()
+            if row is None or (row[1] and time.time() - row[1] > ttl):
+                return None
+            results = self._db.execute(
+                "SELECT result FROM batch_results WHERE job_id = ? AND seq >= ? ORDER BY seq LIMIT ?",
+                (job_id, offset, limit),
+            ).fetchall()
+        return job_view(json.loads(row[0]), [json.loads(r[0]) for r in results], offset)
+
+    async def request_cancel(self, job_id: str) -> bool:
+        return await self._io.run(self._request_cancel, job_id)
+
+    def _request_cancel(self, job_id: str) -> bool:
+        with self._lock:
+            return self._db.execute("UPDATE batch_jobs SET cancel_requested = 1 WHERE job_id = ?",
+                                    (job_id,)).rowcount > 0
+
+    async def prune(self, ttl: float):
+        await self._io.run(self._prune, time.time() - ttl)
+
+    def _prune(self, cutoff: float):
+        with self._lock:
+            self._db.execute("DELETE FROM batch_results WHERE job_id IN"
+                             " (SELECT job_id FROM batch_jobs WHERE finished_at < ?)", (cutoff,))
+            self._db.execute("DELETE FROM batch_jobs WHERE finished_at < ?", (cutoff,))
+
+
+class BatchJobStore:
+    """Batch jobs by id, LRU-bounded; finished jobs expire after ``ttl`` seconds."""
+
+    def __init__(self, max_jobs: int = BATCH_MAX_JOBS, ttl: int = BATCH_JOB_TTL,
+                 max_running: int = BATCH_MAX_RUNNING_JOBS, shared: Optional[SQLiteJobLog] = None):
+        self.shared = shared
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self.max_running = max_running
+        self._running: Optional[asyncio.Semaphore] = None
+        self._jobs: "OrderedDict[str, BatchJob]" = OrderedDict()
+        self.submitted = 0
+        self.batches = 0
+        self.items = 0
+        self.item_errors = 0
+        self.shared_intents = 0
+
+    async def submit(self, total: int, runner: Callable[[BatchJob], Awaitable[None]]) -> BatchJob:
+        """Start ``runner(job)`` in the background once fewer than ``max_running`` jobs are running"""
+        if self._running is None:
+            self._running = asyncio.Semaphore(self.max_running)
+        self._evict()
+        job = BatchJob(total)
+        self._jobs[job.job_id] = job
+        self.submitted += 1
+        if self.shared is not None:
+            await self.shared.prune(self.ttl)
+            await self.shared.save(job)
+        job.task = asyncio.create_task(self._run(job, runner))
+        return job
+
+    async def _run(self, job: BatchJob, runner: Callable[[BatchJob], Awaitable[None]]):
+        try:
+            async with self._running:
+                job.status = "running"
+                if self.shared is not None:
+                    await self.shared.save(job)
+                await runner(job)
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+        except Exception as e:
+            log.exception("❌ Batch job %s failed: %s", job.job_id, e)
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            if self.shared is not None:
+                # shield: a second cancel (shutdown drain) must not lose the final status
+                await asyncio.shield(self.shared.save(job))
+
+    async def add_result(self, job: BatchJob, result: Dict[str, Any]):
+        job.results.append(result)
+        if self.shared is not None and await self.shared.add_result(job, result):
+            job.task.cancel()  # DELETE ที่ส่งไปยัง worker อื่น
+
+    def _evict(self):
+        now = time.time()
+        for job_id in [j.job_id for j in self._jobs.values() if j.finished_at and now - j.finished_at > self.ttl]:
+            del self._jobs[job_id]
+        # เกิน max_jobs: ทิ้ง job ที่จบแล้วที่เก่าที่สุดก่อน (job ที่ยังทำงานไม่ถูกทิ้ง)
+        for job_id in [j.job_id for j in self._jobs.values() if j.status in FINISHED]:
+            if len(self._jobs) < self.max_jobs:
+                break
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if job.finished_at and time.time() - job.finished_at > self.ttl:
+            del self._jobs[job_id]
+            return None
+        self._jobs.move_to_end(job_id)
+        return job
+
+    async def view(self, job_id: str, offset: int = 0, limit: int = 100) -> Optional[Dict[str, Any]]:
+        """The job's view from this worker, or from the shared log when another worker runs it"""
+        job = self.get(job_id)
+        if job is not None:
+            return job.view(offset, limit)
+        if self.shared is not None:
+            return await self.shared.view(job_id, offset, limit, self.ttl)
+        return None
+
+    async def cancel(self, job_id: str) -> bool:
+        """Cancel a running job (here, or via the shared log); False for an unknown job"""
+        job = self.get(job_id)
+        if job is not None:
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
+            return True
+        return self.shared is not None and await self.shared.request_cancel(job_id)
+
+    def running(self) -> List[asyncio.Task]:
+        return [job.task for job in self._jobs.values() if job.task is not None and not job.task.done()]
+
+    async def drain(self, timeout: float) -> bool:
+        """Wait up to ``timeout`` seconds for running jobs (shutdown), then cancel the rest; True when all finished"""
+        tasks = self.running()
+        if not tasks:
+            return True
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending, timeout=1)
+        return not pending
+
+    def record(self, summary: Dict[str, Any]):
+        """Counters of a finished batch (streamed or job)"""
+        self.batches += 1
+        self.items += summary["items"]
+        self.item_errors += summary["errors"]
+        self.shared_intents += summary["shared_intents"]
+
+    def stats(self) -> Dict[str, Any]:
+        by_status: Dict[str, int] = {}
+        for job in self._jobs.values():
+            by_status[job.status] = by_status.get(job.status, 0) + 1
+        return {
+            "backend": self.shared.name if self.shared is not None else "memory",
+            "jobs": len(self._jobs),
+            "jobs_by_status": by_status,
+            "jobs_submitted": self.submitted,
+            "batches": self.batches,
+            "items": self.items,
+            "item_errors": self.item_errors,
+            "shared_intents": self.shared_intents,
+            "max_items": BATCH_MAX_ITEMS,
+            "concurrency": BATCH_CONCURRENCY,
+        }
+
+
+def create_job_store(kind: str = BATCH_JOB_BACKEND) -> BatchJobStore:
+    if kind == "sqlite":
+        return BatchJobStore(shared=SQLiteJobLog(BATCH_JOB_SQLITE_PATH))
+    if kind != "memory":
+        raise ValueError(f"Unknown BATCH_JOB_BACKEND: {kind}")
+    return BatchJobStore()
+
+
+batch_jobs = create_job_store()
@@ -0,0 +1,439 @@
+"""Load test for /api/chat, /api/chat/stream and /api/chat/batch.
+
+By default the app runs in-process (ASGI transport, no network) with the
+offline providers from fake_providers.py, so no API keys are needed; tune
+them with the FAKE_* environment variables. Use --url to load a running
+server instead.
+
+Each simulated user sends messages from fixtures/bench_messages.json one
+after another. The report has p50/p95/p99 latency, requests per second and
+per-stage timings (intent, search, reply, per tool) taken from the
+``timings`` and ``plan_execution`` fields of each response. Results are saved
+as JSON under bench_results/ and can be compared against an earlier run:
+
+    python benchmark.py --users 20 --requests 400 --label baseline
+    python benchmark.py --users 20 --requests 400 --compare bench_results/baseline.json
+
+--batch N sends the messages N at a time to /api/chat/batch; latency is
+then per message (its ``elapsed_ms``) and ``requests_per_provider_call``
+shows how many messages each Gemini/Amadeus call served, to compare with a
+run of single requests:
+
+    python benchmark.py --users 4 --requests 400 --label single
+    python benchmark.py --users 1 --requests 400 --batch 100 --label batched
+
+--workers 1,2,4 measures how throughput scales with worker processes on
+this machine: for each count it starts ``main.py --workers N`` (fake
+providers, shared SQLite state in a temporary directory), loads it over
+HTTP with the same settings and stops it with SIGTERM (graceful drain):
+
+    python benchmark.py --workers 1,2,4 --users 32 --requests 2000 --label scaling
+
+With --compare the exit code is 1 when p95/p99 latency or throughput got
+worse than --max-regression (default 10%).
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MESSAGES = os.path.join(BACKEND_DIR, "fixtures", "bench_messages.json")
+DEFAULT_OUT_DIR = os.path.join(BACKEND_DIR, "bench_results")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return round(ordered[index], 1)
+
+
+def distribution(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "mean": round(sum(values) / len(values), 1),
+        "max": round(max(values), 1),
+    }
+
+
+def parse_sse(body: str) -> List[tuple]:
+    events = []
+    for block in body.split("\n\n"):
+        event, data = None, None
+        for line in block.splitlines():
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: "):
+                data = json.loads(line[6:])
+        if event:
+            events.append((event, data))
+    return events
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.stages: Dict[str, List[float]] = defaultdict(list)
+        self.tools: Dict[str, List[float]] = defaultdict(list)
+        self.tool_failures: Dict[str, int] = defaultdict(int)
+
+    def record(self, latency_ms: float, result: Optional[Dict[str, Any]], error: Optional[str]):
+        if error:
+            self.errors[error] += 1
+            return
+        self.latencies.append(latency_ms)
+        for stage, value in (result.get("timings") or {}).items():
+            self.stages[stage].append(value)
+        for step in result.get("plan_execution") or []:
+            tool = step.get("tool") or "unknown"
+            self.tools[tool].append(step.get("elapsed_ms", 0.0))
+            if step.get("status") != "ok":
+                self.tool_failures[tool] += 1
+
+
+async def send(client: httpx.AsyncClient, message: str, session_id: Optional[str], stream: bool):
+    payload = {"message": message, "session_id": session_id}
+    if not stream:
+        response = await client.post("/api/chat", json=payload)
+        if response.status_code != 200:
+            return None, f"http_{response.status_code}"
+        return response.json(), None
+
+    response = await client.post("/api/chat/stream", json=payload)
+    if response.status_code != 200:
+        return None, f"http_{response.status_code}"
+    events = parse_sse(response.text)
+    for event, data in events:
+        if event == "done":
+            return data, None
+    return None, "stream_error" if any(event == "error" for event, _ in events) else "stream_incomplete"
+
+
+async def send_batch(client: httpx.AsyncClient, messages: List[str]) -> List[tuple]:
+    """(result, error) per message of one /api/chat/batch request"""
+    response = await client.post("/api/chat/batch", json={"items": [{"message": m} for m in messages]})
+    if response.status_code != 200:
+        return [(None, f"http_{response.status_code}")] * len(messages)
+    lines = [json.loads(line) for line in response.text.splitlines() if line]
+    items = [line for line in lines if not line.get("done")]
+    outcomes = [(item, None) if item.get("status") == "ok" else (None, f"batch_{item.get('status')}") for item in items]
+    return outcomes + [(None, "batch_incomplete")] * (len(messages) - len(items))
+
+
+async def simulated_user(user: int, client: httpx.AsyncClient, messages: List[str], args, recorder: Recorder,
+                         remaining: List[int], deadline: Optional[float]):
+    session_id = None
+    turn = user  # users start at different messages
+    while True:
+        if deadline is not None:
+            if time.perf_counter() >= deadline:
+                return
+        else:
+            if remaining[0] <= 0:
+                return
+        count = args.batch or 1
+        if deadline is None:
+            count = min(count, remaining[0])
+            remaining[0] -= count
+        if args.batch:
+            batch = [messages[(turn + i) % len(messages)] for i in range(count)]
+            turn += count
+            started = time.perf_counter()
+            try:
+                outcomes = await send_batch(client, batch)
+            except httpx.HTTPError as e:
+                outcomes = [(None, type(e).__name__)] * count
+            for result, error in outcomes:
+                latency = result.get("elapsed_ms", 0.0) if result else (time.perf_counter() - started) * 1000
+                recorder.record(latency, result, error)
+            continue
+        message = messages[turn % len(messages)]
+        turn += 1
+        started = time.perf_counter()
+        try:
+            result, error = await send(client, message, session_id, args.stream)
+        except httpx.HTTPError as e:
+            result, error = None, type(e).__name__
+        recorder.record((time.perf_counter() - started) * 1000, result, error)
+        if args.sessions and result:
+            session_id = result.get("session_id")
+        if args.think_ms:
+            await asyncio.sleep(args.think_ms / 1000)
+
+
+def provider_calls(stats: Optional[Dict[str, Any]]) -> int:
+    """Finished Gemini + Amadeus calls in a server's /api/stats (0 when unavailable)"""
+    lanes = ((stats or {}).get("executor") or {}).get("providers") or {}
+    return sum(lane.get("completed", 0) + lane.get("failed", 0) for lane in lanes.values())
+
+
+def same_worker(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> bool:
+    pid = lambda stats: ((stats or {}).get("startup") or {}).get("pid")
+    return pid(before) is not None and pid(before) == pid(after)
+
+
+async def run_load(client: httpx.AsyncClient, messages: List[str], args) -> Dict[str, Any]:
+    if args.warmup:
+        warmup = Recorder()
+        await asyncio.gather(*(
+            simulated_user(u, client, messages, args, warmup, [args.warmup], None) for u in range(1)
+        ))
+
+    before = None
+    try:
+        response = await client.get("/api/stats")
+        before = response.json() if response.status_code == 200 else None
+    except httpx.HTTPError:
+        pass
+    recorder = Recorder()
+    remaining = [args.requests]
+    deadline = time.perf_counter() + args.duration if args.duration else None
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        simulated_user(u, client, messages, args, recorder, remaining, deadline) for u in range(args.users)
+    ))
+    duration = time.perf_counter() - started
+
+    total = len(recorder.latencies) + sum(recorder.errors.values())
+    report = {
+        "requests": total,
+        "errors": dict(recorder.errors),
+        "error_rate": round(sum(recorder.errors.values()) / total, 4) if total else 0.0,
+        "duration_s": round(duration, 2),
+        "rps": round(total / duration, 2) if duration else 0.0,
+        "latency_ms": distribution(recorder.latencies),
+        "stages_ms": {stage: distribution(values) for stage, values in sorted(recorder.stages.items())},
+        "tools_ms": {
+            tool: dict(distribution(values), failed=recorder.tool_failures.get(tool, 0))
+            for tool, values in sorted(recorder.tools.items())
+        },
+    }
+    try:
+        stats = await client.get("/api/stats")
+        if stats.status_code == 200:
+            report["server_stats"] = stats.json()
+    except httpx.HTTPError:
+        pass
+    after = report.get("server_stats")
+    # with several workers the two /api/stats may come from different processes
+    if same_worker(before, after):
+        calls = provider_calls(after) - provider_calls(before)
+        report["provider_calls"] = calls
+        report["requests_per_provider_call"] = round(total / calls, 2) if calls > 0 else None
+    return report
+
+
+async def run(args, messages: List[str]) -> Dict[str, Any]:
+    timeout = httpx.Timeout(args.timeout)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=timeout) as client:
+            return await run_load(client, messages, args)
+
+    os.environ.setdefault("FAKE_PROVIDERS", "1")
+    # every simulated user shares one client IP in-process; ADMISSION_ENABLED=1 measures with rate limits on
+    os.environ.setdefault("ADMISSION_ENABLED", "0")
+    sys.path.insert(0, BACKEND_DIR)
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=timeout) as client:
+            report = await run_load(client, messages, args)
+    clients = main.provider_clients
+    if clients.fake:
+        report["fake_providers"] = {"gemini": clients.gemini_model.stats(), "amadeus": clients.amadeus.stats()}
+    return report
+
+
+def wait_for_workers(url: str, workers: int, timeout: float) -> bool:
+    """Poll /healthz on new connections until every worker pid has answered"""
+    pids = set()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = httpx.get(f"{url}/healthz", timeout=1, headers={"Connection": "close"})
+            if response.status_code == 200:
+                pids.add(response.json()["pid"])
+                if len(pids) >= workers:
+                    return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    return False
+
+
+def run_scaling(args, messages: List[str]) -> Dict[str, Any]:
+    """Load ``main.py --workers N`` for each N in --workers; report per worker count"""
+    counts = [int(n) for n in args.workers.split(",") if n.strip()]
+    runs = []
+    for n in counts:
+        port = args.port + len(runs)
+        url = f"http://127.0.0.1:{port}"
+        with tempfile.TemporaryDirectory(prefix="bench-state-") as state_dir:
+            env = dict(os.environ, STATE_DIR=state_dir)
+            env.setdefault("FAKE_PROVIDERS", "1")
+            env.setdefault("ADMISSION_ENABLED", "0")
+            env.setdefault("STATE_BACKEND", "sqlite")  # the same state setup for 1 and N workers
+            server = subprocess.Popen(
+                [sys.executable, "main.py", "--workers", str(n), "--host", "127.0.0.1", "--port", str(port)],
+                cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            try:
+                if not wait_for_workers(url, n, args.timeout):
+                    raise SystemExit(f"{n} workers did not start on port {port}")
+                args.url = url
+                report = asyncio.run(run(args, messages))
+            finally:
+                args.url = None
+                server.send_signal(signal.SIGTERM)
+                try:
+                    server.wait(timeout=60)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+        report.pop("server_stats", None)
+        runs.append({"workers": n, "report": report})
+        print(f"  {n} workers: {report['rps']} req/s, p95 {report['latency_ms'].get('p95')} ms, "
+              f"errors {report['error_rate']:.2%}")
+    base = runs[0]["report"]["rps"] if runs else 0
+    for entry in runs:
+        entry["speedup"] = round(entry["report"]["rps"] / base, 2) if base else None
+    # the highest worker count is the headline report (and what --compare checks)
+    return {"report": runs[-1]["report"] if runs else {}, "scaling": runs, "cpus": os.cpu_count()}
+
+
+def print_scaling(scaling: List[Dict[str, Any]], cpus: Optional[int]):
+    print(f"\nThroughput by worker count ({cpus} CPUs):")
+    print(f"  {'workers':>7} {'req/s':>9} {'speedup':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    for entry in scaling:
+        report = entry["report"]
+        print(f"  {entry['workers']:>7} {report['rps']:>9} {entry['speedup']:>7}x "
+              f"{report['latency_ms'].get('p50', 0):>8} {report['latency_ms'].get('p95', 0):>8} "
+              f"{report['error_rate']:>7.2%}")
+
+
+def compare(result: Dict[str, Any], baseline_result: Dict[str, Any], max_regression: float) -> bool:
+    """Print baseline vs current; return True when a regression exceeds the threshold"""
+    current, baseline = result["report"], baseline_result["report"]
+    rows = [("rps", current["rps"], baseline["rps"], True)]
+    for key in ("p50", "p95", "p99"):
+        rows.append((f"latency {key} ms", current["latency_ms"].get(key, 0), baseline["latency_ms"].get(key, 0), False))
+    for stage in sorted(set(current["stages_ms"]) & set(baseline["stages_ms"])):
+        rows.append((f"{stage} p95", current["stages_ms"][stage].get("p95", 0),
+                     baseline["stages_ms"][stage].get("p95", 0), False))
+
+    regressed = False
+    print(f"\nCompared with {baseline_result.get('label')} ({baseline_result.get('started_at')}):")
+    for name, now, before, higher_is_better in rows:
+        change = (now - before) / before if before else 0.0
+        worse = -change if higher_is_better else change
+        gate = name in ("rps", "latency p95 ms", "latency p99 ms")
+        flag = ""
+        if gate and worse > max_regression:
+            flag = "  << REGRESSION"
+            regressed = True
+        print(f"  {name:<22} {before:>10} -> {now:>10}  ({change:+.1%}){flag}")
+    return regressed
+
+
+def print_report(result: Dict[str, Any]):
+    report = result["report"]
+    latency = report["latency_ms"]
+    print(f"\n{result['label']}: {report['requests']} requests in {report['duration_s']}s "
+          f"({report['rps']} req/s), error rate {report['error_rate']:.2%}")
+    print(f"  latency ms  p50={latency.get('p50')} p95={latency.get('p95')} p99={latency.get('p99')} "
+          f"max={latency.get('max')}")
+    if report.get("requests_per_provider_call") is not None:
+        print(f"  provider calls {report['provider_calls']} ({report['requests_per_provider_call']} requests per call)")
+    for stage, dist in report["stages_ms"].items():
+        print(f"  {stage:<16} p50={dist.get('p50')} p95={dist.get('p95')} p99={dist.get('p99')}")
+    for tool, dist in report["tools_ms"].items():
+        print(f"  {tool:<16} p50={dist.get('p50')} p95={dist.get('p95')} failed={dist['failed']}")
+    if report["errors"]:
+        print(f"  errors: {report['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the AI Travel Agent chat API")
+    parser.add_argument("--users", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--requests", type=int, default=200, help="total requests (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="run for this many seconds instead")
+    parser.add_argument("--warmup", type=int, default=0, help="requests sent before measuring")
+    parser.add_argument("--stream", action="store_true", help="load /api/chat/stream instead of /api/chat")
+    parser.add_argument("--batch", type=int, default=0, help="send messages N at a time to /api/chat/batch")
+    parser.add_argument("--sessions", action="store_true", help="each user keeps its session_id across turns")
+    parser.add_argument("--think-ms", type=float, default=0, help="pause between a user's requests")
+    parser.add_argument("--messages", default=DEFAULT_MESSAGES, help="JSON file with a 'messages' list")
+    parser.add_argument("--url", help="base URL of a running server (default: in-process with fake providers)")
+    parser.add_argument("--workers", help="comma-separated worker counts to start and compare, e.g. 1,2,4")
+    parser.add_argument("--port", type=int, default=8790, help="first port for --workers servers")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--label", help="name of the result file (default: timestamp)")
+    parser.add_argument("--out", default=DEFAULT_OUT_DIR, help="directory for result files")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.10)
+    args = parser.parse_args()
+
+    with open(args.messages, encoding="utf-8") as f:
+        messages = json.load(f)["messages"]
+
+    started_at = datetime.now().isoformat(timespec="seconds")
+    label = args.label or started_at.replace(":", "")
+    scaling = run_scaling(args, messages) if args.workers else None
+    report = scaling["report"] if scaling else asyncio.run(run(args, messages))
+    result = {
+        "label": label,
+        "started_at": started_at,
+        "config": {
+            "target": args.url or ("main.py --workers " + args.workers if args.workers else "in-process"),
+            "endpoint": "/api/chat/batch" if args.batch else "/api/chat/stream" if args.stream else "/api/chat",
+            "batch": args.batch or None,
+            "users": args.users,
+            "requests": None if args.duration else args.requests,
+            "duration": args.duration or None,
+            "sessions": args.sessions,
+            "think_ms": args.think_ms,
+            "env": {k: v for k, v in os.environ.items() if k.startswith(("FAKE_", "REPLY_MODE", "FAST_INTENT", "CACHE_", "ADMISSION_", "BATCH_", "STATE_"))},
+        },
+        "report": report,
+    }
+    if scaling:
+        result["scaling"] = scaling["scaling"]
+        result["config"]["cpus"] = scaling["cpus"]
+    print_report(result)
+    if scaling:
+        print_scaling(scaling["scaling"], scaling["cpus"])
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{label}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\nSaved {path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(result, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
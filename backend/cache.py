@@ -0,0 +1,268 @@
+"""TTL + LRU cache for provider search results.
+
+Keys are built from the tool name and its normalized query parameters, so
+"bkk"/"BKK " and reordered arguments hit the same entry. Each tool has its
+own TTL, the entry count is bounded with least-recently-used eviction, and
+concurrent misses for the same key share a single upstream call.
+
+Two backends are available (``CACHE_BACKEND``):
+
+- ``memory`` (default): an in-process ``OrderedDict``.
+- ``sqlite``: a WAL-mode SQLite file (``CACHE_SQLITE_PATH``) shared by every
+  worker process on the machine. Values must be JSON-serializable. Its
+  queries block (up to the busy timeout under write contention), so they run
+  on the backend's own thread instead of on the event loop.
+
+The default follows ``STATE_BACKEND`` (see state.py).
+
+Cached values are shared between requests and must be treated as read-only.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from state import STATE_BACKEND, StoreThread, connect_sqlite, state_path
+from telemetry import log
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", STATE_BACKEND)
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", state_path("cache.sqlite3"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTLS = {
+    "flights": int(os.getenv("CACHE_TTL_FLIGHTS", "300")),
+    "hotels": int(os.getenv("CACHE_TTL_HOTELS", "900")),
+    "cars": int(os.getenv("CACHE_TTL_CARS", "900")),
+}
+CACHE_DEFAULT_TTL = int(os.getenv("CACHE_DEFAULT_TTL", "300"))
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return value.strip().upper()
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def make_key(tool: str, params: Dict[str, Any]) -> str:
+    """Stable cache key: ``tool`` plus sorted, normalized, non-empty params"""
+    parts = [
+        f"{name}={json.dumps(_normalize(value), ensure_ascii=False)}"
+        for name, value in sorted(params.items())
+        if value not in (None, "")
+    ]
+    return f"{tool}:" + "&".join(parts)
+
+
+class MemoryBackend:
+    """In-process LRU store with per-entry expiry."""
+
+    name = "memory"
+    io = None  # nothing blocks: called on the event loop
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        self._entries[key] = (time.time() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def expires_in(self, key: str) -> Optional[float]:
+        """Seconds until the entry expires (None when absent); does not count as a use"""
+        entry = self._entries.get(key)
+        remaining = entry[0] - time.time() if entry else 0.0
+        return remaining if remaining > 0 else None
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """LRU store in a SQLite file, shared between worker processes."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = CACHE_SQLITE_PATH, max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.io = StoreThread("cache")
+        self._db = connect_sqlite(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)")
+        # Row count as of this worker's last write, so stats() never queries from the loop
+        self._size = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: float):
+        now = time.time()
+        payload = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, payload, now + ttl, now),
+            )
+            self._size = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            if self._size > self.max_entries:
+                self._size -= self._db.execute("DELETE FROM cache WHERE expires_at <= ?", (now,)).rowcount
+            overflow = self._size - self.max_entries
+            if overflow > 0:
+                self._db.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                    (overflow,),
+                )
+                self.evictions += overflow
+                self._size -= overflow
+
+    def delete(self, key: str):
+        with self._lock:
+            self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def expires_in(self, key: str) -> Optional[float]:
+        with self._lock:
+            row = self._db.execute("SELECT expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        remaining = row[0] - time.time() if row else 0.0
+        return remaining if remaining > 0 else None
+
+    def size(self) -> int:
+        return self._size
+
+
+class ResultCache:
+    """Per-tool TTL cache with hit/miss counters and request coalescing."""
+
+    def __init__(self, backend, ttls: Dict[str, int], default_ttl: int = CACHE_DEFAULT_TTL):
+        self.backend = backend
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, tool: str, event: str):
+        counters = self._counters.setdefault(tool, {"hits": 0, "misses": 0, "coalesced": 0, "stores": 0,
+                                                     "store_errors": 0, "refreshes": 0})
+        counters[event] += 1
+
+    def ttl_for(self, tool: str) -> int:
+        return self.ttls.get(tool, self.default_ttl)
+
+    async def _backend(self, method: str, *args):
+        fn = getattr(self.backend, method)
+        if self.backend.io is not None:
+            return await self.backend.io.run(fn, *args)
+        return fn(*args)
+
+    async def expires_in(self, tool: str, params: Dict[str, Any]) -> Optional[float]:
+        """Seconds until the cached ``(tool, params)`` entry expires, None when not cached"""
+        return await self._backend("expires_in", make_key(tool, params))
+
+    async def get_or_fetch(self, tool: str, params: Dict[str, Any], fetch: Callable[[], Awaitable[Any]],
+                           refresh: bool = False):
+        """Return the cached value for ``(tool, params)`` or call ``fetch`` once to fill it.
+
+        ``None`` results (failed or empty searches) are returned but not cached.
+        ``refresh=True`` (cache warming) fetches even when an entry exists and
+        is counted as a refresh instead of a hit or miss.
+        """
+        key = make_key(tool, params)
+        if not refresh:
+            value = await self._backend("get", key)
+            if value is not None:
+                self._count(tool, "hits")
+                return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._count(tool, "coalesced")
+            return await asyncio.shield(inflight)
+
+        self._count(tool, "refreshes" if refresh else "misses")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await fetch()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                # Waiters should see a failed fetch, not be cancelled themselves
+                e = RuntimeError(f"{tool} fetch was cancelled")
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        else:
+            # Resolve waiters first: a failed store must not leave them hanging
+            future.set_result(value)
+            if value is not None:
+                try:
+                    await self._backend("set", key, value, self.ttl_for(tool))
+                except Exception as e:
+                    log.warning("⚠️ Result cache store for %s failed: %s", tool, e)
+                    self._count(tool, "store_errors")
+                else:
+                    self._count(tool, "stores")
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        tools = {}
+        for tool, counters in self._counters.items():
+            lookups = counters["hits"] + counters["misses"] + counters["coalesced"]
+            served = counters["hits"] + counters["coalesced"]
+            tools[tool] = dict(counters, hit_ratio=round(served / lookups, 3) if lookups else 0.0)
+        return {
+            "backend": self.backend.name,
+            "entries": self.backend.size(),
+            "max_entries": self.backend.max_entries,
+            "evictions": self.backend.evictions,
+            "ttls": self.ttls,
+            "tools": tools,
+        }
+
+
+def create_backend(kind: str = CACHE_BACKEND):
+    if kind == "sqlite":
+        return SQLiteBackend(CACHE_SQLITE_PATH, CACHE_MAX_ENTRIES)
+    if kind != "memory":
+        raise ValueError(f"Unknown CACHE_BACKEND: {kind}")
+    return MemoryBackend(CACHE_MAX_ENTRIES)
+
+
+result_cache = ResultCache(create_backend(), CACHE_TTLS)
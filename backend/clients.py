@@ -0,0 +1,187 @@
+"""Lazily constructed provider clients and startup bookkeeping.
+
+Importing main.py no longer configures Gemini or builds the Amadeus client;
+each is created on first use (or during startup pre-warm) and the
+``google.generativeai`` import is deferred with it. ``FAKE_PROVIDERS=1``
+swaps in the offline stand-ins from fake_providers.py.
+
+With ``STARTUP_PREWARM=1`` the app's lifespan starts ``prewarm()`` in the
+background: both clients are built and an Amadeus OAuth token is fetched,
+so the first user request does not pay for the TLS handshake and token
+round trip. ``/readyz`` reports not-ready until the pre-warm has finished.
+
+The Amadeus client sends its requests through the shared keep-alive pool in
+http_pool.py (``AMADEUS_POOLED_HTTP=0`` restores the SDK's urllib
+transport), so the pre-warmed connection is reused by the first search.
+Either transport times out after ``AMADEUS_TIMEOUT``: a call abandoned by
+the resilience policy then also ends its request and frees its provider
+thread, instead of holding it while the retry takes another.
+``AMADEUS_HOST`` / ``AMADEUS_PORT`` / ``AMADEUS_SSL=0`` point it elsewhere,
+e.g. at mock_amadeus.py.
+"""
+import asyncio
+import functools
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from urllib.request import urlopen
+
+from http_pool import http_pool
+from providers import run_amadeus
+from resilience import PROVIDER_POLICIES
+from telemetry import log
+
+FAKE_PROVIDERS = os.getenv("FAKE_PROVIDERS") == "1"
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL", "models/gemini-flash-latest")
+STARTUP_PREWARM = os.getenv("STARTUP_PREWARM", "0") == "1"
+PREWARM_TIMEOUT = float(os.getenv("PREWARM_TIMEOUT", "15"))
+AMADEUS_POOLED_HTTP = os.getenv("AMADEUS_POOLED_HTTP", "1") == "1"
+
+REQUIRED_ENV = ("GEMINI_API_KEY", "AMADEUS_API_KEY", "AMADEUS_API_SECRET")
+
+
+class ProviderClients:
+    """Holds the Gemini model and Amadeus client, creating each on first access."""
+
+    def __init__(self, fake: bool = FAKE_PROVIDERS):
+        self.fake = fake
+        self._gemini_model = None
+        self._amadeus = None
+        self._lock = threading.Lock()
+        self.init_seconds: Dict[str, float] = {}
+        self.prewarm_state: Dict[str, Any] = {"status": "pending" if STARTUP_PREWARM else "disabled"}
+
+    @property
+    def gemini_model(self):
+        if self._gemini_model is None:
+            with self._lock:
+                if self._gemini_model is None:
+                    self._gemini_model = self._timed("gemini", self._create_gemini_model)
+        return self._gemini_model
+
+    @gemini_model.setter
+    def gemini_model(self, model):
+        self._gemini_model = model
+
+    @property
+    def amadeus(self):
+        if self._amadeus is None:
+            with self._lock:
+                if self._amadeus is None:
+                    self._amadeus = self._timed("amadeus", self._create_amadeus)
+        return self._amadeus
+
+    @amadeus.setter
+    def amadeus(self, client):
+        self._amadeus = client
+
+    def _timed(self, name: str, factory):
+        started = time.perf_counter()
+        client = factory()
+        self.init_seconds[name] = round(time.perf_counter() - started, 4)
+        log.info("✅ %s client ready in %.0f ms", name, self.init_seconds[name] * 1000)
+        return client
+
+    def _create_gemini_model(self):
+        if self.fake:
+            from fake_providers import fake_gemini_model
+            return fake_gemini_model()
+        import google.generativeai as genai
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        return genai.GenerativeModel(GEMINI_MODEL_NAME)
+
+    def _create_amadeus(self):
+        if self.fake:
+            from fake_providers import fake_amadeus_client
+            return fake_amadeus_client()
+        from amadeus import Client
+        opener = http_pool.urllib_opener if AMADEUS_POOLED_HTTP else urlopen
+        options = {"http": functools.partial(opener, timeout=PROVIDER_POLICIES["amadeus"].timeout)}
+        if os.getenv("AMADEUS_HOST"):
+            options["host"] = os.getenv("AMADEUS_HOST")
+        if os.getenv("AMADEUS_PORT"):
+            options["port"] = int(os.getenv("AMADEUS_PORT"))
+        if os.getenv("AMADEUS_SSL") == "0":
+            options["ssl"] = False
+        return Client(
+            client_id=os.getenv("AMADEUS_API_KEY"),
+            client_secret=os.getenv("AMADEUS_API_SECRET"),
+            **options
+        )
+
+    def missing_config(self) -> List[str]:
+        if self.fake:
+            return []
+        return [name for name in REQUIRED_ENV if not os.getenv(name)]
+
+    def _fetch_amadeus_token(self):
+        client = self.amadeus
+        if self.fake:
+            return
+        from amadeus.client.access_token import AccessToken
+        # The SDK creates this attribute lazily on the first request and reuses it afterwards
+        if not hasattr(client, "access_token"):
+            client.access_token = AccessToken(client)
+        client.access_token._bearer_token()
+
+    async def prewarm(self, timeout: float = PREWARM_TIMEOUT):
+        """Build both clients and fetch the Amadeus OAuth token off the event loop"""
+        self.prewarm_state = {"status": "running"}
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.gather(
+                asyncio.to_thread(lambda: self.gemini_model),
+                run_amadeus(self._fetch_amadeus_token),
+            ), timeout)
+        except Exception as e:
+            self.prewarm_state = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+            log.warning("⚠️ Pre-warm failed: %s", self.prewarm_state["error"])
+        else:
+            self.prewarm_state = {"status": "ok"}
+            log.info("🔥 Providers pre-warmed")
+        self.prewarm_state["seconds"] = round(time.perf_counter() - started, 3)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "fake": self.fake,
+            "gemini_created": self._gemini_model is not None,
+            "amadeus_created": self._amadeus is not None,
+            "init_seconds": self.init_seconds,
+            "prewarm": self.prewarm_state,
+            "missing_config": self.missing_config(),
+        }
+
+
+provider_clients = ProviderClients()
+
+
+class StartupTimer:
+    """Cold-start timings of this worker process (module import, lifespan startup, time to ready)."""
+
+    def __init__(self, import_started: float):
+        self.pid = os.getpid()
+        self.import_started = import_started
+        self.import_seconds: Optional[float] = None
+        self.startup_seconds: Optional[float] = None
+        self.ready_seconds: Optional[float] = None
+
+    def imported(self):
+        self.import_seconds = round(time.perf_counter() - self.import_started, 4)
+
+    def started(self, since: float):
+        self.startup_seconds = round(time.perf_counter() - since, 4)
+        log.info("🚀 Worker %s started: import %.0f ms, startup %.0f ms", self.pid,
+                 (self.import_seconds or 0) * 1000, self.startup_seconds * 1000)
+
+    def ready(self):
+        if self.ready_seconds is None:
+            self.ready_seconds = round(time.perf_counter() - self.import_started, 4)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pid": self.pid,
+            "import_seconds": self.import_seconds,
+            "startup_seconds": self.startup_seconds,
+            "time_to_ready_seconds": self.ready_seconds,
+        }
@@ -0,0 +1,202 @@
+"""Offline stand-ins for the Gemini model and the Amadeus client.
+
+Enabled with ``FAKE_PROVIDERS=1`` (see main.py) so the chat pipeline can be
+run and benchmarked without API keys. The fakes expose the same call shapes
+the app uses, answer with recorded payloads from ``fixtures/`` and simulate:
+
+- latency: ``FAKE_GEMINI_LATENCY_MS`` / ``FAKE_AMADEUS_LATENCY_MS`` as
+  ``"<median>,<p95>"`` (log-normal) or ``"<ms>"`` (fixed);
+- failures: ``FAKE_GEMINI_ERROR_RATE`` / ``FAKE_AMADEUS_ERROR_RATE`` (0..1),
+  raised as the real SDK exception types (503 / 500) so retries and circuit
+  breakers behave as in production.
+
+``FAKE_SEED`` makes the latency and error sequence reproducible.
+"""
+import copy
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+
+from google.api_core import exceptions as google_exceptions
+from amadeus import ServerError
+
+from intent_parser import parse_intent
+
+FIXTURES_DIR = os.getenv("FAKE_FIXTURES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures"))
+
+_seed = os.getenv("FAKE_SEED")
+_random = random.Random(int(_seed) if _seed else None)
+_random_lock = threading.Lock()  # fakes are called from the provider thread pool
+
+
+def load_fixture(name: str) -> Dict[str, Any]:
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+class LatencyModel:
+    """Log-normal latency given its median and 95th percentile (milliseconds)."""
+
+    def __init__(self, median_ms: float, p95_ms: Optional[float] = None):
+        self.median_ms = median_ms
+        self.p95_ms = p95_ms if p95_ms is not None else median_ms
+        # p95 of a log-normal = median * exp(1.645 * sigma)
+        self.sigma = math.log(self.p95_ms / median_ms) / 1.645 if median_ms > 0 and self.p95_ms > median_ms else 0.0
+
+    @classmethod
+    def from_env(cls, name: str, default: str) -> "LatencyModel":
+        values = [float(v) for v in os.getenv(name, default).split(",")]
+        return cls(*values[:2])
+
+    def sample_s(self) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        with _random_lock:
+            z = _random.gauss(0, 1)
+        return self.median_ms * math.exp(self.sigma * z) / 1000
+
+
+def _should_fail(error_rate: float) -> bool:
+    if error_rate <= 0:
+        return False
+    with _random_lock:
+        return _random.random() < error_rate
+
+
+class _Counters:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, failed: bool):
+        with self._lock:
+            self.calls += 1
+            self.errors += failed
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "errors": self.errors}
+
+
+# --- Gemini ---
+
+class FakeGeminiResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """Mimics ``genai.GenerativeModel.generate_content`` for plan and reply prompts."""
+
+    def __init__(self, latency: LatencyModel, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.counters = _Counters()
+        responses = load_fixture("gemini_responses.json")
+        self.replies = responses["replies"]
+        self.fallback_plan = responses["fallback_plan"]
+
+    def _respond(self, prompt: str) -> str:
+        if "แผนการทำงาน" in prompt:
+            match = re.search(r'^ข้อความ: "(.*)"$', prompt, re.M)
+            plan = parse_intent(match.group(1)) if match else None
+            return f"```json\n{json.dumps(plan or self.fallback_plan, ensure_ascii=False)}\n```"
+        return self.replies[zlib.crc32(prompt.encode()) % len(self.replies)]
+
+    def generate_content(self, prompt: str, stream: bool = False, generation_config=None):
+        delay = self.latency.sample_s()
+        failed = _should_fail(self.error_rate)
+        self.counters.record(failed)
+        if failed:
+            time.sleep(delay)
+            raise google_exceptions.ServiceUnavailable("fake Gemini outage")
+        text = self._respond(prompt)
+        if not stream:
+            time.sleep(delay)
+            return FakeGeminiResponse(text)
+
+        def chunks():
+            # First chunk after ~40% of the latency, the rest spread over the remainder
+            words = re.findall(r"\S+\s*", text) or [text]
+            time.sleep(delay * 0.4)
+            for i in range(0, len(words), 4):
+                yield FakeGeminiResponse("".join(words[i:i + 4]))
+                time.sleep(delay * 0.6 * 4 / len(words))
+        return chunks()
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.counters.stats(), latency_ms=[self.latency.median_ms, self.latency.p95_ms],
+                    error_rate=self.error_rate)
+
+
+# --- Amadeus ---
+
+class FakeAmadeusResponse:
+    status_code = 200
+    parsed = True
+
+    def __init__(self, result: Dict[str, Any]):
+        self.result = result
+        self.data = result.get("data")
+
+
+class _FakeEndpoint:
+    def __init__(self, client: "FakeAmadeusClient", fixture: str):
+        self.client = client
+        self.result = load_fixture(fixture)
+
+    def get(self, **params):
+        return self.client._serve(self.result)
+
+
+class FakeAmadeusClient:
+    """Mimics the ``amadeus.Client`` endpoints the app calls.
+
+    ``shopping.car_rental_offers`` is left out on purpose: the real SDK
+    (8.1.0) does not have it either, so the car step fails the same way.
+    """
+
+    def __init__(self, latency: LatencyModel, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.counters = _Counters()
+        self.shopping = SimpleNamespace(
+            flight_offers_search=_FakeEndpoint(self, "amadeus_flight_offers.json"),
+            hotel_offers_search=_FakeEndpoint(self, "amadeus_hotel_offers.json"),
+        )
+        self.reference_data = SimpleNamespace(locations=SimpleNamespace(hotels=SimpleNamespace(
+            by_city=_FakeEndpoint(self, "amadeus_hotel_list.json"),
+        )))
+
+    def _serve(self, result: Dict[str, Any]) -> FakeAmadeusResponse:
+        failed = _should_fail(self.error_rate)
+        self.counters.record(failed)
+        time.sleep(self.latency.sample_s())
+        if failed:
+            raise ServerError(SimpleNamespace(status_code=500, parsed=False, result=None, request=None))
+        return FakeAmadeusResponse(copy.deepcopy(result))
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.counters.stats(), latency_ms=[self.latency.median_ms, self.latency.p95_ms],
+                    error_rate=self.error_rate)
+
+
+def fake_gemini_model() -> FakeGeminiModel:
+    return FakeGeminiModel(
+        LatencyModel.from_env("FAKE_GEMINI_LATENCY_MS", "700,1800"),
+        float(os.getenv("FAKE_GEMINI_ERROR_RATE", "0")),
+    )
+
+
+def fake_amadeus_client() -> FakeAmadeusClient:
+    return FakeAmadeusClient(
+        LatencyModel.from_env("FAKE_AMADEUS_LATENCY_MS", "400,1200"),
+        float(os.getenv("FAKE_AMADEUS_ERROR_RATE", "0")),
+    )
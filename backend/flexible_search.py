@@ -0,0 +1,125 @@
+"""Flexible-date flight search ("cheapest day next week").
+
+A date window is expanded into one search per departure day, or per
+(departure, return) pair for round trips, and the searches run concurrently:
+at most ``FLEX_CONCURRENCY`` at a time per request, and upstream calls of all
+flexible searches together are spaced to ``FLEX_RATE_PER_SECOND``. The caller
+supplies the per-day search, which goes through the result cache, so days
+already fetched by an overlapping window cost nothing. The per-day offers are
+merged into a price calendar (cheapest offer per day) and one list of all
+offers sorted by price, of which the caller shows the top N first.
+"""
+import asyncio
+import os
+import time
+from datetime import date, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+FLEX_MAX_DAYS = int(os.getenv("FLEX_MAX_DAYS", "14"))
+FLEX_TOP_N = int(os.getenv("FLEX_TOP_N", "5"))
+FLEX_CONCURRENCY = int(os.getenv("FLEX_CONCURRENCY", "4"))
+FLEX_RATE_PER_SECOND = float(os.getenv("FLEX_RATE_PER_SECOND", "5"))
+
+DatePair = Tuple[str, Optional[str]]
+DaySearch = Callable[[str, Optional[str]], Awaitable[Optional[List[Dict[str, Any]]]]]
+
+
+class RateLimiter:
+    """Spaces call starts at least ``1 / rate`` seconds apart (shared by all callers)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self.waited_s = 0.0
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            self.waited_s += slot - now
+            await asyncio.sleep(slot - now)
+
+
+flex_rate_limiter = RateLimiter(FLEX_RATE_PER_SECOND)
+
+
+def date_pairs(date_from: str, date_to: str, return_date: Optional[str] = None,
+               trip_days: Optional[int] = None, today: Optional[date] = None) -> List[DatePair]:
+    """Departure (and return) dates to search, capped at ``FLEX_MAX_DAYS`` days.
+
+    With ``return_date`` every departure before it is paired with that fixed
+    return; with ``trip_days`` each departure returns that many days later.
+    Days in the past are skipped. Raises ValueError for malformed dates.
+    """
+    today = today or date.today()
+    start = max(date.fromisoformat(date_from), today)
+    end = date.fromisoformat(date_to)
+    fixed_return = date.fromisoformat(return_date) if return_date else None
+    pairs = []
+    day = start
+    while day <= end and len(pairs) < FLEX_MAX_DAYS:
+        if fixed_return is not None:
+            if day < fixed_return:
+                pairs.append((day.isoformat(), fixed_return.isoformat()))
+        elif trip_days:
+            pairs.append((day.isoformat(), (day + timedelta(days=trip_days)).isoformat()))
+        else:
+            pairs.append((day.isoformat(), None))
+        day += timedelta(days=1)
+    return pairs
+
+
+def offer_price(flight: Dict[str, Any]) -> Tuple[Optional[float], str]:
+    """(price, currency) of a flight offer (see results.FlightOffer)"""
+    price = flight.get("price")
+    return (float(price) if isinstance(price, (int, float)) else None), flight.get("currency", "")
+
+
+async def flexible_search(pairs: List[DatePair], search: DaySearch, top_n: int = FLEX_TOP_N,
+                          concurrency: int = FLEX_CONCURRENCY) -> Dict[str, Any]:
+    """Run ``search(departure, return)`` for every pair and merge the offers"""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def search_day(pair: DatePair):
+        async with semaphore:
+            try:
+                return await search(*pair), None
+            except Exception as e:
+                return None, str(e)
+
+    results = await asyncio.gather(*(search_day(pair) for pair in pairs))
+
+    calendar = []
+    offers = []
+    for (departure, return_date), (flights, error) in zip(pairs, results):
+        entry = {"departure_date": departure}
+        if return_date:
+            entry["return_date"] = return_date
+        priced = []
+        for flight in flights or []:
+            amount, currency = offer_price(flight)
+            if amount is not None:
+                priced.append((amount, currency, flight))
+        if priced:
+            amount, currency, _ = min(priced, key=lambda p: p[0])
+            entry.update(status="ok", price=amount, currency=currency, offers=len(priced))
+            for amount, _, flight in priced:
+                offers.append((amount, dict(flight, departure_date=departure,
+                                            **({"return_date": return_date} if return_date else {}))))
+        else:
+            entry["status"] = "error" if error else "no_results"
+        calendar.append(entry)
+
+    offers.sort(key=lambda o: o[0])
+    priced_days = [e for e in calendar if e["status"] == "ok"]
+    cheapest_day = min(priced_days, key=lambda e: e["price"]) if priced_days else None
+    return {
+        "calendar": calendar,
+        "offers": [flight for _, flight in offers],
+        "top": [flight for _, flight in offers[:top_n]],
+        "cheapest_day": cheapest_day,
+        "days_searched": len(pairs),
+    }
@@ -0,0 +1,209 @@
+"""Persistent per-city hotel directory.
+
+The Amadeus "hotels by city" list barely changes, so it is kept in a JSON
+file (``HOTEL_DIRECTORY_PATH``) instead of being fetched before every offers
+search. Entries older than ``HOTEL_DIRECTORY_REFRESH_AFTER`` are still
+served while a background task refreshes them; only entries past
+``HOTEL_DIRECTORY_MAX_AGE`` (or unknown cities) block on the upstream call.
+
+The directory also remembers which hotels actually returned offers, which
+``select_hotel_ids`` uses together with distance to the city centre and
+chain variety to pick the hotels worth asking for offers.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from telemetry import log
+
+HOTEL_DIRECTORY_PATH = os.getenv("HOTEL_DIRECTORY_PATH", "hotel_directory.json")
+HOTEL_DIRECTORY_REFRESH_AFTER = int(os.getenv("HOTEL_DIRECTORY_REFRESH_AFTER", str(7 * 24 * 3600)))
+HOTEL_DIRECTORY_MAX_AGE = int(os.getenv("HOTEL_DIRECTORY_MAX_AGE", str(30 * 24 * 3600)))
+HOTEL_DIRECTORY_MAX_PER_CITY = int(os.getenv("HOTEL_DIRECTORY_MAX_PER_CITY", "200"))
+
+HotelLoader = Callable[[], Awaitable[List[Dict[str, Any]]]]
+
+
+def compact_hotel(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep only the fields of an Amadeus by-city record that the directory uses"""
+    geo = raw.get('geoCode') or {}
+    distance = raw.get('distance') or {}
+    km = distance.get('value')
+    if km is not None and distance.get('unit') == 'MILE':
+        km = km * 1.609
+    return {
+        'hotelId': raw.get('hotelId'),
+        'name': raw.get('name'),
+        'chainCode': raw.get('chainCode'),
+        'distance_km': km,
+        'lat': geo.get('latitude'),
+        'lon': geo.get('longitude'),
+    }
+
+
+class HotelDirectory:
+    """City code -> hotel list index, persisted to disk with stale-while-refresh."""
+
+    def __init__(self, path: Optional[str] = HOTEL_DIRECTORY_PATH,
+                 refresh_after: int = HOTEL_DIRECTORY_REFRESH_AFTER,
+                 max_age: int = HOTEL_DIRECTORY_MAX_AGE):
+        self.path = path
+        self.refresh_after = refresh_after
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self._cities: Dict[str, Dict[str, Any]] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._background: set = set()
+        self._dirty = False
+        self._file_lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self._cities = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("⚠️ Hotel directory not loaded: %s", e)
+            self._cities = {}
+
+    def _save(self, snapshot: Dict[str, Any]):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with self._file_lock:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+    async def flush(self):
+        """Write pending changes (new cities, offer statistics) to disk"""
+        if not self._dirty:
+            return
+        self._dirty = False
+        snapshot = json.loads(json.dumps(self._cities))
+        await asyncio.to_thread(self._save, snapshot)
+
+    async def get_hotels(self, city_code: str, loader: HotelLoader) -> List[Dict[str, Any]]:
+        """Hotels in ``city_code``, loading them with ``loader`` only when missing or expired"""
+        city_code = city_code.strip().upper()
+        entry = self._cities.get(city_code)
+        age = time.time() - entry['fetched_at'] if entry else None
+
+        if entry is not None and age < self.max_age:
+            self.hits += 1
+            if age >= self.refresh_after and city_code not in self._loading:
+                task = asyncio.create_task(self._refresh_in_background(city_code, loader))
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+            return entry['hotels']
+
+        self.misses += 1
+        return await self._refresh(city_code, loader)
+
+    async def _refresh(self, city_code: str, loader: HotelLoader) -> List[Dict[str, Any]]:
+        pending = self._loading.get(city_code)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[city_code] = future
+        try:
+            hotels = await loader()
+            hotels = sorted(
+                (h for h in hotels if h.get('hotelId')),
+                key=lambda h: h['distance_km'] if h.get('distance_km') is not None else float('inf'),
+            )[:HOTEL_DIRECTORY_MAX_PER_CITY]
+            if hotels:
+                self._store(city_code, hotels)
+                await self.flush()
+            future.set_result(hotels)
+            return hotels
+        except BaseException as e:
+            future.set_exception(RuntimeError(f"hotel list for {city_code} failed: {e}"))
+            future.exception()
+            raise
+        finally:
+            self._loading.pop(city_code, None)
+
+    async def _refresh_in_background(self, city_code: str, loader: HotelLoader):
+        try:
+            await self._refresh(city_code, loader)
+            self.refreshes += 1
+        except Exception as e:
+            log.warning("⚠️ Background refresh of hotels in %s failed: %s", city_code, e)
+
+    def _store(self, city_code: str, hotels: List[Dict[str, Any]]):
+        # Keep offer statistics for hotels that are still listed
+        old_stats = self._cities.get(city_code, {}).get('offer_stats', {})
+        listed = {h['hotelId'] for h in hotels}
+        self._cities[city_code] = {
+            'fetched_at': time.time(),
+            'hotels': hotels,
+            'offer_stats': {hid: s for hid, s in old_stats.items() if hid in listed},
+        }
+        self._dirty = True
+
+    def select_hotel_ids(self, city_code: str, limit: int) -> List[str]:
+        """Pick up to ``limit`` hotels to query for offers.
+
+        Hotels that returned offers before come first, then the ones never
+        tried, then those that keep coming back empty; ties are broken by
+        distance. The first pass takes one hotel per chain for variety.
+        """
+        entry = self._cities.get(city_code.strip().upper())
+        if not entry:
+            return []
+        stats = entry.get('offer_stats', {})
+
+        def rank(item):
+            position, hotel = item
+            hit, miss = stats.get(hotel['hotelId'], (0, 0))
+            return (-(hit + 1) / (hit + miss + 2), position)
+
+        ranked = [hotel for _, hotel in sorted(enumerate(entry['hotels']), key=rank)]
+        chosen, seen_chains = [], set()
+        for hotel in ranked:
+            chain = hotel.get('chainCode')
+            if chain:
+                if chain in seen_chains:
+                    continue
+                seen_chains.add(chain)
+            chosen.append(hotel['hotelId'])
+            if len(chosen) == limit:
+                return chosen
+        for hotel in ranked:
+            if hotel['hotelId'] not in chosen:
+                chosen.append(hotel['hotelId'])
+                if len(chosen) == limit:
+                    break
+        return chosen
+
+    def record_offers(self, city_code: str, queried_ids: List[str], offered_ids: List[str]):
+        """Remember which of the queried hotels came back with offers"""
+        entry = self._cities.get(city_code.strip().upper())
+        if not entry:
+            return
+        stats = entry.setdefault('offer_stats', {})
+        offered = set(offered_ids)
+        for hotel_id in queried_ids:
+            hit, miss = stats.get(hotel_id, (0, 0))
+            stats[hotel_id] = (hit + 1, miss) if hotel_id in offered else (hit, miss + 1)
+        self._dirty = True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cities": len(self._cities),
+            "hits": self.hits,
+            "misses": self.misses,
+            "background_refreshes": self.refreshes,
+        }
+
+
+hotel_directory = HotelDirectory()
@@ -0,0 +1,251 @@
+"""Shared pooled HTTP transport for outbound provider calls.
+
+The Amadeus SDK opens a new urllib connection (and TLS handshake) for every
+request. ``http_pool`` keeps one httpx connection pool per process instead:
+connections stay alive between searches, HTTP/2 is used when the ``h2``
+package is installed, and the pool size is configurable.
+
+- ``http_pool.urllib_opener`` plugs into ``amadeus.Client(http=...)`` (see
+  clients.py), so token requests and searches share the pool;
+- ``http_pool.requests_session()`` gives requests-based SDKs such as
+  googlemaps (``googlemaps.Client(requests_session=...)``) the same pool;
+- ``await http_pool.arequest(...)`` is the native async entry point.
+
+``stats()`` reports requests, newly opened connections and TLS handshakes
+(a low ``new_connection_ratio`` means keep-alive is working), in-flight
+requests and the pool's idle/active connections.
+"""
+import importlib.util
+import os
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Optional
+from urllib.error import URLError
+
+import httpx
+
+HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "20"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+# HTTP/2 needs the optional h2 package (pip install "httpx[http2]")
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") == "1" and importlib.util.find_spec("h2") is not None
+
+
+class UrllibResponse:
+    """The parts of urllib's HTTPResponse the Amadeus SDK reads (status, headers, body)."""
+
+    def __init__(self, response: httpx.Response):
+        self.status = self.code = response.status_code
+        self.headers = response.headers
+        self._body = response.content
+
+    def info(self):
+        return self.headers
+
+    def read(self) -> bytes:
+        return self._body
+
+
+class HttpPool:
+    """One keep-alive connection pool (sync and async clients) with usage counters."""
+
+    def __init__(self, max_connections: int = HTTP_POOL_MAX_CONNECTIONS,
+                 max_keepalive: int = HTTP_POOL_MAX_KEEPALIVE,
+                 keepalive_expiry: float = HTTP_KEEPALIVE_EXPIRY, http2: bool = HTTP2_ENABLED):
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive,
+                                   keepalive_expiry=keepalive_expiry)
+        self.timeout = httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        self.http2 = http2
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.max_inflight = 0
+        self.requests = 0
+        self.failures = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self.by_host: Dict[str, int] = defaultdict(int)
+        self.by_version: Dict[str, int] = defaultdict(int)
+
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(limits=self.limits, timeout=self.timeout, http2=self.http2)
+        return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None or self._async_client.is_closed:
+            self._async_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout, http2=self.http2)
+        return self._async_client
+
+    # --- counters ---
+
+    def _started(self, url: str):
+        with self._lock:
+            self.inflight += 1
+            self.max_inflight = max(self.max_inflight, self.inflight)
+            self.requests += 1
+            self.by_host[httpx.URL(url).host] += 1
+
+    def _finished(self, response: Optional[httpx.Response]):
+        with self._lock:
+            self.inflight -= 1
+            if response is None:
+                self.failures += 1
+            else:
+                self.by_version[response.http_version] += 1
+
+    def _on_trace(self, event: str, info: Dict[str, Any]):
+        if event == "connection.connect_tcp.complete":
+            with self._lock:
+                self.connections_opened += 1
+        elif event == "connection.start_tls.complete":
+            with self._lock:
+                self.tls_handshakes += 1
+
+    async def _on_trace_async(self, event: str, info: Dict[str, Any]):
+        self._on_trace(event, info)
+
+    # --- requests ---
+
+    def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Blocking request through the shared pool (for SDK calls in the provider thread pool)"""
+        self._started(url)
+        response = None
+        try:
+            response = self.client.request(method, url, extensions={"trace": self._on_trace}, **kwargs)
+            return response
+        finally:
+            self._finished(response)
+
+    async def arequest(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Async request through the shared pool's async client"""
+        self._started(url)
+        response = None
+        try:
+            response = await self.async_client.request(method, url, extensions={"trace": self._on_trace_async},
+                                                       **kwargs)
+            return response
+        finally:
+            self._finished(response)
+
+    def urllib_opener(self, request, timeout: Optional[float] = None) -> UrllibResponse:
+        """Drop-in for ``urllib.request.urlopen`` as used by ``amadeus.Client(http=...)``
+
+        Connection errors are raised as URLError so the SDK reports them as
+        NetworkError, exactly as with its default transport. ``timeout``
+        overrides the pool's read timeout (and caps its connect timeout).
+        """
+        options = {}
+        if timeout is not None:
+            options["timeout"] = httpx.Timeout(timeout, connect=min(HTTP_CONNECT_TIMEOUT, timeout))
+        try:
+            response = self.request(request.get_method(), request.full_url,
+                                    headers=dict(request.header_items()), content=request.data, **options)
+        except httpx.TransportError as e:
+            raise URLError(e) from e
+        return UrllibResponse(response)
+
+    def requests_session(self):
+        """A requests.Session whose requests go through this pool"""
+        import requests
+        session = requests.Session()
+        adapter = PooledRequestsAdapter(self)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    # --- lifecycle / stats ---
+
+    def _pool_connections(self, client) -> Dict[str, int]:
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", None) or [])
+        idle = sum(1 for c in connections if c.is_idle())
+        return {"open": len(connections), "idle": idle, "active": len(connections) - idle}
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self):
+        self.close()
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def stats(self) -> Dict[str, Any]:
+        pools = {}
+        if self._client is not None:
+            pools["sync"] = self._pool_connections(self._client)
+        if self._async_client is not None and not self._async_client.is_closed:
+            pools["async"] = self._pool_connections(self._async_client)
+        return {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive": self.limits.max_keepalive_connections,
+            "requests": self.requests,
+            "failures": self.failures,
+            "inflight": self.inflight,
+            "max_inflight": self.max_inflight,
+            "connections_opened": self.connections_opened,
+            "tls_handshakes": self.tls_handshakes,
+            "new_connection_ratio": round(self.connections_opened / self.requests, 3) if self.requests else 0.0,
+            "connections": pools,
+            "by_host": dict(self.by_host),
+            "by_http_version": dict(self.by_version),
+        }
+
+
+def _requests_adapter_base():
+    try:
+        from requests.adapters import BaseAdapter
+    except ImportError:  # requests only comes with googlemaps
+        return object
+    return BaseAdapter
+
+
+class PooledRequestsAdapter(_requests_adapter_base()):
+    """requests transport adapter that sends through an HttpPool instead of urllib3."""
+
+    def __init__(self, pool: HttpPool):
+        super().__init__()
+        self.pool = pool
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        import requests
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        elif timeout is not None:
+            timeout = httpx.Timeout(timeout)
+        else:
+            timeout = self.pool.timeout
+        try:
+            pooled = self.pool.request(request.method, request.url, headers=dict(request.headers),
+                                       content=request.body, timeout=timeout)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(e, request=request) from e
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e, request=request) from e
+        response = requests.Response()
+        response.status_code = pooled.status_code
+        response.headers = requests.structures.CaseInsensitiveDict(pooled.headers)
+        response._content = pooled.content
+        response.encoding = pooled.encoding
+        response.reason = pooled.reason_phrase
+        response.url = str(pooled.url)
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+http_pool = HttpPool()
@@ -0,0 +1,388 @@
+"""Deterministic fast path for intent analysis.
+
+Greetings and well-structured search requests ("หาเที่ยวบิน BKK ไป NRT
+วันที่ 25 ธ.ค.", "hotel in Tokyo 10-15 Dec") are turned into the same
+``{"plan": [...]}`` structure the Gemini analysis prompt returns, without an
+LLM round trip. ``parse_intent`` returns ``None`` whenever the message is
+ambiguous, incomplete or negated ("no hotel"), and the caller falls back to
+Gemini.
+"""
+import re
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from airports import airport_index
+
+# Upper-case three-letter words never read as locations, even if airports.csv lists the code
+NOT_IATA = {"USD", "EUR", "THB", "JPY", "GBP", "SGD", "HKD", "AUD", "KRW", "CNY", "AND", "THE", "FOR"}
+
+TOOL_KEYWORDS = {
+    "search_flights": ["เที่ยวบิน", "ตั๋วเครื่องบิน", "เครื่องบิน", "บินไป", "บินจาก", "flight", "fly", "airfare", "plane ticket"],
+    "search_hotels": ["โรงแรม", "ที่พัก", "รีสอร์ท", "hotel", "accommodation", "resort"],
+    "search_car_rentals": ["รถเช่า", "เช่ารถ", "car rental", "rental car", "rent a car", "hire car"],
+}
+
+GREETING_RE = re.compile(
+    r"^(?:(?:สวัสดี|หวัดดี|ดีจ้า|ขอบคุณ|hello|hi|hey|thanks|thank you|good (?:morning|afternoon|evening))"
+    r"(?:\s*(?:ครับ|คับ|ค่ะ|คะ|ค่า|จ้า|จ้ะ|นะ|there|everyone))*\s*)+$"
+)
+
+THAI_MONTHS = {
+    "ม.ค.": 1, "มกราคม": 1, "ก.พ.": 2, "กุมภาพันธ์": 2, "มี.ค.": 3, "มีนาคม": 3,
+    "เม.ย.": 4, "เมษายน": 4, "พ.ค.": 5, "พฤษภาคม": 5, "มิ.ย.": 6, "มิถุนายน": 6,
+    "ก.ค.": 7, "กรกฎาคม": 7, "ส.ค.": 8, "สิงหาคม": 8, "ก.ย.": 9, "กันยายน": 9,
+    "ต.ค.": 10, "ตุลาคม": 10, "พ.ย.": 11, "พฤศจิกายน": 11, "ธ.ค.": 12, "ธันวาคม": 12,
+}
+EN_MONTHS = {
+    name: number
+    for number, names in enumerate([
+        ("jan", "january"), ("feb", "february"), ("mar", "march"), ("apr", "april"),
+        ("may",), ("jun", "june"), ("jul", "july"), ("aug", "august"),
+        ("sep", "sept", "september"), ("oct", "october"), ("nov", "november"), ("dec", "december"),
+    ], start=1)
+    for name in names
+}
+
+_thai_month = "|".join(re.escape(m) for m in sorted(THAI_MONTHS, key=len, reverse=True))
+_en_month = "|".join(sorted(EN_MONTHS, key=len, reverse=True))
+_range = r"(?:\s*(?:-|–|ถึง|to|until)\s*(\d{1,2}))?"
+
+ISO_DATE_RE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})")
+SLASH_DATE_RE = re.compile(r"(?<!\d)(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?(?!\d)")
+THAI_DATE_RE = re.compile(r"(?<!\d)(\d{1,2})" + _range + r"\s*(" + _thai_month + r")\s*(\d{4})?")
+EN_DAY_MONTH_RE = re.compile(
+    r"(?<!\d)(\d{1,2})(?:st|nd|rd|th)?" + _range + r"\s+(" + _en_month + r")\b\.?,?\s*(\d{4})?"
+)
+EN_MONTH_DAY_RE = re.compile(
+    r"\b(" + _en_month + r")\.?\s+(\d{1,2})(?:st|nd|rd|th)?(?:\s*(?:-|–|to|until)\s*(\d{1,2}))?\b,?\s*(\d{4})?"
+)
+RELATIVE_DAYS = [("มะรืนนี้", 2), ("มะรืน", 2), ("พรุ่งนี้", 1), ("วันนี้", 0),
+                 ("day after tomorrow", 2), ("tomorrow", 1), ("today", 0)]
+
+# "cheapest day" requests become a flexible-date flight search over a window
+FLEXIBLE_KEYWORDS = ["ถูกสุด", "ถูกที่สุด", "วันไหนถูก", "cheapest", "flexible date", "flexible dates"]
+# phrase -> (weeks from the current week, start today instead of Monday)
+WINDOW_PHRASES = [("สัปดาห์หน้า", 1), ("อาทิตย์หน้า", 1), ("next week", 1),
+                  ("สัปดาห์นี้", 0), ("อาทิตย์นี้", 0), ("this week", 0)]
+TRIP_DAYS_RE = re.compile(r"(?<!\d)(\d{1,2})\s*(?:วัน|คืน|days?|nights?)(?![a-z])")
+STAY_NIGHTS_RE = re.compile(r"(?<!\d)(\d{1,2})\s*(?:คืน|nights?)(?![a-z])")
+
+ORIGIN_MARKERS = ("จาก", "from")
+DESTINATION_MARKERS = ("ไป", "ถึง", "to", "-", "→")
+NEGATION_RE = re.compile(r"ไม่|(?<![a-z])(?:not|no|don'?t|doesn'?t|without|never)(?![a-z])|n't(?![a-z])")
+
+
+def is_greeting(message: str) -> bool:
+    text = re.sub(r"[^\w\s฀-๿]", " ", message.lower())
+    text = re.sub(r"\s+", " ", text).strip()
+    return bool(text) and GREETING_RE.match(text) is not None
+
+
+def _make_date(year: Optional[str], month: int, day: int, today: date) -> Optional[date]:
+    """Build a date; without a year pick the next occurrence from today"""
+    try:
+        if year:
+            y = int(year)
+            if y < 100:
+                y += 2000
+            elif y > 2400:  # Buddhist Era (พ.ศ.)
+                y -= 543
+            return date(y, month, day)
+        candidate = date(today.year, month, day)
+        if candidate < today:
+            candidate = date(today.year + 1, month, day)
+        return candidate
+    except ValueError:
+        return None
+
+
+def extract_dates(message: str, today: date) -> Optional[List[Tuple[int, date]]]:
+    """All dates in the message as (position, date), or None if one is invalid"""
+    lowered = message.lower()
+    found: List[Tuple[int, int, date]] = []
+
+    def add(start: int, end: int, value: Optional[date]) -> bool:
+        if any(start < e and s < end for s, e, _ in found):
+            return True  # already covered by a higher-priority pattern
+        if value is None:
+            return False
+        found.append((start, end, value))
+        return True
+
+    for m in ISO_DATE_RE.finditer(message):
+        if not add(m.start(), m.end(), _make_date(m.group(1), int(m.group(2)), int(m.group(3)), today)):
+            return None
+    for m in THAI_DATE_RE.finditer(message):
+        month = THAI_MONTHS[m.group(3)]
+        first = _make_date(m.group(4), month, int(m.group(1)), today)
+        if not add(m.start(), m.end(), first):
+            return None
+        if m.group(2):
+            found.append((m.end(), m.end(), _make_date(m.group(4), month, int(m.group(2)), today)))
+    for regex, day_group, month_group in ((EN_DAY_MONTH_RE, 1, 3), (EN_MONTH_DAY_RE, 2, 1)):
+        for m in regex.finditer(lowered):
+            month = EN_MONTHS[m.group(month_group)]
+            range_group = 2 if regex is EN_DAY_MONTH_RE else 3
+            if not add(m.start(), m.end(), _make_date(m.group(4), month, int(m.group(day_group)), today)):
+                return None
+            if m.group(range_group):
+                found.append((m.end(), m.end(), _make_date(m.group(4), month, int(m.group(range_group)), today)))
+    for m in SLASH_DATE_RE.finditer(message):
+        if not add(m.start(), m.end(), _make_date(m.group(3), int(m.group(2)), int(m.group(1)), today)):
+            return None
+    for word, offset in RELATIVE_DAYS:
+        for m in re.finditer(re.escape(word), lowered):
+            add(m.start(), m.end(), today + timedelta(days=offset))
+
+    if any(value is None for _, _, value in found):
+        return None
+    return [(start, value) for start, _, value in sorted(found, key=lambda f: f[0])]
+
+
+def is_flexible(message: str) -> bool:
+    lowered = message.lower()
+    return any(_contains(lowered, k) for k in FLEXIBLE_KEYWORDS)
+
+
+def extract_window(message: str, today: date) -> Optional[Tuple[date, date]]:
+    """Departure window named by a phrase like "สัปดาห์หน้า" (Monday-Sunday, from today at the earliest)"""
+    lowered = message.lower()
+    for phrase, weeks in WINDOW_PHRASES:
+        if phrase in lowered:
+            monday = today - timedelta(days=today.weekday()) + timedelta(weeks=weeks)
+            return max(monday, today), monday + timedelta(days=6)
+    return None
+
+
+def extract_trip_days(message: str) -> Optional[int]:
+    m = TRIP_DAYS_RE.search(message.lower())
+    return int(m.group(1)) if m and 0 < int(m.group(1)) <= 60 else None
+
+
+def extract_stay_nights(message: str) -> Optional[int]:
+    m = STAY_NIGHTS_RE.search(message.lower())
+    return int(m.group(1)) if m and 0 < int(m.group(1)) <= 60 else None
+
+
+def extract_places(message: str) -> List[Tuple[int, int, str, str]]:
+    """Place mentions as (start, end, code for flights, city code), in message order"""
+    mentions = []
+    for m in re.finditer(r"(?<![A-Za-z])[A-Z]{3}(?![A-Za-z])", message):
+        code = m.group(0)
+        # only codes in airports.csv: any other upper-case word ("USA", "VIP") is not a place
+        if code not in NOT_IATA and airport_index.is_valid_code(code):
+            mentions.append((m.start(), m.end(), code, airport_index.city_of(code)))
+    for start, end, place in airport_index.find_mentions(message):
+        mentions.append((start, end, place.airport, place.city))
+    mentions.sort()
+    # Drop mentions nested in a longer one ("nyc" inside "NYC" twice, etc.)
+    result = []
+    for mention in mentions:
+        if result and mention[0] < result[-1][1]:
+            continue
+        result.append(mention)
+    return result
+
+
+def _has_marker(message: str, position: int, markers) -> bool:
+    before = message[max(0, position - 8):position].lower().rstrip()
+    return any(before.endswith(marker) for marker in markers)
+
+
+def place_role(message: str, position: int) -> str:
+    """"origin" / "destination" when a direction marker ("from", "ไป", ...) precedes the place, else "" """
+    if _has_marker(message, position, ORIGIN_MARKERS):
+        return "origin"
+    if _has_marker(message, position, DESTINATION_MARKERS):
+        return "destination"
+    return ""
+
+
+def is_negated(message: str) -> bool:
+    """The message says what the user does *not* want ("ไม่เอาโรงแรม", "no hotel")"""
+    return NEGATION_RE.search(message.lower()) is not None
+
+
+def _contains(lowered: str, keyword: str) -> bool:
+    if keyword.isascii():
+        return re.search(r"(?<![a-z])" + re.escape(keyword) + r"s?(?![a-z])", lowered) is not None
+    return keyword in lowered
+
+
+def detect_tools(message: str) -> set:
+    lowered = message.lower()
+    return {
+        tool for tool, keywords in TOOL_KEYWORDS.items()
+        if any(_contains(lowered, k) for k in keywords)
+    }
+
+
+def parse_intent(message: str, today: Optional[date] = None,
+                 context: Optional[Dict[str, str]] = None) -> Optional[Dict[str, Any]]:
+    """Return a plan for ``message``, or None when Gemini should decide.
+
+    ``context`` holds trip slots from earlier turns (origin, destination,
+    city, start_date, end_date); they fill in whatever a follow-up message
+    such as "แล้วโรงแรมล่ะ" leaves out.
+    """
+    today = today or date.today()
+    context = context or {}
+    if is_greeting(message):
+        return {"plan": []}
+
+    tools = detect_tools(message)
+    if not tools or is_negated(message):
+        return None
+    dates = extract_dates(message, today)
+    if dates is None or len(dates) > 2:
+        return None
+    window = None
+    if "search_flights" in tools and is_flexible(message):
+        if tools != {"search_flights"}:
+            return None
+        window = extract_window(message, today)
+        if window is not None:
+            # an explicit date next to a window phrase is the return date
+            if len(dates) > 1 or (dates and dates[0][1] <= window[0]):
+                return None
+            start, end = window[0].isoformat(), dates[0][1].isoformat() if dates else None
+        elif len(dates) == 2:
+            if dates[1][1] <= dates[0][1]:
+                return None
+            window = (dates[0][1], dates[1][1])
+            start, end = window[0].isoformat(), None
+        else:
+            return None
+    elif dates:
+        start = dates[0][1].isoformat()
+        end = dates[1][1].isoformat() if len(dates) > 1 else None
+    elif context.get("start_date"):
+        start, end = context["start_date"], context.get("end_date")
+    else:
+        return None
+    if window is None and TRIP_DAYS_RE.search(message.lower()):
+        # "3 nights" fixes the end date; "5 days" leaves the number of nights to Gemini
+        nights = extract_stay_nights(message)
+        if nights is None:
+            return None
+        stay_end = (date.fromisoformat(start) + timedelta(days=nights)).isoformat()
+        if end and end != stay_end:
+            return None
+        end = stay_end
+    if end and end <= start:
+        return None
+
+    places = extract_places(message)
+    cities = []
+    for mention in places:
+        if mention[3] not in [m[3] for m in cities]:
+            cities.append(mention)
+    if len(cities) > 2:
+        return None
+    plan = []
+
+    if "search_flights" in tools:
+        if len(cities) == 2:
+            first, second = cities
+            if _has_marker(message, first[0], DESTINATION_MARKERS) and _has_marker(message, second[0], ORIGIN_MARKERS):
+                first, second = second, first
+            origin, destination = first[2], second[2]
+        elif len(cities) == 1:
+            only = cities[0]
+            if _has_marker(message, only[0], ORIGIN_MARKERS):
+                origin, destination = only[2], context.get("destination")
+            else:
+                origin, destination = context.get("origin"), only[2]
+        else:
+            origin, destination = context.get("origin"), context.get("destination")
+        if not origin or not destination or origin == destination:
+            return None
+        flight = {
+            "tool": "search_flights",
+            "origin": origin,
+            "destination": destination,
+            "departure_date": start,
+        }
+        if window is not None:
+            del flight["departure_date"]
+            flight["departure_date_from"] = window[0].isoformat()
+            flight["departure_date_to"] = window[1].isoformat()
+            trip_days = extract_trip_days(message)
+            if trip_days and not end:
+                flight["trip_days"] = trip_days
+        if end:
+            flight["return_date"] = end
+        plan.append(flight)
+        stay_city = airport_index.city_of(destination) or destination
+    elif len(cities) == 1:
+        stay_city = cities[0][3]
+    elif not cities and context.get("city"):
+        stay_city = context["city"]
+    else:
+        return None
+
+    if "search_hotels" in tools:
+        hotel = {"tool": "search_hotels", "city": stay_city, "check_in_date": start}
+        if end:
+            hotel["check_out_date"] = end
+        plan.append(hotel)
+    if "search_car_rentals" in tools:
+        car = {"tool": "search_car_rentals", "city": stay_city, "pick_up_date": start}
+        if end:
+            car["drop_off_date"] = end
+        plan.append(car)
+    return {"plan": plan}
+
+
+# tool -> (field, "airport" for flight endpoints or "city" for stays)
+PLACE_FIELDS = {
+    "search_flights": (("origin", "airport"), ("destination", "airport")),
+    "search_hotels": (("city", "city"),),
+    "search_car_rentals": (("city", "city"),),
+}
+NEEDS_INFO_KIND = {"search_flights": "flight", "search_hotels": "hotel", "search_car_rentals": "car"}
+
+
+def resolve_plan_places(intent_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn the place names in a Gemini plan into validated codes.
+
+    Known codes are kept (a city code such as TYO is valid for flights too),
+    names and near-miss spellings are resolved through airports.csv, and
+    well-formed codes missing from the dataset are passed through. A step
+    whose place cannot be resolved is dropped; if that empties the plan the
+    result asks the user for the missing place instead of searching for it.
+    """
+    plan = intent_data.get("plan") if isinstance(intent_data, dict) else None
+    if not isinstance(plan, list):
+        return intent_data
+    resolved, missing, kind = [], [], None
+    for step in plan:
+        if not isinstance(step, dict):
+            continue
+        step = dict(step)
+        unresolved = []
+        for field, role in PLACE_FIELDS.get(step.get("tool"), ()):
+            value = step.get(field)
+            if not isinstance(value, str) or not value.strip():
+                continue
+            value = value.strip()
+            code = value.upper()
+            if value.isascii() and len(code) == 3 and code.isalpha() and (
+                    airport_index.is_valid_code(code) or airport_index.resolve(value) is None):
+                step[field] = (airport_index.city_of(code) or code) if role == "city" else code
+                continue
+            place = airport_index.resolve(value)
+            if place is None:
+                unresolved.append(field)
+            else:
+                step[field] = place.city if role == "city" else place.airport
+        if unresolved:
+            missing.extend(f for f in unresolved if f not in missing)
+            kind = kind or NEEDS_INFO_KIND.get(step.get("tool"))
+            continue
+        resolved.append(step)
+    result = dict(intent_data, plan=resolved)
+    if missing and not resolved:
+        result["needs_more_info"] = kind or "general"
+        result["missing"] = missing
+    return result
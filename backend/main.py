@@ -1,18 +1,94 @@
-from fastapi import FastAPI, HTTPException
+import time
+IMPORT_STARTED = time.perf_counter()  # วัด cold-start ของ worker ตั้งแต่เริ่ม import
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from dotenv import load_dotenv
 import os
-import google.generativeai as genai
-from amadeus import Client, ResponseError
+from amadeus import ResponseError, NetworkError, ServerError
 import re
+import math
 import json
+import orjson
+import asyncio
 from datetime import datetime, date, timedelta
+from providers import provider_executor, run_gemini, run_amadeus
+from planner import execute_plan
+from cache import result_cache
+from hotel_directory import hotel_directory, compact_hotel
+from intent_parser import parse_intent, resolve_plan_places
+from airports import airport_index
+from results import CarOffer, FlightOffer, HotelResult, RESULT_MAX_PAGE_SIZE, RESULT_PAGE_SIZE, decode_cursor, result_store
+from plan_cache import depends_on_context, plan_cache
+from sessions import SessionRecord, session_store
+from flexible_search import date_pairs, flexible_search, flex_rate_limiter
+from telemetry import REQUEST_LATENCY, log, register_collector, render_metrics, span, trace_stats
+import telemetry
+import resilience
+from resilience import CircuitOpenError, breaker_states, is_transient
+from admission import ADMISSION_REQUEST_DEADLINE, Overloaded, ProviderThrottledError, admission, provider_deadline, provider_limiter
+from prefetch import PREFETCH_ENABLED, prefetcher
+from batch import BATCH_CONCURRENCY, BATCH_MAX_ITEMS, SharedTasks, batch_jobs, dedupe_key, run_batch
 
 load_dotenv()
+from clients import STARTUP_PREWARM, StartupTimer, provider_clients  # อ่าน FAKE_PROVIDERS / STARTUP_PREWARM หลังโหลด .env
+from http_pool import http_pool
+
+startup_timer = StartupTimer(IMPORT_STARTED)
+shutting_down = False
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Gemini / Amadeus ถูกสร้างตอนใช้งานครั้งแรก (ดู clients.py) หรือ pre-warm เบื้องหลังเมื่อ STARTUP_PREWARM=1
+    global shutting_down
+    started = time.perf_counter()
+    prewarm_task = None
+    if STARTUP_PREWARM:
+        prewarm_task = asyncio.create_task(provider_clients.prewarm())
+        prewarm_task.add_done_callback(lambda _: startup_timer.ready())
+    else:
+        startup_timer.ready()
+    # cache warming ของเส้นทาง/เมืองยอดนิยม (ดู prefetch.py)
+    prefetch_task = asyncio.create_task(prefetcher.run()) if PREFETCH_ENABLED else None
+    startup_timer.started(started)
+    try:
+        yield
+    finally:
+        shutting_down = True
+        for task in (prewarm_task, prefetch_task):
+            if task is not None:
+                task.cancel()
+        # request ที่ค้างอยู่จบไปแล้ว (uvicorn รอให้ก่อน); รอ batch job และ provider call ที่ยังทำงาน
+        # (เช่น ของ request ที่ถูกยกเลิก) ให้เสร็จก่อนปิด thread pool และ HTTP connection
+        drain_started = time.monotonic()
+        drained = await batch_jobs.drain(SHUTDOWN_DRAIN_TIMEOUT)
+        remaining = max(0.0, SHUTDOWN_DRAIN_TIMEOUT - (time.monotonic() - drain_started))
+        drained = await provider_executor.drain(remaining) and drained
+        if drained:
+            log.info("👋 Worker %s drained in %.0f ms", startup_timer.pid, (time.monotonic() - drain_started) * 1000)
+        else:
+            log.warning("⚠️ Worker %s shutdown drain timed out: %d provider calls abandoned",
+                        startup_timer.pid, provider_executor.inflight())
+        await hotel_directory.flush()
+        provider_executor.shutdown(wait=False)
+        await http_pool.aclose()
+        telemetry.shutdown()
+
+app = FastAPI(title="AI Travel Agent API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
-app = FastAPI(title="AI Travel Agent API")
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    """Admission control ตัด request ทิ้ง → 429 พร้อม Retry-After แทนการรอคิวยาว"""
+    return ORJSONResponse(
+        {"detail": str(exc), "reason": exc.reason, "retry_after": round(exc.retry_after, 1)},
+        status_code=429,
+        headers={"Retry-After": str(math.ceil(exc.retry_after))}
+    )
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,20 +96,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
-# Initialize APIs
-print("🚀 Initializing Gemini...")
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-gemini_model = genai.GenerativeModel('models/gemini-flash-latest') # (โมเดลที่ถูกต้อง)
-print("✅ Gemini initialized")
+# จำนวนโรงแรมที่ส่งไปขอราคาต่อการค้นหา (หลายโรงแรมไม่มีห้องว่าง จึงขอมากกว่าที่แสดง)
+HOTEL_OFFER_CANDIDATES = int(os.getenv("HOTEL_OFFER_CANDIDATES", "10"))
+# จำนวน flight offers ที่ขอจาก Amadeus ต่อการค้นหา (เก็บไว้ทั้งหมดใน result_store แล้วแบ่งหน้าให้ client)
+FLIGHT_MAX_OFFERS = int(os.getenv("FLIGHT_MAX_OFFERS", "50"))
+# ข้อความที่ parse ได้ด้วย rules (ทักทาย, IATA code, ชื่อเมือง + วันที่) ไม่ต้องเรียก Gemini เพื่อวางแผน
+FAST_INTENT_PARSER = os.getenv("FAST_INTENT_PARSER", "1") == "1"
+# REPLY_MODE=template: วางแผนด้วย Gemini แบบ deterministic (temperature 0) แล้วตอบผลค้นหาด้วย template
+# เรียก Gemini เขียนคำตอบเฉพาะบทสนทนาทั่วไป (ค่าเริ่มต้น "llm" = เรียก Gemini ทุกครั้งเหมือนเดิม)
+REPLY_MODE = os.getenv("REPLY_MODE", "llm")
+PLAN_GENERATION_CONFIG = {"temperature": 0, "max_output_tokens": 1024}
 
-print("🚀 Initializing Amadeus...")
-amadeus = Client(
-    client_id=os.getenv("AMADEUS_API_KEY"),
-    client_secret=os.getenv("AMADEUS_API_SECRET")
-)
-print("✅ Amadeus initialized")
+# ตอนปิด worker: uvicorn รอ request ที่ค้างอยู่ไม่เกิน SHUTDOWN_GRACE_PERIOD วินาที
+# แล้ว lifespan รอ batch job / provider call ที่ยังทำงานอีกไม่เกิน SHUTDOWN_DRAIN_TIMEOUT วินาที
+SHUTDOWN_GRACE_PERIOD = float(os.getenv("SHUTDOWN_GRACE_PERIOD", "30"))
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "20"))
+
+# จำนวนข้อความจาก conversation_history ที่ใช้ตั้งต้น session ใหม่
+SESSION_SEED_TURNS = 10
+
+MISSING_INFO_LABELS = {
+    "origin": "เมืองต้นทาง",
+    "destination": "ปลายทาง",
+    "date": "วันที่เดินทาง",
+    "city": "เมือง",
+}
 
 # System Prompt (เหมือนเดิม)
 SYSTEM_PROMPT = """คุณเป็นผู้ช่วยวางแผนการเดินทางและจองตั๋วที่เป็นมิตร ชื่อว่า "AI Travel Agent"
@@ -61,7 +151,24 @@ SYSTEM_PROMPT = """คุณเป็นผู้ช่วยวางแผน
 
 class ChatRequest(BaseModel):
     message: str
+    # ประวัติเก็บไว้ที่ server ตาม session_id; conversation_history ใช้ตั้งต้น session ใหม่เท่านั้น
+    session_id: Optional[str] = None
     conversation_history: Optional[List[Dict[str, str]]] = []
+    # ขนาดหน้าแรกของผลค้นหา และ field ที่ต้องการต่อประเภท เช่น {"flights": ["price", "currency", "segments"]}
+    page_size: Optional[int] = Field(None, ge=1)
+    fields: Optional[Dict[str, List[str]]] = None
+
+class BatchItem(BaseModel):
+    message: str
+    id: Optional[str] = None  # ค่าที่ partner ใช้จับคู่ผลลัพธ์ (ค่าเริ่มต้น = ลำดับใน items)
+    session_id: Optional[str] = None  # ไม่ระบุ = ไม่สร้าง session
+
+class BatchChatRequest(BaseModel):
+    items: List[BatchItem]
+    # "template" = Gemini ตอบเฉพาะข้อความที่ไม่มีผลค้นหา, "llm" = Gemini เขียนคำตอบทุกข้อความ
+    reply_mode: str = "template"
+    page_size: Optional[int] = Field(None, ge=1)
+    fields: Optional[Dict[str, List[str]]] = None
 
 class ChatResponse(BaseModel):
     response: str
@@ -69,138 +176,199 @@ class ChatResponse(BaseModel):
     travel_data: Optional[Dict[str, Any]] = None
     search_results: Optional[Dict[str, Any]] = None
 
-# (ฟังก์ชัน search_flights เหมือนเดิม)
-async def search_flights(origin: str, destination: str, departure_date: str):
-    """Search flights using Amadeus API"""
+def default_trip_dates(start: Optional[str], end: Optional[str]):
+    """Fill missing dates: start = 7 days from today, end = start + 2 days"""
+    if not start:
+        start = (date.today() + timedelta(days=7)).strftime('%Y-%m-%d')
+    if not end:
+        start_date = datetime.strptime(start, '%Y-%m-%d')
+        end = (start_date + timedelta(days=2)).strftime('%Y-%m-%d')
+    return start, end
+
+# --- Cached search: เรียก Amadeus เฉพาะเมื่อ query นี้ยังไม่อยู่ใน result_cache ---
+async def cached_search(tool: str, params: Dict[str, Any], fetch, refresh: bool = False):
+    """result_cache lookup ที่นับ query จริงของผู้ใช้ให้ prefetcher (refresh=True = prefetch เอง ไม่นับ)"""
+    if not refresh:
+        prefetcher.record(tool, params)
+    return await result_cache.get_or_fetch(tool, params, fetch, refresh=refresh)
+
+async def search_flights(origin: str, destination: str, departure_date: str,
+                         return_date: Optional[str] = None, rate_limited: bool = False, refresh: bool = False):
+    """Search flights, reusing cached results for the same query"""
+    if not departure_date:
+        departure_date = (date.today() + timedelta(days=7)).strftime('%Y-%m-%d')
+    
+    async def fetch():
+        if rate_limited:
+            # fan-out ของ flexible search: จำกัดอัตราเฉพาะตอนต้องเรียก Amadeus จริง (cache hit ไม่เสีย quota)
+            await flex_rate_limiter.acquire()
+        return await fetch_flights(origin, destination, departure_date, return_date)
+    
+    return await cached_search(
+        "flights",
+        {"origin": origin, "destination": destination, "departure_date": departure_date,
+         "return_date": return_date},
+        fetch,
+        refresh
+    )
+
+async def search_hotels(city_code: str, check_in: str, check_out: str, refresh: bool = False):
+    """Search hotels, reusing cached results for the same query"""
     try:
-        if not departure_date:
-            departure_date = (date.today() + timedelta(days=7)).strftime('%Y-%m-%d')
-        
-        print(f"✈️ Searching flights: {origin} → {destination} on {departure_date}")
+        check_in, check_out = default_trip_dates(check_in, check_out)
+    except ValueError as e:
+        log.warning("❌ Invalid hotel dates: %s", e)
+        return None
+    return await cached_search(
+        "hotels",
+        {"city_code": city_code, "check_in": check_in, "check_out": check_out},
+        lambda: fetch_hotels(city_code, check_in, check_out),
+        refresh
+    )
+
+async def search_car_rentals(city_code: str, pick_up_date: str, drop_off_date: str, refresh: bool = False):
+    """Search car rentals, reusing cached results for the same query"""
+    try:
+        pick_up_date, drop_off_date = default_trip_dates(pick_up_date, drop_off_date)
+    except ValueError as e:
+        log.warning("❌ Invalid car rental dates: %s", e)
+        return None
+    return await cached_search(
+        "cars",
+        {"city_code": city_code, "pick_up_date": pick_up_date, "drop_off_date": drop_off_date},
+        lambda: fetch_car_rentals(city_code, pick_up_date, drop_off_date),
+        refresh
+    )
+
+# Cache warming: prefetcher เรียกค้นหาซ้ำด้วย params เดียวกับ key ใน result_cache
+prefetcher.register("flights", lambda q: search_flights(q["origin"], q["destination"], q["departure_date"],
+                                                        q.get("return_date"), refresh=True))
+prefetcher.register("hotels", lambda q: search_hotels(q["city_code"], q["check_in"], q["check_out"], refresh=True))
+prefetcher.register("cars", lambda q: search_car_rentals(q["city_code"], q["pick_up_date"], q["drop_off_date"],
+                                                         refresh=True))
+
+# --- Upstream calls: timeout, retry (เฉพาะ search ที่ idempotent) และ circuit breaker ต่อ endpoint ---
+def is_amadeus_transient(exc: BaseException) -> bool:
+    """Amadeus SDK reports connection problems as NetworkError and 5xx as ServerError"""
+    return isinstance(exc, (NetworkError, ServerError)) or is_transient(exc)
+
+async def amadeus_call(endpoint: str, fn, **params):
+    return await resilience.call(
+        "amadeus", endpoint,
+        lambda: run_amadeus(fn, **params),
+        idempotent=True,
+        retry_on=is_amadeus_transient
+    )
+
+async def gemini_call(endpoint: str, *args, **kwargs):
+    # การ generate ไม่ retry อัตโนมัติ (GEMINI_RETRIES=0) เพราะผู้ใช้รอคำตอบอยู่
+    return await resilience.call(
+        "gemini", endpoint,
+        lambda: run_gemini(provider_clients.gemini_model.generate_content, *args, **kwargs),
+        idempotent=True
+    )
+
+# (ฟังก์ชัน fetch_flights เหมือนเดิม)
+async def fetch_flights(origin: str, destination: str, departure_date: str, return_date: Optional[str] = None):
+    """Search flights using Amadeus API (round trip when return_date is given)"""
+    try:
+        log.debug("✈️ Searching flights: %s → %s on %s (return %s)", origin, destination, departure_date, return_date)
         
-        response = amadeus.shopping.flight_offers_search.get(
+        params = dict(
             originLocationCode=origin,
             destinationLocationCode=destination,
             departureDate=departure_date,
             adults=1,
-            max=5
+            max=FLIGHT_MAX_OFFERS
         )
+        if return_date:
+            params["returnDate"] = return_date
+        response = await amadeus_call("flight_offers", provider_clients.amadeus.shopping.flight_offers_search.get, **params)
         
-        flights = []
-        for offer in response.data[:5]:
-            flight = {
-                'price': f"{offer['price']['total']} {offer['price']['currency']}",
-                'segments': []
-            }
-            
-            for itinerary in offer['itineraries']:
-                for segment in itinerary['segments']:
-                    flight['segments'].append({
-                        'departure': {
-                            'airport': segment['departure']['iataCode'],
-                            'time': segment['departure']['at']
-                        },
-                        'arrival': {
-                            'airport': segment['arrival']['iataCode'],
-                            'time': segment['arrival']['at']
-                        },
-                        'airline': segment['carrierCode'],
-                        'duration': segment['duration']
-                    })
-            
-            flights.append(flight)
+        # เก็บเป็น dict (model_dump) เพื่อให้ result_cache เก็บเป็น JSON ได้
+        flights = [FlightOffer.from_amadeus(offer).model_dump() for offer in response.data or []]
         
-        print(f"✅ Found {len(flights)} flights")
+        log.debug("✅ Found %d flights", len(flights))
         return flights
     
+    except (CircuitOpenError, ProviderThrottledError) as error:
+        log.warning("⛔ %s", error)
+        raise
     except ResponseError as error:
-        print(f"❌ Amadeus Error: {error}")
-        return None
+        log.warning("❌ Amadeus Error: %s", error)
+        raise
     except Exception as e:
-        print(f"❌ Error: {e}")
-        return None
+        log.error("❌ Error: %s", e)
+        raise
 
 # --- (นี่คือ Bug 1 ที่แก้ไขแล้ว) ---
-async def search_hotels(city_code: str, check_in: str, check_out: str):
+async def fetch_hotel_list(city_code: str):
+    """List the hotels in a city (Amadeus hotel list by city code)"""
+    hotel_list = await amadeus_call(
+        "hotel_list",
+        provider_clients.amadeus.reference_data.locations.hotels.by_city.get,
+        cityCode=city_code
+    )
+    return [compact_hotel(h) for h in hotel_list.data or []]
+
+async def fetch_hotels(city_code: str, check_in: str, check_out: str):
     """Search hotels using Amadeus API"""
     try:
-        if not check_in:
-            check_in = (date.today() + timedelta(days=7)).strftime('%Y-%m-%d')
-        
-        if not check_out:
-            check_in_date = datetime.strptime(check_in, '%Y-%m-%d')
-            check_out = (check_in_date + timedelta(days=2)).strftime('%Y-%m-%d')
-        
-        print(f"🏨 Searching hotels in {city_code}: {check_in} to {check_out}")
+        log.debug("🏨 Searching hotels in %s: %s to %s", city_code, check_in, check_out)
         
-        hotel_list = amadeus.reference_data.locations.hotels.by_city.get(
-            cityCode=city_code
+        # รายชื่อโรงแรมในเมืองแทบไม่เปลี่ยน → ใช้จาก hotel_directory (refresh เบื้องหลัง)
+        hotels_in_city = await hotel_directory.get_hotels(
+            city_code,
+            lambda: fetch_hotel_list(city_code)
         )
         
-        if not hotel_list.data:
-            print("❌ No hotels found")
+        if not hotels_in_city:
+            log.debug("❌ No hotels found")
             return None
         
-        hotel_ids = [h['hotelId'] for h in hotel_list.data[:5]]
+        hotel_ids = hotel_directory.select_hotel_ids(city_code, HOTEL_OFFER_CANDIDATES)
         
-        offers = amadeus.shopping.hotel_offers_search.get(
+        offers = await amadeus_call(
+            "hotel_offers",
+            provider_clients.amadeus.shopping.hotel_offers_search.get,
             hotelIds=','.join(hotel_ids),
             checkInDate=check_in,
             checkOutDate=check_out,
             adults=1
         )
+        hotel_directory.record_offers(
+            city_code,
+            hotel_ids,
+            [(h.get('hotel') or {}).get('hotelId') for h in offers.data or []]
+        )
         
-        hotels = []
-        # (แก้ไข) เพิ่ม .get() เพื่อป้องกัน 'NoneType' Error
-        for hotel_data in offers.data[:5]:
-            hotel_info = hotel_data.get('hotel')
-            offers_info = hotel_data.get('offers')
-
-            if not hotel_info or not offers_info:
-                continue # ข้ามโรงแรมนี้ไป ถ้าข้อมูลไม่ครบ
-
-            hotel = {
-                'name': hotel_info.get('name', 'N/A'),
-                'offers': []
-            }
-            
-            for offer in offers_info[:2]:
-                offer_price = offer.get('price', {})
-                offer_room = offer.get('room', {}).get('typeEstimated', {})
-                
-                hotel['offers'].append({
-                    'price': f"{offer_price.get('total', 'N/A')} {offer_price.get('currency', '')}",
-                    'room': offer_room.get('category', 'N/A')
-                })
-            
-            hotels.append(hotel)
+        # (แก้ไข) ข้ามโรงแรมที่ข้อมูลไม่ครบ (HotelResult.from_amadeus คืน None)
+        hotels = [hotel.model_dump() for hotel in map(HotelResult.from_amadeus, offers.data or []) if hotel]
         
-        print(f"✅ Found {len(hotels)} hotels")
+        log.debug("✅ Found %d hotels", len(hotels))
         return hotels
     
+    except (CircuitOpenError, ProviderThrottledError) as error:
+        log.warning("⛔ %s", error)
+        raise
     except ResponseError as error:
-        print(f"❌ Amadeus Error: {error}")
-        return None
+        log.warning("❌ Amadeus Error: %s", error)
+        raise
     except Exception as e:
-        print(f"❌ Error: {e}")
-        return None
+        log.error("❌ Error: %s", e)
+        raise
 # --- (จบส่วนแก้ไข Bug 1) ---
 
 # --- (นี่คือ Bug 2 ที่แก้ไขแล้ว) ---
-async def search_car_rentals(city_code: str, pick_up_date: str, drop_off_date: str):
+async def fetch_car_rentals(city_code: str, pick_up_date: str, drop_off_date: str):
     """Search car rentals using Amadeus API"""
     try:
-        if not pick_up_date:
-            pick_up_date = (date.today() + timedelta(days=7)).strftime('%Y-%m-%d')
-        
-        if not drop_off_date:
-            pick_up_date_obj = datetime.strptime(pick_up_date, '%Y-%m-%d')
-            drop_off_date = (pick_up_date_obj + timedelta(days=2)).strftime('%Y-%m-%d')
-        
-        print(f"🚗 Searching car rentals in {city_code}: {pick_up_date} to {drop_off_date}")
+        log.debug("🚗 Searching car rentals in %s: %s to %s", city_code, pick_up_date, drop_off_date)
         
         # (แก้ไข) นี่คือชื่อ SDK ที่ถูกต้อง (car_rental_offers.get)
-        response = amadeus.shopping.car_rental_offers.get(
+        response = await amadeus_call(
+            "car_rental_offers",
+            provider_clients.amadeus.shopping.car_rental_offers.get,
             cityCode=city_code,
             pickUpDate=pick_up_date,
             dropOffDate=drop_off_date,
@@ -209,51 +377,125 @@ async def search_car_rentals(city_code: str, pick_up_date: str, drop_off_date: s
         # ---
         
         if not response.data:
-            print("❌ No car rentals found")
+            log.debug("❌ No car rentals found")
             return None
 
-        cars = []
-        # (แก้ไข) เพิ่ม .get() เพื่อป้องกัน Error
-        for offer_data in response.data[:5]:
-            provider = offer_data.get('provider', {})
-            car = offer_data.get('car', {})
-            price = offer_data.get('price', {})
-            
-            cars.append({
-                'provider_name': provider.get('name', 'N/A'),
-                'car_type': car.get('type', 'N/A'),
-                'category': car.get('category', 'N/A'),
-                'price': f"{price.get('total', 'N/A')} {price.get('currency', '')}"
-            })
+        cars = [CarOffer.from_amadeus(offer_data, index).model_dump()
+                for index, offer_data in enumerate(response.data)]
         
-        print(f"✅ Found {len(cars)} car rental offers")
+        log.debug("✅ Found %d car rental offers", len(cars))
         return cars
     
+    except (CircuitOpenError, ProviderThrottledError) as error:
+        log.warning("⛔ %s", error)
+        raise
     except ResponseError as error:
-        print(f"❌ Amadeus Error (Car Rental): {error}")
-        return None
+        log.warning("❌ Amadeus Error (Car Rental): %s", error)
+        raise
     except Exception as e:
-        print(f"❌ Error in search_car_rentals: {e}")
-        return None
+        log.error("❌ Error in search_car_rentals: %s", e)
+        raise
 # --- (จบส่วนแก้ไข Bug 2) ---
 
-@app.get("/")
-async def root():
-    return {"message": "AI Travel Agent API is running"}
+# --- Plan step handlers: return (key ใน search_results, payload) หรือ None ---
+# (None = ไม่พบผลลัพธ์; error จาก provider ส่งต่อให้ execute_plan รายงานเป็น status "error")
+async def run_flight_step(step: Dict[str, Any], inputs: Dict[str, Any]):
+    origin = step.get("origin")
+    destination = step.get("destination")
+    departure_date = step.get("departure_date")
+    return_date = step.get("return_date")
+    
+    if not (origin and destination):
+        return None
+    if step.get("departure_date_from") and step.get("departure_date_to"):
+        return await run_flexible_flight_step(step)
+    flights = await search_flights(origin, destination, departure_date, return_date)
+    if not flights:
+        return None
+    query = {
+        'origin': origin,
+        'destination': destination,
+        'departure_date': departure_date or (date.today() + timedelta(days=7)).strftime('%Y-%m-%d')
+    }
+    if return_date:
+        query['return_date'] = return_date
+    return "flights", await result_store.first_page("flights", flights, query=query)
 
-@app.post("/api/chat")
-async def chat(request: ChatRequest):
-    try:
-        print(f"\n📨 Received: {request.message}")
-        
-        message_lower = request.message.lower()
-        search_results = None
-        
-        # --- (Prompt อัจฉริยะ ทำงานได้ดีมาก!) ---
-        # Step 1: Let AI analyze intent
-        analysis_prompt = f"""วิเคราะห์ข้อความของผู้ใช้ และสร้าง "แผนการทำงาน" (Plan) เป็น List ของ JSON
+async def run_flexible_flight_step(step: Dict[str, Any]):
+    """ค้นหาทุกวันในช่วง departure_date_from..departure_date_to แล้วรวมเป็นปฏิทินราคา + ถูกสุด N อันดับ"""
+    origin, destination = step["origin"], step["destination"]
+    trip_days = step.get("trip_days")
+    pairs = date_pairs(
+        step["departure_date_from"],
+        step["departure_date_to"],
+        return_date=step.get("return_date"),
+        trip_days=int(trip_days) if trip_days else None
+    )
+    if not pairs:
+        return None
+    merged = await flexible_search(
+        pairs,
+        lambda departure, return_date: search_flights(origin, destination, departure, return_date, rate_limited=True)
+    )
+    if not merged["offers"]:
+        errors = [day for day in merged["calendar"] if day["status"] == "error"]
+        if errors and len(errors) == len(merged["calendar"]):
+            raise RuntimeError(f"flight search failed for all {len(errors)} dates")
+        return None
+    query = {key: step[key] for key in ("origin", "destination", "departure_date_from", "departure_date_to",
+                                        "return_date", "trip_days") if step.get(key)}
+    # ทุก offer ของทุกวันเรียงตามราคาแล้ว → หน้าแรกคือถูกสุด N อันดับ
+    return "flights", await result_store.first_page(
+        "flights", merged["offers"],
+        calendar=merged["calendar"],
+        cheapest_day=merged["cheapest_day"],
+        query=query
+    )
+
+async def run_hotel_step(step: Dict[str, Any], inputs: Dict[str, Any]):
+    city = step.get("city")
+    check_in = step.get("check_in_date")
+    check_out = step.get("check_out_date")
     
-ข้อความ: "{request.message}"
+    if not city:
+        return None
+    hotels = await search_hotels(city, check_in, check_out)
+    if not hotels:
+        return None
+    return "hotels", await result_store.first_page("hotels", hotels, query={
+        'city_code': city,
+        'check_in_date': check_in,
+        'check_out_date': check_out
+    })
+
+async def run_car_rental_step(step: Dict[str, Any], inputs: Dict[str, Any]):
+    city = step.get("city")
+    pick_up = step.get("pick_up_date")
+    drop_off = step.get("drop_off_date")
+    
+    if not city:
+        return None
+    cars = await search_car_rentals(city, pick_up, drop_off)
+    if not cars:
+        return None
+    return "cars", await result_store.first_page("cars", cars, query={
+        'city_code': city,
+        'pick_up_date': pick_up,
+        'drop_off_date': drop_off
+    })
+
+PLAN_STEP_HANDLERS = {
+    "search_flights": run_flight_step,
+    "search_hotels": run_hotel_step,
+    "search_car_rentals": run_car_rental_step,
+}
+
+def build_analysis_prompt(message: str, context: str = "") -> str:
+    """Prompt for Step 1: ให้ Gemini สร้าง Plan จากข้อความของผู้ใช้ (และบริบทของ session)"""
+    context_block = f"\nบริบทจากบทสนทนาก่อนหน้า (ใช้เติมข้อมูลที่ผู้ใช้ไม่ได้พูดซ้ำ):\n{context}\n" if context else ""
+    return f"""วิเคราะห์ข้อความของผู้ใช้ และสร้าง "แผนการทำงาน" (Plan) เป็น List ของ JSON
+    
+ข้อความ: "{message}"{context_block}
 วันนี้คือวันที่: {date.today().strftime('%Y-%m-%d')}
 
 "Plan" คือ List ของ Tool ที่ต้องเรียกใช้ตามลำดับ
@@ -264,50 +506,82 @@ Tool ที่มี: "search_flights", "search_hotels", "search_car_rentals"
   "plan": [
     {{
       "tool": "search_flights",
-      "origin": "รหัสสนามบิน 3 ตัว",
-      "destination": "รหัสสนามบิน 3 ตัว",
+      "origin": "รหัสสนามบินหรือชื่อเมือง",
+      "destination": "รหัสสนามบินหรือชื่อเมือง",
       "departure_date": "YYYY-MM-DD",
       "return_date": "YYYY-MM-DD" // (ถ้ามี)
     }},
+    {{
+      "tool": "search_flights", // แบบยืดหยุ่นวันที่: หาวันที่ถูกที่สุดในช่วง (ไม่เกิน 14 วัน)
+      "origin": "รหัสสนามบินหรือชื่อเมือง",
+      "destination": "รหัสสนามบินหรือชื่อเมือง",
+      "departure_date_from": "YYYY-MM-DD",
+      "departure_date_to": "YYYY-MM-DD",
+      "return_date": "YYYY-MM-DD", // (ถ้ามีวันกลับที่แน่นอน)
+      "trip_days": 5 // (ถ้าบอกจำนวนวันของทริปแทนวันกลับ)
+    }},
     {{
       "tool": "search_hotels",
-      "city": "รหัสเมือง 3 ตัว",
+      "city": "รหัสเมืองหรือชื่อเมือง",
       "check_in_date": "YYYY-MM-DD",
       "check_out_date": "YYYY-MM-DD"
     }},
     {{
       "tool": "search_car_rentals",
-      "city": "รหัสเมือง 3 ตัว",
+      "city": "รหัสเมืองหรือชื่อเมือง",
       "pick_up_date": "YYYY-MM-DD",
       "drop_off_date": "YYYY-MM-DD"
     }}
   ]
 }}
 
-- ต้องสกัด "origin", "destination", และ "city" ออกมาให้ถูกต้อง
+- ต้องสกัด "origin", "destination", และ "city" ออกมาให้ถูกต้อง ใส่รหัส IATA ถ้าผู้ใช้พิมพ์มา ไม่เช่นนั้นใส่ชื่อเมืองตามที่ผู้ใช้พิมพ์ (ระบบแปลงเป็นรหัสเอง)
 - **สำคัญมาก:** ต้องสกัด "วันที่" (departure_date, check_in_date, etc.) ออกมาเป็น YYYY-MM-DD ให้ถูกต้อง ถ้าผู้ใช้บอก "25 ธ.ค." (ปีนี้คือ {date.today().year}) ให้แปลงเป็น {date.today().year}-12-25
 - ถ้าผู้ใช้แค่ทักทาย (intent "none") ให้ตอบ: {{"plan": []}}
 - ถ้าข้อมูลไม่พอ (เช่น "อยากไปโตเกียว" แต่ไม่บอกต้นทาง) ให้ตอบ: {{"plan": [], "needs_more_info": "flight", "missing": ["origin", "date"]}}
 
-Airport codes:
-Bangkok=BKK, Tokyo=NRT, New York=JFK, London=LHR, Paris=CDG, Singapore=SIN, 
-Dubai=DXB, Los Angeles=LAX, Hong Kong=HKG, Seoul=ICN, Osaka=KIX, Phuket=HKT,
-Chiang Mai=CNX, San Francisco=SFO, Sydney=SYD, Melbourne=MEL
-
-City codes:
-Bangkok=BKK, Tokyo=TYO, New York=NYC, London=LON, Paris=PAR, Singapore=SIN,
-Dubai=DXB, Los Angeles=LAX, Hong Kong=HKG, Seoul=SEL, Osaka=OSA
-
 ตัวอย่าง:
 - "สวัสดี" → {{"plan": []}}
 - "หาเที่ยวบิน BKK ไป NRT วันที่ 2025-12-25" → {{"plan": [{{"tool": "search_flights", "origin": "BKK", "destination": "NRT", "departure_date": "2025-12-25"}}]}}
 - "หาโรงแรมที่นิวยอร์ก วันที่ 10 ธ.ค. ถึง 15 ธ.ค." → {{"plan": [{{"tool": "search_hotels", "city": "NYC", "check_in_date": "{date.today().year}-12-10", "check_out_date": "{date.today().year}-12-15"}}]}}
 - "หาเที่ยวบิน BKK-NRT วันที่ 2025-10-30, โรงแรมใน TYO, และรถเช่าใน TYO" → {{"plan": [{{"tool": "search_flights", "origin": "BKK", "destination": "NRT", "departure_date": "2025-10-30"}}, {{"tool": "search_hotels", "city": "TYO", "check_in_date": "2025-10-30"}}, {{"tool": "search_car_rentals", "city": "TYO", "pick_up_date": "2025-10-30"}}]}}
+- "ตั๋ว BKK ไป NRT วันไหนถูกสุด 1-7 ธ.ค. ไป 5 วัน" → {{"plan": [{{"tool": "search_flights", "origin": "BKK", "destination": "NRT", "departure_date_from": "{date.today().year}-12-01", "departure_date_to": "{date.today().year}-12-07", "trip_days": 5}}]}}
 - "อยากไปเที่ยว" → {{"plan": [], "needs_more_info": "general", "missing": ["destination", "date"]}}
 """
 
-        print("🔍 AI analyzing intent...")
-        analysis_response = gemini_model.generate_content(analysis_prompt)
+async def analyze_intent(message: str, session: Optional[SessionRecord] = None) -> Dict[str, Any]:
+    """Step 1: ใช้ fast-path parser ก่อน ถ้า parse ไม่ได้ค่อยถาม Gemini"""
+    with span("intent") as trace:
+        if FAST_INTENT_PARSER:
+            intent_data = parse_intent(message, context=session.slots if session else None)
+            if intent_data is not None:
+                log.debug("⚡ Intent (rules): %s", intent_data)
+                trace.set(source="rules")
+                return intent_data
+        
+        # ข้อความที่ระบุครบในตัว ใช้ cache เดียวกับ turn แรก; follow-up ใช้ซ้ำได้เฉพาะเมื่อ trip slots ตรงกัน
+        # (follow-up ที่ยังไม่มี slots ขึ้นกับข้อความก่อนหน้าเอง จึงไม่ cache)
+        context = session.context_text() if session else ""
+        slots = session.slots if context and depends_on_context(message, date.today()) else None
+        cacheable = slots is None or bool(slots)
+        if cacheable:
+            cached = plan_cache.get(message, slots=slots)
+            if cached is not None:
+                log.debug("💾 Intent (cache): %s", cached)
+                trace.set(source="cache")
+                return cached
+        
+        log.debug("🔍 AI analyzing intent...")
+        trace.set(source="gemini")
+        started = time.perf_counter()
+        if REPLY_MODE == "template":
+            analysis_response = await gemini_call(
+                "plan",
+                build_analysis_prompt(message, context),
+                generation_config=PLAN_GENERATION_CONFIG
+            )
+        else:
+            analysis_response = await gemini_call("plan", build_analysis_prompt(message, context))
         analysis_text = analysis_response.text.strip()
         
         try:
@@ -316,98 +590,77 @@ Dubai=DXB, Los Angeles=LAX, Hong Kong=HKG, Seoul=SEL, Osaka=OSA
             elif "```" in analysis_text:
                 analysis_text = analysis_text.split("```")[1].split("```")[0].strip()
             
-            intent_data = json.loads(analysis_text)
-            print(f"🤖 Intent (Plan): {intent_data}")
+            # ชื่อเมือง/รหัสที่ Gemini ส่งมาถูกตรวจและแปลงเป็นรหัสด้วย airports.csv ก่อนเรียก Amadeus
+            intent_data = resolve_plan_places(json.loads(analysis_text))
+            log.debug("🤖 Intent (Plan): %s", intent_data)
+            if isinstance(intent_data, dict) and cacheable:
+                plan_cache.put(message, intent_data, time.perf_counter() - started, slots=slots)
         except Exception as e:
-            print(f"⚠️ Parse error: {e}")
+            log.warning("⚠️ Parse error: %s", e)
+            trace.set(parse_error=str(e))
             intent_data = {"plan": [], "needs_more_info": False}
+        return intent_data
+
+def plan_steps(intent_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    plan = intent_data.get("plan", [])
+    if not isinstance(plan, list):
+        return []
+    return [step for step in plan if isinstance(step, dict)]
+
+async def run_plan(intent_data: Dict[str, Any], on_step=None):
+    """Step 2: Execute search (steps ที่ไม่ขึ้นต่อกันจะทำงานพร้อมกัน)"""
+    plan = plan_steps(intent_data)
+    
+    all_search_results = {
+        "flights": None,
+        "hotels": None,
+        "cars": None
+    }
+    
+    plan_execution = []
+    if plan:
+        log.debug("🤖 Executing plan with %d steps...", len(plan))
+        with span("plan", steps=len(plan)):
+            step_results = await execute_plan(plan, PLAN_STEP_HANDLERS, on_result=on_step)
+        for result in step_results:
+            if result.status == "ok" and result.value:
+                key, payload = result.value
+                all_search_results[key] = payload
+            elif result.status != "ok":
+                log.warning("⚠️ Step %s (%s) %s: %s", result.id, result.tool, result.status, result.error)
+            plan_execution.append(result.summary())
+    
+    return all_search_results, plan_execution
+
+def summarize_results(all_search_results: Dict[str, Any]) -> List[str]:
+    """ข้อความสรุปจำนวนผลลัพธ์ของแต่ละ tool"""
+    summary_parts = []
+    if all_search_results["flights"]:
+        summary_parts.append(f"พบเที่ยวบิน {all_search_results['flights']['total']} เที่ยว ✈️")
+        cheapest_day = all_search_results["flights"].get("cheapest_day")
+        if cheapest_day:
+            summary_parts.append(f"วันที่ถูกที่สุดคือ {cheapest_day['departure_date']} "
+                                 f"({cheapest_day['price']:.2f} {cheapest_day['currency']}) 📅")
+    if all_search_results["hotels"]:
+        summary_parts.append(f"พบโรงแรม {all_search_results['hotels']['total']} แห่ง 🏨")
+    if all_search_results["cars"]:
+        summary_parts.append(f"พบรถเช่า {all_search_results['cars']['total']} คัน 🚗")
+    return summary_parts
+
+def build_reply_prompt(message: str, intent_data: Dict[str, Any], all_search_results: Dict[str, Any],
+                       context: str = "") -> str:
+    """Step 3: Prompt สำหรับให้ Gemini เขียนคำตอบ (พร้อมบริบทของ session ถ้ามี)"""
+    system = f"{SYSTEM_PROMPT}\n{context}\n" if context else SYSTEM_PROMPT
+    
+    if any(all_search_results.values()):
+        summary = " และ ".join(summarize_results(all_search_results))
         
-        # --- (ตรรกะ Step 2 เหมือนเดิม) ---
-        # Step 2: Execute search
-        plan = intent_data.get("plan", [])
-        
-        all_search_results = {
-            "flights": None,
-            "hotels": None,
-            "cars": None
-        }
-        
-        if plan:
-            print(f"🤖 Executing plan with {len(plan)} steps...")
-            for step in plan:
-                tool_name = step.get("tool")
-                
-                if tool_name == "search_flights":
-                    origin = step.get("origin")
-                    destination = step.get("destination")
-                    departure_date = step.get("departure_date")
-                    
-                    if origin and destination:
-                        flights = await search_flights(origin, destination, departure_date)
-                        if flights:
-                            all_search_results["flights"] = {
-                                'data': flights,
-                                'query': {
-                                    'origin': origin,
-                                    'destination': destination,
-                                    'departure_date': departure_date or (date.today() + timedelta(days=7)).strftime('%Y-%m-%d')
-                                }
-                            }
-
-                elif tool_name == "search_hotels":
-                    city = step.get("city")
-                    check_in = step.get("check_in_date")
-                    check_out = step.get("check_out_date")
-                    
-                    if city:
-                        hotels = await search_hotels(city, check_in, check_out)
-                        if hotels:
-                            all_search_results["hotels"] = {
-                                'data': hotels,
-                                'query': {
-                                    'city_code': city,
-                                    'check_in_date': check_in,
-                                    'check_out_date': check_out
-                                }
-                            }
-
-                elif tool_name == "search_car_rentals":
-                    city = step.get("city")
-                    pick_up = step.get("pick_up_date")
-                    drop_off = step.get("drop_off_date")
-                    
-                    if city:
-                        cars = await search_car_rentals(city, pick_up, drop_off)
-                        if cars:
-                            all_search_results["cars"] = {
-                                'data': cars,
-                                'query': {
-                                    'city_code': city,
-                                    'pick_up_date': pick_up,
-                                    'drop_off_date': drop_off
-                                }
-                            }
-        
-        # Step 3: Generate response (เหมือนเดิม)
-        has_results = any(all_search_results.values())
-        
-        if has_results:
-            summary_parts = []
-            if all_search_results["flights"]:
-                summary_parts.append(f"พบเที่ยวบิน {len(all_search_results['flights']['data'])} เที่ยว ✈️")
-            if all_search_results["hotels"]:
-                summary_parts.append(f"พบโรงแรม {len(all_search_results['hotels']['data'])} แห่ง 🏨")
-            if all_search_results["cars"]:
-                summary_parts.append(f"พบรถเช่า {len(all_search_results['cars']['data'])} คัน 🚗")
-            
-            summary = " และ ".join(summary_parts)
-            
-            prompt = f"""{SYSTEM_PROMPT}
+        return f"""{system}
 
 ฉันทำงานตามแผนที่วางไว้ และได้ผลลัพธ์ดังนี้:
 {summary}
 
-ข้อความเดิม: "{request.message}"
+ข้อความเดิม: "{message}"
 
 ตอบ:
 1. สรุปผลลัพธ์ที่เจอ (เช่น: "เจอ 5 เที่ยวบิน และ 3 โรงแรมค่ะ!")
@@ -416,14 +669,14 @@ Dubai=DXB, Los Angeles=LAX, Hong Kong=HKG, Seoul=SEL, Osaka=OSA
 
 2-3 ประโยค มีอิโมจิ"""
 
-        elif intent_data.get("needs_more_info"):
-            missing = ", ".join(intent_data.get("missing", []))
-            prompt = f"""{SYSTEM_PROMPT}
+    elif intent_data.get("needs_more_info"):
+        missing = ", ".join(intent_data.get("missing", []))
+        return f"""{system}
 
 ผู้ใช้ต้องการบางอย่าง แต่ข้อมูลไม่ครบ
 ขาดข้อมูล: {missing}
 
-ข้อความ: "{request.message}"
+ข้อความ: "{message}"
 
 ตอบ:
 1. รับทราบ
@@ -431,11 +684,11 @@ Dubai=DXB, Los Angeles=LAX, Hong Kong=HKG, Seoul=SEL, Osaka=OSA
 3. ให้ตัวอย่าง
 
 2-3 ประโยค มีอิโมจิ"""
-        
-        else: # (กรณี intent "none" หรือ plan: [])
-            prompt = f"""{SYSTEM_PROMPT}
+    
+    else: # (กรณี intent "none" หรือ plan: [])
+        return f"""{system}
 
-ข้อความ: "{request.message}"
+ข้อความ: "{message}"
 
 ตอบอย่างเป็นธรรมชาติ:
 - ถ้าทักทาย → ทักทายและแนะนำตัว
@@ -443,28 +696,575 @@ Dubai=DXB, Los Angeles=LAX, Hong Kong=HKG, Seoul=SEL, Osaka=OSA
 - ถ้าถามเดินทาง → ให้ข้อมูลและชวนค้นหา
 
 2-4 ประโยค มีอิโมจิ"""
+
+def build_template_reply(intent_data: Dict[str, Any], all_search_results: Dict[str, Any]) -> Optional[str]:
+    """คำตอบสำเร็จรูปสำหรับ REPLY_MODE=template (None = ต้องให้ Gemini ตอบ)"""
+    if any(all_search_results.values()):
+        summary = " และ ".join(summarize_results(all_search_results))
+        return f"เจอแล้วค่ะ! {summary} ดูรายละเอียดด้านล่างได้เลยนะคะ 😊 ต้องการให้ช่วยอะไรเพิ่มไหมคะ?"
+    
+    if intent_data.get("needs_more_info"):
+        missing = [MISSING_INFO_LABELS.get(m, m) for m in intent_data.get("missing", [])]
+        asked = " และ ".join(missing) if missing else "รายละเอียดการเดินทาง"
+        return (f"ได้เลยค่ะ! ✈️ ขอทราบ{asked}เพิ่มอีกนิดนะคะ "
+                f"เช่น \"หาเที่ยวบิน BKK ไป NRT วันที่ 25 ธ.ค.\" 😊")
+    
+    return None
+
+async def stream_gemini(prompt: str):
+    """Yield text chunks from Gemini streaming generation (SDK iterator runs in the provider pool)"""
+    # Stream ถูก retry ไม่ได้หลังส่ง token แรกไปแล้ว จึงใช้แค่ circuit breaker
+    breaker = resilience.get_breaker("gemini", "reply")
+    if not breaker.allow():
+        raise CircuitOpenError(f"{breaker.name} circuit is open")
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    
+    def produce():
+        try:
+            for chunk in provider_clients.gemini_model.generate_content(prompt, stream=True):
+                loop.call_soon_threadsafe(chunks.put_nowait, chunk.text)
+        finally:
+            loop.call_soon_threadsafe(chunks.put_nowait, None)
+    
+    producer = asyncio.ensure_future(run_gemini(produce))
+    healthy = True
+    try:
+        while (text := await chunks.get()) is not None:
+            yield text
+        await producer  # re-raise SDK errors
+    except Exception as e:
+        healthy = not is_transient(e)
+        raise
+    finally:
+        # client ที่ปิดการเชื่อมต่อกลางทางไม่นับเป็นความผิดของ provider
+        if healthy:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+
+def elapsed_ms(since: float) -> float:
+    return round((time.perf_counter() - since) * 1000, 1)
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode()}\n\n"
+
+@app.get("/")
+async def root():
+    return {"message": "AI Travel Agent API is running"}
+
+@app.get("/api/stats")
+async def stats():
+    """Provider pool usage (limits, in-flight calls, queue depth) and result cache counters"""
+    return {
+        "executor": provider_executor.stats(),
+        "cache": result_cache.stats(),
+        "hotel_directory": hotel_directory.stats(),
+        "plan_cache": plan_cache.stats(),
+        "sessions": session_store.stats(),
+        "traces": trace_stats(),
+        "clients": provider_clients.stats(),
+        "http_pool": http_pool.stats(),
+        "airports": airport_index.stats(),
+        "results": result_store.stats(),
+        "admission": admission.stats(),
+        "provider_limits": provider_limiter.stats(),
+        "prefetch": prefetcher.stats(),
+        "batch": batch_jobs.stats(),
+        "startup": startup_timer.stats()
+    }
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the event loop answers (ไม่เช็ค provider เพื่อไม่ให้ restart worker เพราะ upstream ล่ม)"""
+    return {"status": "ok", "pid": startup_timer.pid}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: startup and pre-warm finished, provider keys configured, not shutting down"""
+    reasons = []
+    if shutting_down:
+        reasons.append("shutting_down")
+    if startup_timer.ready_seconds is None:
+        reasons.append(f"prewarm_{provider_clients.prewarm_state['status']}")
+    reasons += [f"missing_{name.lower()}" for name in provider_clients.missing_config()]
+    body = {
+        "status": "not_ready" if reasons else "ready",
+        "reasons": reasons,
+        "prewarm": provider_clients.prewarm_state,
+        "startup": startup_timer.stats(),
+        # breaker ที่เปิดอยู่แสดงไว้เฉยๆ ไม่ทำให้ not ready (ทุก worker ใช้ upstream เดียวกัน)
+        "open_breakers": [b["name"] for b in breaker_states() if b["state"] != "closed"]
+    }
+    return ORJSONResponse(body, status_code=503 if reasons else 200)
+
+@app.get("/api/health/providers")
+async def provider_health():
+    """Circuit breaker state per provider endpoint ("degraded" while any breaker is open)"""
+    breakers = breaker_states()
+    return {
+        "status": "degraded" if any(b["state"] != "closed" for b in breakers) else "ok",
+        "breakers": breakers,
+        "hedges_started": resilience.hedges_started,
+        "hedges_skipped": resilience.hedges_skipped
+    }
+
+def collect_runtime_metrics():
+    """Values read from the existing stats() at scrape time (cache hit ratios, pool usage, breakers)"""
+    cache_stats = result_cache.stats()["tools"]
+    plan_stats = plan_cache.stats()
+    lookups = [
+        ({"cache": tool, "outcome": outcome}, counters[outcome])
+        for tool, counters in cache_stats.items() for outcome in ("hits", "misses", "coalesced")
+    ]
+    lookups += [
+        ({"cache": "plan", "outcome": outcome}, plan_stats[key])
+        for outcome, key in (("hits", "exact_hits"), ("near_hits", "near_hits"), ("misses", "misses"))
+    ]
+    yield ("cache_lookups_total", "counter", "Cache lookups by outcome", lookups)
+    directory_stats = hotel_directory.stats()
+    ratios = [({"cache": tool}, counters["hit_ratio"]) for tool, counters in cache_stats.items()]
+    ratios.append(({"cache": "plan"}, plan_stats["hit_rate"]))
+    lookups = directory_stats["hits"] + directory_stats["misses"]
+    ratios.append(({"cache": "hotel_directory"}, round(directory_stats["hits"] / lookups, 3) if lookups else 0.0))
+    yield ("cache_hit_ratio", "gauge", "Share of lookups served from cache", ratios)
+    lanes = provider_executor.stats()["providers"]
+    yield ("provider_inflight", "gauge", "Provider calls running in the pool",
+           [({"provider": name}, lane["active"]) for name, lane in lanes.items()])
+    yield ("provider_queued", "gauge", "Provider calls waiting for a pool slot",
+           [({"provider": name}, lane["waiting"]) for name, lane in lanes.items()])
+    yield ("circuit_breaker_open", "gauge", "1 while the breaker rejects calls",
+           [({"breaker": b["name"]}, int(b["state"] == "open")) for b in breaker_states()])
+    yield ("sessions_active", "gauge", "Conversation sessions held by the session store",
+           [({}, session_store.stats()["sessions"])])
+    admission_stats = admission.stats()
+    yield ("admission_active", "gauge", "Chat requests holding an admission slot", [({}, admission_stats["active"])])
+    yield ("admission_queued", "gauge", "Chat requests waiting in the fair queue",
+           [({"priority": p}, n) for p, n in admission_stats["queued_by_priority"].items()])
+    yield ("admission_rejected_total", "counter", "Requests shed with 429 by reason",
+           [({"reason": reason}, n) for reason, n in admission_stats["rejected"].items()])
+    limits = provider_limiter.stats()
+    yield ("provider_throttle_wait_seconds_total", "counter", "Time provider calls waited for a rate-limit token",
+           [({"provider": name}, lane["waited_s"]) for name, lane in limits.items()])
+    yield ("provider_throttled_total", "counter", "Provider calls refused by the global rate limit",
+           [({"provider": name}, lane["throttled"]) for name, lane in limits.items()])
+    prefetch_stats = prefetcher.stats()
+    yield ("prefetch_searches_total", "counter", "Background cache-warming searches by outcome",
+           [({"tool": tool, "outcome": outcome}, n) for outcome in ("refreshed", "failed")
+            for tool, n in prefetch_stats[outcome].items()])
+    yield ("prefetch_calls_last_hour", "gauge", "Upstream calls spent by prefetching in the last hour",
+           [({}, prefetch_stats["calls_last_hour"])])
+    batch_stats = batch_jobs.stats()
+    yield ("batch_items_total", "counter", "Messages answered through the batch endpoints",
+           [({}, batch_stats["items"])])
+    yield ("batch_shared_intents_total", "counter", "Batch messages that reused another message's intent analysis",
+           [({}, batch_stats["shared_intents"])])
+    yield ("batch_jobs", "gauge", "Batch jobs held in memory by status",
+           [({"status": status}, n) for status, n in batch_stats["jobs_by_status"].items()])
+    yield ("result_sets_active", "gauge", "Paginated search result sets held by the result store",
+           [({}, result_store.size())])
+    pool = http_pool.stats()
+    yield ("http_pool_requests_total", "counter", "Outbound HTTP requests through the shared pool",
+           [({}, pool["requests"])])
+    yield ("http_pool_connections_opened_total", "counter", "New TCP connections opened by the shared pool",
+           [({}, pool["connections_opened"])])
+    yield ("http_pool_inflight", "gauge", "Outbound HTTP requests in progress", [({}, pool["inflight"])])
+    yield ("http_pool_connections", "gauge", "Pooled connections by state",
+           [({"client": name, "state": state}, counts[state])
+            for name, counts in pool["connections"].items() for state in ("idle", "active")])
+    phases = {"import": startup_timer.import_seconds, "startup": startup_timer.startup_seconds,
+              "ready": startup_timer.ready_seconds}
+    yield ("worker_startup_seconds", "gauge", "Cold-start time of this worker by phase",
+           [({"phase": phase}, value) for phase, value in phases.items() if value is not None])
+
+register_collector(collect_runtime_metrics)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition: latency histograms, provider counters, cache hit ratios"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+async def open_session(request: ChatRequest) -> SessionRecord:
+    """Session ของ request นี้ (สร้างใหม่ถ้าไม่มี/หมดอายุ)"""
+    session = await session_store.get_or_create(request.session_id)
+    if not session.has_context() and request.conversation_history:
+        # client รุ่นเก่าที่ยังส่งประวัติทั้งหมดมา: ใช้ตั้งต้น session เท่านั้น
+        for item in request.conversation_history[-SESSION_SEED_TURNS:]:
+            role = "user" if item.get("role") == "user" else "assistant"
+            session.add_turn(role, item.get("content", ""))
+    return session
+
+async def shape_payload(request: ChatRequest, key: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """หน้าแรกของผลค้นหาตาม page_size / fields ที่ client ขอ (ค่าเริ่มต้นไม่ต้องตัดใหม่)"""
+    fields = (request.fields or {}).get(key)
+    if not payload or not (request.page_size or fields):
+        return payload
+    return await result_store.reshape(payload, request.page_size, fields)
+
+async def shape_results(request: ChatRequest, all_search_results: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: await shape_payload(request, key, payload) for key, payload in all_search_results.items()}
+
+async def finish_turn(session: SessionRecord, message: str, intent_data: Dict[str, Any], ai_text: str):
+    """บันทึก trip slots และข้อความของ turn นี้ลง session"""
+    session.update_slots(plan_steps(intent_data))
+    session.add_turn("user", message)
+    session.add_turn("assistant", ai_text)
+    await session_store.save(session)  # sqlite backend: worker อื่นเห็น turn นี้
+
+async def admit_request(http_request: Request, priority: Optional[str] = None):
+    """Slot ของ admission control: 429 เมื่อ client เกิน rate หรือคิวเต็ม (X-Priority: low ลดลำดับตัวเองได้)"""
+    client = admission.client_id(http_request)
+    requested = priority or http_request.headers.get("X-Priority")
+    return await admission.admit(client, admission.priority_of(client, requested))
+
+async def release_slot(ticket):
+    admission.release(ticket)
+
+@app.post("/api/chat")
+async def chat(request: ChatRequest, http_request: Request):
+    ticket = await admit_request(http_request)
+    try:
+        return await answer_chat(request)
+    finally:
+        admission.release(ticket)
+
+async def answer_chat(request: ChatRequest):
+    started = time.perf_counter()
+    status = "error"
+    try:
+        with span("chat", endpoint="/api/chat") as trace:
+            log.info("📨 Received: %s", request.message)
+            session = await open_session(request)
+            context = session.context_text()
+            
+            # Step 1: Analyze intent (rules ก่อน แล้วค่อย Gemini)
+            intent_data = await analyze_intent(request.message, session)
+            timings = {"intent_ms": elapsed_ms(started)}
+            
+            # Step 2: Execute search
+            stage_started = time.perf_counter()
+            all_search_results, plan_execution = await run_plan(intent_data)
+            timings["search_ms"] = elapsed_ms(stage_started)
+            
+            # Step 3: Generate response
+            stage_started = time.perf_counter()
+            has_results = any(all_search_results.values())
+            with span("reply") as reply_trace:
+                ai_text = build_template_reply(intent_data, all_search_results) if REPLY_MODE == "template" else None
+                reply_trace.set(mode="template" if ai_text is not None else "gemini")
+                
+                if ai_text is None:
+                    prompt = build_reply_prompt(request.message, intent_data, all_search_results, context)
+                    log.debug("🤖 Generating response...")
+                    response = await gemini_call("reply", prompt)
+                    ai_text = response.text
+            log.info("✅ Done: %s...", ai_text[:80])
+            await finish_turn(session, request.message, intent_data, ai_text)
+            timings["reply_ms"] = elapsed_ms(stage_started)
+            timings["total_ms"] = elapsed_ms(started)
+            trace.set(session_id=session.session_id, has_results=has_results)
         
-        print("🤖 Generating response...")
-        response = gemini_model.generate_content(prompt)
-        ai_text = response.text
-        print(f"✅ Done: {ai_text[:80]}...")
-        
-        return {
+        status = "ok"
+        # ORJSONResponse ตรงๆ ไม่ผ่าน jsonable_encoder
+        return ORJSONResponse({
             "response": ai_text,
             "has_travel_intent": has_results,
             "travel_data": None,
-            "search_results": all_search_results
-        }
+            "search_results": await shape_results(request, all_search_results),
+            "plan_execution": plan_execution,
+            "session_id": session.session_id,
+            "timings": timings
+        })
         
+    except Overloaded:
+        status = "rejected"
+        raise
     except Exception as e:
-        print(f"❌ ERROR: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ ERROR: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint="/api/chat", status=status)
+
+async def chat_stream_events(request: ChatRequest):
+    """SSE events: session → plan → result (ต่อ tool ที่เสร็จ) → token (คำตอบทีละส่วน) → done"""
+    plan_task = None
+    message = request.message
+    started = time.perf_counter()
+    status = "error"
+    try:
+        with span("chat", endpoint="/api/chat/stream") as trace:
+            log.info("📨 Received (stream): %s", message)
+            session = await open_session(request)
+            context = session.context_text()
+            yield sse_event("session", {"session_id": session.session_id})
+            
+            intent_data = await analyze_intent(message, session)
+            timings = {"intent_ms": elapsed_ms(started)}
+            yield sse_event("plan", intent_data)
+            stage_started = time.perf_counter()
+            
+            # ส่งผลการค้นหาแต่ละ tool ทันทีที่เสร็จ ไม่ต้องรอทั้งแผน
+            finished_steps = asyncio.Queue()
+            
+            async def on_step(result):
+                finished_steps.put_nowait(result)
+            
+            plan_task = asyncio.create_task(run_plan(intent_data, on_step))
+            plan_task.add_done_callback(lambda _: finished_steps.put_nowait(None))
+            while (result := await finished_steps.get()) is not None:
+                if result.status == "ok" and result.value:
+                    key, payload = result.value
+                    yield sse_event("result", {"key": key, "data": await shape_payload(request, key, payload),
+                                               "step": result.summary()})
+                else:
+                    yield sse_event("step", result.summary())
+            all_search_results, plan_execution = await plan_task
+            timings["search_ms"] = elapsed_ms(stage_started)
+            stage_started = time.perf_counter()
+            
+            with span("reply") as reply_trace:
+                ai_text = build_template_reply(intent_data, all_search_results) if REPLY_MODE == "template" else None
+                reply_trace.set(mode="template" if ai_text is not None else "gemini")
+                if ai_text is not None:
+                    timings["first_token_ms"] = elapsed_ms(started)
+                    yield sse_event("token", {"text": ai_text})
+                else:
+                    prompt = build_reply_prompt(message, intent_data, all_search_results, context)
+                    ai_text = ""
+                    async for text in stream_gemini(prompt):
+                        if not ai_text:
+                            timings["first_token_ms"] = elapsed_ms(started)
+                        ai_text += text
+                        yield sse_event("token", {"text": text})
+            log.info("✅ Done (stream): %s...", ai_text[:80])
+            await finish_turn(session, message, intent_data, ai_text)
+            timings["reply_ms"] = elapsed_ms(stage_started)
+            timings["total_ms"] = elapsed_ms(started)
+            trace.set(session_id=session.session_id, has_results=any(all_search_results.values()))
+            
+            yield sse_event("done", {
+                "response": ai_text,
+                "has_travel_intent": any(all_search_results.values()),
+                "travel_data": None,
+                "search_results": await shape_results(request, all_search_results),
+                "plan_execution": plan_execution,
+                "session_id": session.session_id,
+                "timings": timings
+            })
+            status = "ok"
+    except Exception as e:
+        log.exception("❌ ERROR (stream): %s", e)
+        error = {"detail": str(e)}
+        if isinstance(e, Overloaded):
+            error["retry_after"] = round(e.retry_after, 1)
+        yield sse_event("error", error)
+    finally:
+        if plan_task is not None and not plan_task.done():
+            plan_task.cancel()  # client ปิดการเชื่อมต่อกลางทาง
+            status = "cancelled"
+        REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint="/api/chat/stream", status=status)
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    """Streaming /api/chat: Server-Sent Events แทนการรอจนทุกขั้นตอนเสร็จ"""
+    ticket = await admit_request(http_request)  # 429 ก่อนเริ่ม stream
+    return StreamingResponse(
+        chat_stream_events(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release_slot, ticket)  # คืน slot เมื่อ stream จบหรือ client ตัดการเชื่อมต่อ
+    )
+
+def provider_calls() -> int:
+    """Gemini + Amadeus calls ที่ทำเสร็จแล้วใน worker นี้ (ใช้วัดจำนวน call ต่อ batch)"""
+    return sum(lane["completed"] + lane["failed"] for lane in provider_executor.stats()["providers"].values())
+
+async def answer_batch_item(batch: BatchChatRequest, index: int, item: BatchItem, intents: SharedTasks):
+    """คำตอบของข้อความหนึ่งใน batch: ข้อความซ้ำกันใช้ intent เดียวกัน, search ซ้ำกันใช้ cache/coalescing"""
+    started = time.perf_counter()
+    result = {"index": index, "id": item.id if item.id is not None else str(index)}
+    # แต่ละข้อความมี deadline รอ provider token ของตัวเอง ไม่ใช่ของทั้ง batch
+    with provider_deadline(ADMISSION_REQUEST_DEADLINE):
+        session = await session_store.get_or_create(item.session_id) if item.session_id else None
+        context = session.context_text() if session else ""
+        try:
+            if context:
+                intent_data = await analyze_intent(item.message, session)
+            else:
+                intent_data = await intents.run(dedupe_key(item.message), lambda: analyze_intent(item.message))
+            all_search_results, plan_execution = await run_plan(intent_data)
+            ai_text = build_template_reply(intent_data, all_search_results) if batch.reply_mode != "llm" else None
+            if ai_text is None:
+                response = await gemini_call("reply", build_reply_prompt(item.message, intent_data,
+                                                                         all_search_results, context))
+                ai_text = response.text
+        except Overloaded as e:
+            return dict(result, status="throttled", error=str(e), retry_after=round(e.retry_after, 1))
+    if session is not None:
+        await finish_turn(session, item.message, intent_data, ai_text)
+        result["session_id"] = session.session_id
+    return dict(
+        result,
+        status="ok",
+        response=ai_text,
+        has_travel_intent=any(all_search_results.values()),
+        search_results=await shape_results(batch, all_search_results),
+        plan_execution=plan_execution,
+        elapsed_ms=elapsed_ms(started)
+    )
+
+async def batch_results(batch: BatchChatRequest):
+    """ผลของแต่ละข้อความตามลำดับที่เสร็จ แล้วปิดท้ายด้วย {"done": true, "summary": ...}"""
+    started = time.perf_counter()
+    calls_before = provider_calls()
+    intents = SharedTasks()
+    counts = {"ok": 0, "errors": 0}
+    status = "error"
+    log.info("📦 Batch: %d messages", len(batch.items))
+    try:
+        async for result in run_batch(batch.items, lambda i, item: answer_batch_item(batch, i, item, intents),
+                                      BATCH_CONCURRENCY):
+            counts["ok" if result.get("status") == "ok" else "errors"] += 1
+            yield result
+        calls = provider_calls() - calls_before
+        elapsed = time.perf_counter() - started
+        summary = {
+            "items": len(batch.items),
+            "ok": counts["ok"],
+            "errors": counts["errors"],
+            "distinct_messages": len(intents),
+            "shared_intents": intents.shared,
+            # นับ call ทั้ง worker ระหว่าง batch (รวม request อื่นที่เข้ามาพร้อมกัน)
+            "provider_calls": calls,
+            "items_per_provider_call": round(len(batch.items) / calls, 2) if calls else None,
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "items_per_second": round(len(batch.items) / elapsed, 1) if elapsed else None
+        }
+        batch_jobs.record(summary)
+        log.info("📦 Batch done: %s", summary)
+        status = "ok"
+        yield {"done": True, "summary": summary}
+    finally:
+        intents.cancel()
+        REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint="/api/chat/batch", status=status)
+
+def ndjson_line(data: Any) -> bytes:
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS) + b"\n"
+
+def check_batch(batch: BatchChatRequest):
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="items is empty")
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"at most {BATCH_MAX_ITEMS} items per batch")
+
+@app.post("/api/chat/batch")
+async def chat_batch(batch: BatchChatRequest, http_request: Request):
+    """หลายข้อความใน request เดียว: ผลแต่ละข้อความเป็น NDJSON หนึ่งบรรทัดทันทีที่เสร็จ บรรทัดสุดท้ายคือ summary"""
+    check_batch(batch)
+    ticket = await admit_request(http_request, "low")  # ทั้ง batch ใช้ slot เดียว ลำดับต่ำกว่าแชทของผู้ใช้
+
+    async def lines():
+        async for result in batch_results(batch):
+            yield ndjson_line(result)
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
+        background=BackgroundTask(release_slot, ticket)
+    )
+
+@app.post("/api/chat/batch/jobs", status_code=202)
+async def submit_batch_job(batch: BatchChatRequest, http_request: Request):
+    """Batch แบบ async: ได้ job_id กลับทันที แล้ว poll ผลที่ GET /api/chat/batch/jobs/{job_id}"""
+    check_batch(batch)
+    # ตรวจ rate ของ client ตอนส่ง job; job ทำงานเบื้องหลังโดยจำกัดจำนวน job พร้อมกัน (BATCH_MAX_RUNNING_JOBS)
+    admission.release(await admit_request(http_request, "low"))
+
+    async def collect(job):
+        async for result in batch_results(batch):
+            if result.get("done"):
+                job.summary = result["summary"]
+            else:
+                await batch_jobs.add_result(job, result)
+
+    job = await batch_jobs.submit(len(batch.items), collect)
+    return ORJSONResponse({
+        "job_id": job.job_id,
+        "status": job.status,
+        "total": job.total,
+        "status_url": f"/api/chat/batch/jobs/{job.job_id}"
+    }, status_code=202)
+
+@app.get("/api/chat/batch/jobs/{job_id}")
+async def batch_job_status(job_id: str, offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000),
+                           format: str = "json"):
+    """สถานะ/ความคืบหน้าของ job และผลที่เสร็จแล้วทีละช่วง (offset/limit); format=ndjson ส่งผลเป็น NDJSON"""
+    view = await batch_jobs.view(job_id, offset, limit)
+    if view is None:
+        raise HTTPException(status_code=404, detail="batch job expired or unknown")
+    if format == "ndjson":
+        results = view.pop("results")
+        body = b"".join(ndjson_line(r) for r in results) + ndjson_line({"done": True, **view})
+        return PlainTextResponse(body, media_type="application/x-ndjson")
+    return ORJSONResponse(view)
+
+@app.delete("/api/chat/batch/jobs/{job_id}")
+async def cancel_batch_job(job_id: str):
+    """ยกเลิก job ที่ยังไม่เสร็จ (ผลที่เสร็จแล้วยังดูได้จนหมดอายุ)"""
+    if not await batch_jobs.cancel(job_id):
+        raise HTTPException(status_code=404, detail="batch job expired or unknown")
+    await asyncio.sleep(0)  # ให้ task รับ CancelledError ก่อนตอบสถานะ
+    return ORJSONResponse(await batch_jobs.view(job_id, limit=0))
+
+@app.get("/api/results/{result_id}")
+async def result_page(result_id: str, cursor: Optional[str] = None,
+                      limit: int = Query(RESULT_PAGE_SIZE, le=RESULT_MAX_PAGE_SIZE),
+                      sort: Optional[str] = None, fields: Optional[str] = None):
+    """หน้าถัดไป / เรียงใหม่ / เลือก field ของผลค้นหาที่เก็บไว้ โดยไม่ต้องค้นหา upstream ใหม่
+
+    sort: price, -price, duration, stops (flights), name (hotels); cursor มาจาก next_cursor
+    และจำ sort เดิมไว้ในตัว; fields คั่นด้วย comma เช่น "price,currency,segments"
+    """
+    offset = 0
+    if cursor:
+        try:
+            cursor_id, offset, sort = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if cursor_id != result_id:
+            raise HTTPException(status_code=400, detail="cursor belongs to another result set")
+    result_set = await result_store.get(result_id)
+    if result_set is None:
+        # หมดอายุ (RESULT_SET_TTL) หรือถูก evict → client ต้องค้นหาใหม่
+        raise HTTPException(status_code=404, detail="result set expired or unknown")
+    selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    try:
+        page = result_store.page(result_set, offset=offset, limit=limit, sort=sort, fields=selected)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ORJSONResponse(dict(page, kind=result_set.kind))
+
+startup_timer.imported()
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
+    parser = argparse.ArgumentParser(description="AI Travel Agent backend")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")),
+                        help="worker processes (default: WEB_CONCURRENCY or 1)")
+    args = parser.parse_args()
     print("\n🚀 Starting AI Travel Agent Backend...")
-    print("📍 Backend: http://localhost:8000")
-    print("📚 API Docs: http://localhost:8000/docs")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    print(f"📍 Backend: http://localhost:{args.port} ({args.workers} worker{'s' if args.workers > 1 else ''})")
+    print(f"📚 API Docs: http://localhost:{args.port}/docs")
+    if args.workers > 1:
+        # worker แต่ละตัว import main ใหม่และอ่าน env นี้: cache, session, result set, batch job
+        # และ rate limit อยู่ใน SQLite ที่ใช้ร่วมกัน (ดู state.py) เว้นแต่ตั้ง STATE_BACKEND ไว้เอง
+        os.environ.setdefault("STATE_BACKEND", "sqlite")
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)),
+                    timeout_graceful_shutdown=SHUTDOWN_GRACE_PERIOD)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port, timeout_graceful_shutdown=SHUTDOWN_GRACE_PERIOD)
\ No newline at end of file
@@ -0,0 +1,120 @@
+"""Local mock of the Amadeus REST API for testing the pooled HTTP transport.
+
+Unlike fake_providers.py, which replaces the SDK client object, this serves
+real HTTP (HTTP/1.1 keep-alive) so the actual ``amadeus.Client`` and the
+shared connection pool in http_pool.py are exercised end to end:
+
+    python mock_amadeus.py --port 8081 --latency-ms 50
+    AMADEUS_HOST=localhost AMADEUS_PORT=8081 AMADEUS_SSL=0 uvicorn main:app
+
+It answers the OAuth token request and the three search endpoints with the
+recorded payloads in fixtures/. ``GET /__stats`` returns how many TCP
+connections and requests it has seen, so connection reuse can be checked.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+from fake_providers import load_fixture
+
+ROUTES = {
+    "/v2/shopping/flight-offers": "amadeus_flight_offers.json",
+    "/v1/reference-data/locations/hotels/by-city": "amadeus_hotel_list.json",
+    "/v3/shopping/hotel-offers": "amadeus_hotel_offers.json",
+}
+
+
+class MockAmadeusServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms: float = 0.0):
+        super().__init__(address, MockAmadeusHandler)
+        self.latency_s = latency_ms / 1000
+        self.payloads = {path: json.dumps(load_fixture(name)).encode() for path, name in ROUTES.items()}
+        self.connections = 0
+        self.requests = 0
+        self.tokens_issued = 0
+        self._lock = threading.Lock()
+
+    def count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"connections": self.connections, "requests": self.requests, "tokens_issued": self.tokens_issued}
+
+
+class MockAmadeusHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        super().setup()
+        self.server.count("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/vnd.amadeus+json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status: int, title: str):
+        self._send(status, json.dumps({"errors": [{"status": status, "title": title}]}).encode())
+
+    def do_POST(self):
+        self.server.count("requests")
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        if urlsplit(self.path).path != "/v1/security/oauth2/token":
+            return self._error(404, "NOT FOUND")
+        self.server.count("tokens_issued")
+        token = {"type": "amadeusOAuth2Token", "access_token": "mock-token", "expires_in": 1799,
+                 "token_type": "Bearer", "state": "approved"}
+        self._send(200, json.dumps(token).encode(), "application/json")
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/__stats":
+            return self._send(200, json.dumps(self.server.stats()).encode(), "application/json")
+        self.server.count("requests")
+        if self.headers.get("Authorization") != "Bearer mock-token":
+            return self._error(401, "Invalid access token")
+        payload = self.server.payloads.get(path)
+        if payload is None:
+            return self._error(404, "NOT FOUND")
+        if self.server.latency_s:
+            time.sleep(self.server.latency_s)
+        self._send(200, payload)
+
+
+def start_mock_server(port: int = 0, latency_ms: float = 0.0, host: str = "127.0.0.1") -> MockAmadeusServer:
+    """Serve in a background thread; ``server.server_port`` is the bound port"""
+    server = MockAmadeusServer((host, port), latency_ms)
+    threading.Thread(target=server.serve_forever, name="mock-amadeus", daemon=True).start()
+    return server
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Local mock of the Amadeus API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=float(os.getenv("MOCK_AMADEUS_LATENCY_MS", "0")))
+    args = parser.parse_args(argv)
+    server = MockAmadeusServer((args.host, args.port), args.latency_ms)
+    print(f"🧪 Mock Amadeus API on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
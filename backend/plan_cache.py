@@ -0,0 +1,224 @@
+"""Cache for the Gemini planning step (Step 1 of chat).
+
+The analysis prompt embeds today's date, so every entry is scoped to the day
+it was created. Lookups try, in order:
+
+1. an exact match on the normalized message (hash map), then
+2. a near-duplicate: an entry with the same entity signature (tools, place
+   codes, dates and numbers found by ``intent_parser``, plus month names,
+   relative time words and the flexible / round-trip modifiers) whose
+   character trigram vector has cosine similarity >= ``PLAN_CACHE_SIMILARITY``.
+   The signature cannot see every phrase that changes a plan ("after
+   Songkran"), so a matching signature alone is never enough. Places carry
+   their direction ("from Bangkok" vs "to Bangkok"), so a reversed route
+   never matches.
+
+Plans made with session context are cached too. A message that names its
+tool, places and dates without referring back ("there", "same dates") is
+planned the same with or without context and shares the context-free
+entries; a follow-up is keyed on the trip slots it was resolved against
+(see ``depends_on_context``).
+
+Entries are evicted least-recently-used beyond ``PLAN_CACHE_MAX_ENTRIES``.
+"""
+import copy
+import math
+import os
+import re
+from collections import Counter, OrderedDict
+from datetime import date
+from typing import Any, Dict, Optional, Tuple
+
+from intent_parser import (
+    EN_MONTHS, THAI_MONTHS, detect_tools, extract_dates, extract_places, extract_window, is_flexible, is_negated,
+    place_role,
+)
+
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "2048"))
+PLAN_CACHE_SIMILARITY = float(os.getenv("PLAN_CACHE_SIMILARITY", "0.85"))
+# Near-duplicate candidates compared per lookup (most recent first)
+PLAN_CACHE_MAX_CANDIDATES = int(os.getenv("PLAN_CACHE_MAX_CANDIDATES", "64"))
+
+
+ROUND_TRIP_RE = re.compile(r"ไป-?กลับ|(?<![a-z])(?:round[ -]?trips?|return(?:ing)?|two[ -]way)(?![a-z])")
+# Time words the date parser does not turn into dates ("next month", "in two weeks")
+RELATIVE_TIME_RE = re.compile(
+    r"เดือน\S*|สัปดาห์\S*|อาทิตย์\S*|ปี\S*|สุดสัปดาห์|"
+    r"(?<![a-z])(?:next|this|last|coming|in|within|after|before|early|mid|late|end of)?\s*"
+    r"(?:one|two|three|four|five|six|a|\d+)?\s*(?:months?|weeks?|weekends?|years?|days?|nights?)(?![a-z])"
+)
+MONTH_RE = re.compile(
+    r"(?<![a-z])(" + "|".join(sorted(EN_MONTHS, key=len, reverse=True)) + r")(?![a-z])|("
+    + "|".join(re.escape(m) for m in sorted(THAI_MONTHS, key=len, reverse=True)) + ")"
+)
+
+
+# "there", "same dates", "ที่นั่น", "วันเดิม": the message points at earlier turns
+FOLLOW_UP_RE = re.compile(
+    r"ที่นั่น|ที่เดิม|เดิม|นั้น|ด้วย|แทน|ล่ะ|"
+    r"(?<![a-z])(?:there|same|that|those|these|it|them|again|also|too|instead|another|other)(?![a-z])"
+)
+
+
+def normalize_message(message: str) -> str:
+    text = re.sub(r"[^\w\s฀-๿-]", " ", message.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def trigrams(text: str) -> Counter:
+    padded = f"  {text} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def entity_signature(message: str, today: date) -> Tuple:
+    """Everything in the message that can change the plan, in message order"""
+    dates = extract_dates(message, today)
+    lowered = message.lower()
+    return (
+        tuple(sorted(detect_tools(message))),
+        tuple((code, place_role(message, start)) for start, _, code, _ in extract_places(message)),
+        tuple(d.isoformat() for _, d in dates) if dates is not None else ("invalid",),
+        tuple(d.isoformat() for d in extract_window(message, today) or ()),
+        tuple(re.findall(r"\d+", message)),
+        tuple(EN_MONTHS[en] if en else THAI_MONTHS[th] for en, th in MONTH_RE.findall(lowered)),
+        tuple(re.sub(r"\s+", " ", m.group(0)).strip() for m in RELATIVE_TIME_RE.finditer(lowered)),
+        is_flexible(message),
+        ROUND_TRIP_RE.search(lowered) is not None,
+        is_negated(message),
+    )
+
+
+def depends_on_context(message: str, today: date) -> bool:
+    """Whether the session context can change the plan for ``message``
+
+    False only when the message names a tool, every place that tool needs
+    (two for flights) and a date, and does not refer back to earlier turns.
+    """
+    tools = detect_tools(message)
+    if not tools or FOLLOW_UP_RE.search(message.lower()):
+        return True
+    places = {code for _, _, code, _ in extract_places(message)}
+    if len(places) < (2 if "search_flights" in tools else 1):
+        return True
+    dates = extract_dates(message, today)
+    return not dates and extract_window(message, today) is None
+
+
+def _slots_key(slots: Optional[Dict[str, str]]) -> str:
+    return "&".join(f"{name}={value}" for name, value in sorted((slots or {}).items()))
+
+
+class _Entry:
+    __slots__ = ("key", "signature", "grams", "norm", "intent_data", "latency_s")
+
+    def __init__(self, key, signature, grams, intent_data, latency_s):
+        self.key = key
+        self.signature = signature
+        self.grams = grams
+        self.norm = math.sqrt(sum(c * c for c in grams.values()))
+        self.intent_data = intent_data
+        self.latency_s = latency_s
+
+
+class PlanCache:
+    """Day-scoped exact + near-duplicate cache of intent analysis results."""
+
+    def __init__(self, max_entries: int = PLAN_CACHE_MAX_ENTRIES, threshold: float = PLAN_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._by_signature: Dict[Tuple, "OrderedDict[str, None]"] = {}
+        self._day: Optional[str] = None
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_s = 0.0
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        bucket = self._by_signature.get(entry.signature)
+        if bucket is not None:
+            bucket.pop(key, None)
+            if not bucket:
+                del self._by_signature[entry.signature]
+
+    def _hit(self, entry: _Entry) -> Dict[str, Any]:
+        self._entries.move_to_end(entry.key)
+        self._by_signature[entry.signature].move_to_end(entry.key)
+        self.saved_s += entry.latency_s
+        return copy.deepcopy(entry.intent_data)
+
+    @staticmethod
+    def _similarity(grams: Counter, norm: float, entry: _Entry) -> float:
+        if not norm or not entry.norm:
+            return 0.0
+        dot = sum(count * entry.grams.get(gram, 0) for gram, count in grams.items())
+        return dot / (norm * entry.norm)
+
+    def get(self, message: str, today: Optional[date] = None,
+            slots: Optional[Dict[str, str]] = None) -> Optional[Dict[str, Any]]:
+        """Cached plan for ``message``; ``slots`` are the trip slots a follow-up was resolved against"""
+        today = today or date.today()
+        normalized = normalize_message(message)
+        context = _slots_key(slots)
+        entry = self._entries.get(f"{today.isoformat()}|{context}|{normalized}")
+        if entry is not None:
+            self.exact_hits += 1
+            return self._hit(entry)
+
+        signature = (today.isoformat(), context) + entity_signature(message, today)
+        bucket = self._by_signature.get(signature)
+        if bucket:
+            grams = trigrams(normalized)
+            norm = math.sqrt(sum(c * c for c in grams.values()))
+            for checked, key in enumerate(reversed(bucket)):
+                if checked >= PLAN_CACHE_MAX_CANDIDATES:
+                    break
+                candidate = self._entries[key]
+                if self._similarity(grams, norm, candidate) >= self.threshold:
+                    self.near_hits += 1
+                    return self._hit(candidate)
+
+        self.misses += 1
+        return None
+
+    def put(self, message: str, intent_data: Dict[str, Any], latency_s: float, today: Optional[date] = None,
+            slots: Optional[Dict[str, str]] = None):
+        today = today or date.today()
+        day = today.isoformat()
+        normalized = normalize_message(message)
+        context = _slots_key(slots)
+        key = f"{day}|{context}|{normalized}"
+        if key in self._entries:
+            self._remove(key)
+
+        if day != self._day:
+            # Plans from earlier days are never served again
+            self._entries.clear()
+            self._by_signature.clear()
+            self._day = day
+
+        signature = (day, context) + entity_signature(message, today)
+        self._entries[key] = _Entry(key, signature, trigrams(normalized), copy.deepcopy(intent_data), latency_s)
+        self._by_signature.setdefault(signature, OrderedDict())[key] = None
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.exact_hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "similarity_threshold": self.threshold,
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.exact_hits + self.near_hits) / lookups, 3) if lookups else 0.0,
+            "saved_latency_ms": round(self.saved_s * 1000, 1),
+        }
+
+
+plan_cache = PlanCache()
@@ -0,0 +1,161 @@
+"""Concurrent executor for the tool plan produced by the intent analysis step.
+
+Steps with no declared dependencies all start at once, so a
+"flight + hotel + car" plan takes as long as its slowest search instead of
+the sum of all three. A step may name the steps it needs with
+``"depends_on": ["<id>", ...]`` (ids default to the step's index in the
+plan, made unique if another step already uses it); it then starts only after those finished and receives their results.
+Every step runs under its own timeout and failures stay local to the step,
+so the caller always gets whatever partial results were produced.
+"""
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from resilience import max_call_seconds
+from telemetry import span
+
+# Steps are Amadeus searches; a hotel search can make two calls in a row (hotel list, then offers).
+# The default leaves room for every retry so the planner does not cancel calls that are still retrying.
+PLAN_STEP_TIMEOUT = float(os.getenv("PLAN_STEP_TIMEOUT", str(2 * max_call_seconds("amadeus"))))
+
+StepHandler = Callable[[Dict[str, Any], Dict[str, Any]], Awaitable[Any]]
+StepCallback = Callable[["StepResult"], Awaitable[None]]
+
+
+@dataclass
+class StepResult:
+    id: str
+    tool: Optional[str]
+    status: str  # "ok", "error", "timeout" or "skipped"
+    value: Any = None
+    error: Optional[str] = None
+    elapsed_ms: float = 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        """JSON-friendly view without the (possibly large) result value"""
+        info = {"id": self.id, "tool": self.tool, "status": self.status, "elapsed_ms": round(self.elapsed_ms, 1)}
+        if self.error:
+            info["error"] = self.error
+        return info
+
+
+def _step_ids(plan: List[Dict[str, Any]]) -> List[str]:
+    """Unique id per step: its own ``id`` (first use wins), else its index, suffixed if that is taken"""
+    explicit = [str(step["id"]) if step.get("id") is not None else None for step in plan]
+    taken = set(explicit) - {None}
+    owners = {}
+    for index, step_id in enumerate(explicit):
+        owners.setdefault(step_id, index)
+    ids = []
+    for index, step_id in enumerate(explicit):
+        if step_id is None or owners[step_id] != index:
+            step_id, n = str(index), 1
+            while step_id in taken:
+                step_id, n = f"{index}.{n}", n + 1
+            taken.add(step_id)
+        ids.append(step_id)
+    return ids
+
+
+def _dependencies(step: Dict[str, Any]) -> List[str]:
+    deps = step.get("depends_on") or []
+    if isinstance(deps, (str, int)):
+        deps = [deps]
+    return [str(d) for d in deps]
+
+
+def _find_cycles(graph: Dict[str, List[str]]) -> set:
+    """Return ids of steps that sit on (or depend on) a dependency cycle"""
+    state: Dict[str, int] = {}  # 1 = visiting, 2 = done
+    bad = set()
+
+    def visit(node: str) -> bool:
+        if state.get(node) == 1:
+            return True
+        if state.get(node) == 2:
+            return node in bad
+        state[node] = 1
+        cyclic = False
+        for dep in graph.get(node, []):
+            if dep in graph and visit(dep):
+                cyclic = True
+        state[node] = 2
+        if cyclic:
+            bad.add(node)
+        return cyclic
+
+    for node in graph:
+        visit(node)
+    return bad
+
+
+async def execute_plan(
+    plan: List[Dict[str, Any]],
+    handlers: Dict[str, StepHandler],
+    step_timeout: float = PLAN_STEP_TIMEOUT,
+    on_result: Optional[StepCallback] = None,
+) -> List[StepResult]:
+    """Run every step of ``plan`` as early as its dependencies allow.
+
+    ``handlers`` maps a tool name to ``async handler(step, inputs)`` where
+    ``inputs`` holds the values of the step's dependencies keyed by id.
+    ``on_result`` is awaited with each result as soon as its step finishes.
+    Results are returned in plan order.
+    """
+    steps = dict(zip(_step_ids(plan), plan))
+
+    graph = {step_id: _dependencies(step) for step_id, step in steps.items()}
+    cyclic = _find_cycles(graph)
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run_step(step_id: str) -> StepResult:
+        step = steps[step_id]
+        tool = step.get("tool")
+        started = time.perf_counter()
+
+        def result(status, value=None, error=None):
+            return StepResult(step_id, tool, status, value, error, (time.perf_counter() - started) * 1000)
+
+        if step_id in cyclic:
+            return result("skipped", error="dependency cycle")
+        missing = [dep for dep in graph[step_id] if dep not in steps]
+        if missing:
+            return result("skipped", error=f"unknown dependency: {', '.join(missing)}")
+
+        inputs = {}
+        for dep in graph[step_id]:
+            dep_result = await tasks[dep]
+            if dep_result.status != "ok":
+                return result("skipped", error=f"dependency {dep} {dep_result.status}")
+            inputs[dep] = dep_result.value
+
+        handler = handlers.get(tool)
+        if handler is None:
+            return result("skipped", error=f"unknown tool: {tool}")
+
+        started = time.perf_counter()  # time the step itself, not the wait for its dependencies
+        with span(f"plan.{tool}", step_id=step_id) as trace:
+            try:
+                value = await asyncio.wait_for(handler(step, inputs), timeout=step_timeout)
+            except asyncio.TimeoutError:
+                outcome = result("timeout", error=f"no result after {step_timeout:g}s")
+            except Exception as e:
+                outcome = result("error", error=str(e))
+            else:
+                outcome = result("ok", value)
+            trace.set(status=outcome.status)
+            trace.error = outcome.error if outcome.status != "ok" else None
+        return outcome
+
+    async def run_and_report(step_id: str) -> StepResult:
+        result = await run_step(step_id)
+        if on_result is not None:
+            await on_result(result)
+        return result
+
+    for step_id in steps:
+        tasks[step_id] = asyncio.create_task(run_and_report(step_id))
+    return list(await asyncio.gather(*tasks.values()))
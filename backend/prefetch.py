@@ -0,0 +1,230 @@
+"""Background cache warming for the routes and cities users ask for most.
+
+Every live search (see ``search_flights`` / ``search_hotels`` /
+``search_car_rentals`` in main.py) is recorded as a query pattern: the
+tool, its places, how many days ahead the trip starts and how long it is
+(BKK→NRT leaving in 7 days for 3 nights, TYO hotels from tomorrow for
+2 nights). Scores decay with a half-life of ``PREFETCH_HALF_LIFE`` seconds,
+so the top ``PREFETCH_TOP_N`` patterns follow recent traffic.
+
+Every ``PREFETCH_INTERVAL`` seconds the scheduler (started from the app
+lifespan) walks the top patterns and, for the next ``PREFETCH_DAYS`` start
+dates of each, refreshes result cache entries that are missing or expire
+within ``PREFETCH_REFRESH_BEFORE`` seconds. It never competes with live
+traffic:
+
+- upstream searches are capped at ``PREFETCH_CALLS_PER_HOUR`` (a hotel
+  search counts as two calls: hotel list and offers);
+- a pass stops as soon as more than ``PREFETCH_MAX_ACTIVE_REQUESTS`` chat
+  requests are running or provider calls are queueing;
+- its provider calls do not wait for rate-limit tokens, so an empty
+  provider bucket skips the search instead of delaying live requests.
+
+Each worker learns and prefetches on its own; with the shared sqlite cache
+a worker sees entries refreshed by the others and skips them.
+"""
+import asyncio
+import os
+import time
+from collections import defaultdict, deque
+from datetime import date, timedelta
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from admission import admission, provider_deadline
+from cache import make_key, result_cache
+from providers import provider_executor
+from telemetry import log
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", "60"))
+PREFETCH_TOP_N = int(os.getenv("PREFETCH_TOP_N", "10"))
+PREFETCH_DAYS = int(os.getenv("PREFETCH_DAYS", "3"))
+PREFETCH_CALLS_PER_HOUR = int(os.getenv("PREFETCH_CALLS_PER_HOUR", "120"))
+PREFETCH_REFRESH_BEFORE = float(os.getenv("PREFETCH_REFRESH_BEFORE", str(2 * PREFETCH_INTERVAL)))
+PREFETCH_HALF_LIFE = float(os.getenv("PREFETCH_HALF_LIFE", "21600"))
+PREFETCH_MAX_ACTIVE_REQUESTS = int(os.getenv("PREFETCH_MAX_ACTIVE_REQUESTS", "2"))
+PREFETCH_MAX_LEAD_DAYS = int(os.getenv("PREFETCH_MAX_LEAD_DAYS", "60"))
+PREFETCH_MAX_PATTERNS = int(os.getenv("PREFETCH_MAX_PATTERNS", "1000"))
+# a search that came back empty or failed is not retried before this many seconds
+PREFETCH_RETRY_AFTER = float(os.getenv("PREFETCH_RETRY_AFTER", "900"))
+
+# date parameters of each cached tool: the first is the trip start, the others are kept relative to it
+DATE_FIELDS = {
+    "flights": ("departure_date", "return_date"),
+    "hotels": ("check_in", "check_out"),
+    "cars": ("pick_up_date", "drop_off_date"),
+}
+# upstream calls per search, charged against the hourly budget
+CALL_COSTS = {"flights": 1, "hotels": 2, "cars": 1}
+
+# (tool, fixed params, days until start, other dates relative to start)
+Pattern = Tuple[str, Tuple[Tuple[str, Any], ...], int, Tuple[Optional[int], ...]]
+Runner = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class PrefetchScheduler:
+    """Learns popular query patterns and keeps their next few days cached."""
+
+    def __init__(self, cache, runners: Optional[Dict[str, Runner]] = None,
+                 calls_per_hour: int = PREFETCH_CALLS_PER_HOUR, top_n: int = PREFETCH_TOP_N,
+                 days: int = PREFETCH_DAYS):
+        self.cache = cache
+        self.runners: Dict[str, Runner] = dict(runners or {})
+        self.calls_per_hour = calls_per_hour
+        self.top_n = top_n
+        self.days = days
+        self._scores: Dict[Pattern, Tuple[float, float]] = {}  # score, updated_at
+        self._calls: Deque[Tuple[float, int]] = deque()  # (time, cost) of the last hour
+        self._retry_at: Dict[str, float] = {}
+        self.recorded = 0
+        self.passes = 0
+        self.refreshed: Dict[str, int] = defaultdict(int)
+        self.failed: Dict[str, int] = defaultdict(int)
+        self.skipped_busy = 0
+        self.skipped_budget = 0
+
+    def register(self, tool: str, runner: Runner):
+        """``runner(params)`` re-runs a search with the cache params of ``tool``, bypassing the cache"""
+        self.runners[tool] = runner
+
+    # --- learning ---
+
+    def _decayed(self, pattern: Pattern, now: float) -> float:
+        score, updated = self._scores.get(pattern, (0.0, now))
+        return score * 0.5 ** ((now - updated) / PREFETCH_HALF_LIFE)
+
+    def record(self, tool: str, params: Dict[str, Any]):
+        """Count a live search (dates are stored relative to today)"""
+        fields = DATE_FIELDS.get(tool)
+        if not fields:
+            return
+        try:
+            start = date.fromisoformat(params[fields[0]])
+            others = tuple((date.fromisoformat(params[f]) - start).days if params.get(f) else None
+                           for f in fields[1:])
+        except (KeyError, TypeError, ValueError):
+            return
+        lead = (start - date.today()).days
+        if not 0 <= lead <= PREFETCH_MAX_LEAD_DAYS:
+            return
+        fixed = tuple(sorted((k, v) for k, v in params.items() if k not in fields and v not in (None, "")))
+        pattern = (tool, fixed, lead, others)
+        now = time.time()
+        self._scores[pattern] = (self._decayed(pattern, now) + 1, now)
+        self.recorded += 1
+        if len(self._scores) > PREFETCH_MAX_PATTERNS:
+            for stale in self.top(len(self._scores))[PREFETCH_MAX_PATTERNS:]:
+                del self._scores[stale]
+
+    def top(self, n: Optional[int] = None) -> List[Pattern]:
+        now = time.time()
+        ranked = sorted(self._scores, key=lambda p: self._decayed(p, now), reverse=True)
+        return ranked[:self.top_n if n is None else n]
+
+    def targets(self, pattern: Pattern) -> Iterator[Dict[str, Any]]:
+        """Cache params for the pattern's next ``days`` start dates"""
+        tool, fixed, lead, others = pattern
+        fields = DATE_FIELDS[tool]
+        for offset in range(self.days):
+            start = date.today() + timedelta(days=lead + offset)
+            params = dict(fixed)
+            params[fields[0]] = start.isoformat()
+            for name, days in zip(fields[1:], others):
+                params[name] = (start + timedelta(days=days)).isoformat() if days is not None else None
+            yield params
+
+    # --- budget / load ---
+
+    def calls_last_hour(self) -> int:
+        cutoff = time.time() - 3600
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+        return sum(cost for _, cost in self._calls)
+
+    def _spend(self, tool: str) -> bool:
+        cost = CALL_COSTS.get(tool, 1)
+        if self.calls_last_hour() + cost > self.calls_per_hour:
+            return False
+        self._calls.append((time.time(), cost))
+        return True
+
+    def _busy(self) -> bool:
+        if admission.active > PREFETCH_MAX_ACTIVE_REQUESTS:
+            return True
+        return any(lane["waiting"] for lane in provider_executor.stats()["providers"].values())
+
+    # --- warming ---
+
+    async def run_once(self) -> int:
+        """One warming pass over the top patterns; returns the number of searches made"""
+        self.passes += 1
+        searches = 0
+        now = time.time()
+        self._retry_at = {key: at for key, at in self._retry_at.items() if at > now}
+        for pattern in self.top():
+            tool = pattern[0]
+            runner = self.runners.get(tool)
+            if runner is None:
+                continue
+            for params in self.targets(pattern):
+                remaining = await self.cache.expires_in(tool, params)
+                if remaining is not None and remaining > PREFETCH_REFRESH_BEFORE:
+                    continue
+                key = make_key(tool, params)
+                if self._retry_at.get(key, 0) > time.time():
+                    continue
+                if self._busy():
+                    self.skipped_busy += 1
+                    return searches
+                if not self._spend(tool):
+                    self.skipped_budget += 1
+                    return searches
+                searches += 1
+                try:
+                    with provider_deadline(0):
+                        value = await runner(params)
+                except Exception as e:
+                    log.warning("⚠️ Prefetch %s %s failed: %s", tool, params, e)
+                    value = None
+                if value is None:
+                    self.failed[tool] += 1
+                    self._retry_at[key] = time.time() + PREFETCH_RETRY_AFTER
+                else:
+                    self.refreshed[tool] += 1
+                    self._retry_at.pop(key, None)
+        if searches:
+            log.info("🔥 Prefetched %d searches (%d/%d calls this hour)", searches, self.calls_last_hour(),
+                     self.calls_per_hour)
+        return searches
+
+    async def run(self, interval: float = PREFETCH_INTERVAL):
+        """Scheduler loop (cancelled at shutdown)"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                log.warning("⚠️ Prefetch pass failed: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "enabled": PREFETCH_ENABLED,
+            "patterns": len(self._scores),
+            "recorded": self.recorded,
+            "top": [
+                {"tool": tool, **dict(fixed), "days_ahead": lead, "relative_days": list(others),
+                 "score": round(self._decayed((tool, fixed, lead, others), now), 2)}
+                for tool, fixed, lead, others in self.top()
+            ],
+            "passes": self.passes,
+            "calls_last_hour": self.calls_last_hour(),
+            "calls_per_hour": self.calls_per_hour,
+            "refreshed": dict(self.refreshed),
+            "failed": dict(self.failed),
+            "skipped_busy": self.skipped_busy,
+            "skipped_budget": self.skipped_budget,
+        }
+
+
+prefetcher = PrefetchScheduler(result_cache)
@@ -0,0 +1,154 @@
+"""Non-blocking execution layer for the blocking Gemini and Amadeus SDK calls.
+
+Both SDKs are synchronous, so every call is handed to a bounded thread pool
+instead of running on the uvicorn event loop. Each provider gets its own
+concurrency limit ("lane") so a burst of Gemini calls cannot starve Amadeus
+searches, and each lane keeps queue-depth counters for monitoring.
+
+A caller that sets a ``LaneTicket`` (see ``lane_ticket``) learns whether
+the call is queued for a lane slot and when it got one; resilience.py
+starts the provider timeout from that moment, so a saturated local pool is
+not mistaken for a slow provider.
+"""
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+PROVIDER_LIMITS = {
+    "gemini": int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")),
+    "amadeus": int(os.getenv("AMADEUS_MAX_CONCURRENCY", "8")),
+}
+
+
+class ProviderLane:
+    """Concurrency limit and queue counters for a single provider."""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.waiting = 0
+        self.active = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait_s = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        finished = self.completed + self.failed
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait_ms": round(self.total_wait_s * 1000 / finished, 2) if finished else 0.0,
+        }
+
+
+class LaneTicket:
+    """Queue state of one provider call: ``queued`` while it waits for a lane slot, ``started`` once it has one."""
+
+    __slots__ = ("queued", "started")
+
+    def __init__(self):
+        self.queued = False
+        self.started = asyncio.get_running_loop().create_future()  # resolves to the loop time of the slot
+
+
+lane_ticket: contextvars.ContextVar[Optional[LaneTicket]] = contextvars.ContextVar("lane_ticket", default=None)
+
+
+class ProviderExecutor:
+    """Runs blocking provider calls in a shared, bounded thread pool."""
+
+    def __init__(self, limits: Dict[str, int], max_workers: Optional[int] = None):
+        self.lanes = {name: ProviderLane(name, limit) for name, limit in limits.items()}
+        # One thread per permitted in-flight call, so a lane never waits on another lane's threads
+        self.max_workers = max_workers or sum(limits.values())
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="provider")
+
+    async def run(self, provider: str, fn: Callable, *args, **kwargs):
+        """Run ``fn(*args, **kwargs)`` in the pool under ``provider``'s concurrency limit."""
+        lane = self.lanes[provider]
+        loop = asyncio.get_running_loop()
+
+        ticket = lane_ticket.get()
+        queued_at = time.perf_counter()
+        lane.waiting += 1
+        lane.max_waiting = max(lane.max_waiting, lane.waiting)
+        try:
+            if ticket is not None:
+                ticket.queued = True
+            await lane.semaphore.acquire()
+        finally:
+            lane.waiting -= 1
+        lane.total_wait_s += time.perf_counter() - queued_at
+        lane.active += 1
+        if ticket is not None and not ticket.started.done():
+            ticket.started.set_result(loop.time())
+
+        def _on_done(future):
+            # Free the slot only when the thread is really done, even if the caller was cancelled
+            ok = not future.cancelled() and future.exception() is None
+            try:
+                loop.call_soon_threadsafe(self._release, lane, ok)
+            except RuntimeError:
+                pass  # event loop already closed
+
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(lane, False)
+            raise
+        future.add_done_callback(_on_done)
+        return await asyncio.wrap_future(future)
+
+    @staticmethod
+    def _release(lane: ProviderLane, ok: bool):
+        lane.active -= 1
+        if ok:
+            lane.completed += 1
+        else:
+            lane.failed += 1
+        lane.semaphore.release()
+
+    def inflight(self) -> int:
+        """Calls running in the pool or waiting for a lane slot"""
+        return sum(lane.active + lane.waiting for lane in self.lanes.values())
+
+    async def drain(self, timeout: float) -> bool:
+        """Wait for in-flight calls to finish (graceful shutdown); False when ``timeout`` passed first"""
+        deadline = time.monotonic() + timeout
+        while self.inflight():
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_workers": self.max_workers,
+            "providers": {name: lane.stats() for name, lane in self.lanes.items()},
+        }
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait, cancel_futures=not wait)
+
+
+_pool_size = os.getenv("PROVIDER_POOL_SIZE")
+provider_executor = ProviderExecutor(PROVIDER_LIMITS, int(_pool_size) if _pool_size else None)
+
+
+async def run_gemini(fn: Callable, *args, **kwargs):
+    """Run a blocking Gemini SDK call off the event loop."""
+    return await provider_executor.run("gemini", fn, *args, **kwargs)
+
+
+async def run_amadeus(fn: Callable, *args, **kwargs):
+    """Run a blocking Amadeus SDK call off the event loop."""
+    return await provider_executor.run("amadeus", fn, *args, **kwargs)
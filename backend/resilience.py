@@ -0,0 +1,309 @@
+"""Timeouts, retries, circuit breakers and hedged requests for provider calls.
+
+Every outbound call goes through ``call(provider, endpoint, run, ...)``:
+
+- each attempt is bounded by the provider's timeout, counted from the
+  moment it holds a slot in the local provider pool (providers.py): time
+  queued behind other calls in this worker is not the provider's fault and
+  never counts against its breaker;
+- transient failures (timeouts, connection errors, 429/5xx) of idempotent
+  calls are retried with jittered exponential backoff;
+- each (provider, endpoint) pair has a circuit breaker that opens after
+  ``BREAKER_FAILURE_THRESHOLD`` consecutive transient failures and fails
+  fast with ``CircuitOpenError`` until ``BREAKER_RESET_TIMEOUT`` has passed,
+  after which a single probe call decides whether it closes again;
+- optionally (``<PROVIDER>_HEDGE_AFTER``) a second identical request is
+  started when the first is slower than the given delay, and whichever
+  succeeds first wins.
+
+Before each attempt, hedges included, the call takes a token from the
+provider's global rate limit (see admission.py) and fails with
+``ProviderThrottledError`` when none is available in time; a hedge that
+finds no token or an open breaker is simply not sent.
+
+Breaker states are reported by ``breaker_states()`` for the health endpoint.
+Each call is traced as a ``provider.<provider>.<endpoint>`` span and counted
+in the ``provider_*`` metrics.
+"""
+import asyncio
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from admission import Overloaded, ProviderThrottledError, provider_limiter
+from providers import LaneTicket, lane_ticket
+from telemetry import PROVIDER_CALLS, PROVIDER_ERRORS, PROVIDER_LATENCY, span
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "2"))
+
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def _optional_float(name: str) -> Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+@dataclass
+class CallPolicy:
+    timeout: float
+    retries: int = 0
+    hedge_after: Optional[float] = None
+
+
+PROVIDER_POLICIES = {
+    "amadeus": CallPolicy(
+        timeout=float(os.getenv("AMADEUS_TIMEOUT", "10")),
+        retries=int(os.getenv("AMADEUS_RETRIES", "2")),
+        hedge_after=_optional_float("AMADEUS_HEDGE_AFTER"),
+    ),
+    "gemini": CallPolicy(
+        timeout=float(os.getenv("GEMINI_TIMEOUT", "30")),
+        retries=int(os.getenv("GEMINI_RETRIES", "0")),
+        hedge_after=_optional_float("GEMINI_HEDGE_AFTER"),
+    ),
+}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a provider whose breaker is open."""
+
+
+class ProviderTimeoutError(TimeoutError):
+    """A provider call did not finish within its policy timeout."""
+
+
+def status_code_of(exc: BaseException) -> Optional[int]:
+    """HTTP status of an SDK error (Amadeus ``response.status_code`` or google ``code``)"""
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    if status is None:
+        code = getattr(exc, "code", None)
+        status = code if isinstance(code, int) else None
+    return status
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Errors worth retrying and counting against the provider's health"""
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    return status_code_of(exc) in TRANSIENT_STATUS
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open probe."""
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self.state = "half_open"
+            self._probe_in_flight = False
+        if self.state == "half_open":
+            if self._probe_in_flight:
+                self.rejected += 1
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self._probe_in_flight = False
+
+    def release_probe(self):
+        """The half-open probe was cancelled before it had an outcome: let the next call probe instead"""
+        if self.state == "half_open":
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        info = {
+            "name": self.name,
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "successes": self.successes,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "times_opened": self.times_opened,
+        }
+        if self.state == "open":
+            info["retry_in_s"] = round(max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at)), 1)
+        return info
+
+
+_breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+hedges_started = 0
+hedges_skipped = 0
+
+
+def max_call_seconds(provider: str) -> float:
+    """Longest an idempotent ``call()`` can take: every attempt timing out plus the longest backoffs"""
+    policy = PROVIDER_POLICIES[provider]
+    attempt = policy.timeout + (policy.hedge_after or 0.0)  # a hedge gets its own full timeout
+    return attempt * (1 + policy.retries) + RETRY_MAX_DELAY * policy.retries
+
+
+def get_breaker(provider: str, endpoint: str) -> CircuitBreaker:
+    breaker = _breakers.get((provider, endpoint))
+    if breaker is None:
+        breaker = _breakers[(provider, endpoint)] = CircuitBreaker(f"{provider}.{endpoint}")
+    return breaker
+
+
+def breaker_states() -> List[Dict[str, Any]]:
+    return [breaker.snapshot() for breaker in _breakers.values()]
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for retry number ``attempt`` (0-based)"""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+async def _attempt(run: Callable[[], Awaitable[Any]], timeout: float):
+    """``run()`` timed out after ``timeout`` s of provider time (not counting a wait for a local lane slot)"""
+    loop = asyncio.get_running_loop()
+    ticket = LaneTicket()
+    token = lane_ticket.set(ticket)
+    try:
+        task = asyncio.ensure_future(run())
+    finally:
+        lane_ticket.reset(token)
+    started = loop.time()
+    try:
+        while not task.done():
+            if ticket.started.done():
+                started = ticket.started.result()
+            elif ticket.queued:
+                # waiting for a slot in this worker's pool: bounded by the caller's deadline, not the provider timeout
+                await asyncio.wait({task, ticket.started}, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            remaining = started + timeout - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            await asyncio.wait({task, ticket.started} if not ticket.started.done() else {task},
+                               timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        return task.result()
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def _hedged(attempt: Callable[[], Awaitable[Any]], hedge: Callable[[], Awaitable[Any]], hedge_after: float):
+    """Race ``attempt()`` with ``hedge()``, started once the first is slower than ``hedge_after`` s"""
+    global hedges_started, hedges_skipped
+    first = asyncio.ensure_future(attempt())
+    pending = {first}
+    hedged = False
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=None if hedged else hedge_after,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                if task is not first and isinstance(task.exception(), (Overloaded, CircuitOpenError)):
+                    hedges_skipped += 1  # no token or an open breaker: keep waiting for the first
+                    continue
+                error = task.exception()
+            if not done and not hedged:
+                pending.add(asyncio.ensure_future(hedge()))
+                hedged = True
+                hedges_started += 1
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _gated_hedge(provider: str, breaker: CircuitBreaker, run: Callable[[], Awaitable[Any]], timeout: float):
+    """A hedge is a request like any other: it needs a rate-limit token and a closed breaker"""
+    await provider_limiter.acquire(provider)
+    if not breaker.allow():
+        raise CircuitOpenError(f"{breaker.name} circuit is open")
+    return await _attempt(run, timeout)
+
+
+async def call(provider: str, endpoint: str, run: Callable[[], Awaitable[Any]], *,
+               idempotent: bool = False,
+               retry_on: Callable[[BaseException], bool] = is_transient,
+               policy: Optional[CallPolicy] = None):
+    """Await ``run()`` under ``provider``'s timeout, retry, breaker and hedging policy"""
+    policy = policy or PROVIDER_POLICIES[provider]
+    breaker = get_breaker(provider, endpoint)
+    attempts = 1 + (policy.retries if idempotent else 0)
+
+    with span(f"provider.{breaker.name}") as trace:
+        for attempt in range(attempts):
+            trace.set(attempts=attempt + 1)
+            try:
+                await provider_limiter.acquire(provider)
+            except ProviderThrottledError:
+                PROVIDER_CALLS.inc(provider=provider, endpoint=endpoint, outcome="throttled")
+                raise
+            if not breaker.allow():
+                PROVIDER_CALLS.inc(provider=provider, endpoint=endpoint, outcome="rejected")
+                raise CircuitOpenError(f"{breaker.name} circuit is open")
+            started = time.perf_counter()
+            try:
+                if idempotent and policy.hedge_after is not None:
+                    result = await _hedged(lambda: _attempt(run, policy.timeout),
+                                           lambda: _gated_hedge(provider, breaker, run, policy.timeout),
+                                           policy.hedge_after)
+                else:
+                    result = await _attempt(run, policy.timeout)
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    e = ProviderTimeoutError(f"{breaker.name} timed out after {policy.timeout:g}s")
+                PROVIDER_LATENCY.observe(time.perf_counter() - started, provider=provider, endpoint=endpoint)
+                PROVIDER_ERRORS.inc(provider=provider, endpoint=endpoint, error=type(e).__name__)
+                if not retry_on(e):
+                    breaker.record_success()  # the provider answered; the request itself was bad
+                    PROVIDER_CALLS.inc(provider=provider, endpoint=endpoint, outcome="error")
+                    raise e
+                breaker.record_failure()
+                if attempt + 1 >= attempts:
+                    outcome = "timeout" if isinstance(e, ProviderTimeoutError) else "error"
+                    PROVIDER_CALLS.inc(provider=provider, endpoint=endpoint, outcome=outcome)
+                    raise e
+                await asyncio.sleep(backoff_delay(attempt))
+            except BaseException:
+                # cancelled (step timeout, client disconnect, losing hedge): no outcome to record,
+                # but a half-open probe must not stay "in flight" forever
+                breaker.release_probe()
+                raise
+            else:
+                PROVIDER_LATENCY.observe(time.perf_counter() - started, provider=provider, endpoint=endpoint)
+                PROVIDER_CALLS.inc(provider=provider, endpoint=endpoint, outcome="ok")
+                breaker.record_success()
+                return result
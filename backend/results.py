@@ -0,0 +1,408 @@
+"""Typed search results and the server-held result sets behind pagination.
+
+Amadeus payloads are parsed into the Pydantic models below: numeric
+``price`` plus ``currency``, ISO 8601 durations with a ``duration_minutes``
+companion, and stop counts. Search functions return them as plain dicts
+(``model_dump``) so the result cache can still store them as JSON.
+
+Every search step keeps its full result list in ``result_store`` under a
+``result_id`` and the chat response carries only the first page. Clients
+page through the rest with an opaque cursor, re-sort by price or duration
+and select fields via ``GET /api/results/{result_id}``, without another
+upstream search. Result sets expire after ``RESULT_SET_TTL`` seconds and
+are evicted least-recently-used beyond ``RESULT_SET_MAX``.
+
+With ``RESULT_SET_BACKEND=sqlite`` (default: ``STATE_BACKEND``, see
+state.py) result sets are rows in ``RESULT_SET_SQLITE_PATH`` so the next
+page can be served by any worker; the oldest sets are evicted first. Reads
+and writes run on the store's own thread, off the event loop.
+"""
+import base64
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from state import STATE_BACKEND, StoreThread, connect_sqlite, state_path
+
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "5"))
+RESULT_MAX_PAGE_SIZE = int(os.getenv("RESULT_MAX_PAGE_SIZE", "50"))
+RESULT_SET_TTL = int(os.getenv("RESULT_SET_TTL", "1800"))
+RESULT_SET_MAX = int(os.getenv("RESULT_SET_MAX", "5000"))
+RESULT_SET_BACKEND = os.getenv("RESULT_SET_BACKEND", STATE_BACKEND)
+RESULT_SET_SQLITE_PATH = os.getenv("RESULT_SET_SQLITE_PATH", state_path("results.sqlite3"))
+
+ISO_DURATION_RE = re.compile(r"^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+
+
+def duration_minutes(duration: Optional[str]) -> Optional[int]:
+    """Minutes in an ISO 8601 duration such as "PT6H10M" or "P1DT2H" """
+    match = ISO_DURATION_RE.match(duration or "")
+    if not match or not duration[1:].strip("T"):
+        return None
+    days, hours, minutes, seconds = (int(v) if v else 0 for v in match.groups())
+    return days * 1440 + hours * 60 + minutes + round(seconds / 60)
+
+
+def to_amount(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# --- Models ---
+
+class FlightPoint(BaseModel):
+    airport: str
+    time: str
+    terminal: Optional[str] = None
+
+
+class FlightSegment(BaseModel):
+    departure: FlightPoint
+    arrival: FlightPoint
+    airline: str
+    flight_number: Optional[str] = None
+    duration: Optional[str] = None
+    duration_minutes: Optional[int] = None
+
+    @classmethod
+    def from_amadeus(cls, segment: Dict[str, Any]) -> "FlightSegment":
+        return cls(
+            departure=FlightPoint(airport=segment["departure"]["iataCode"], time=segment["departure"]["at"],
+                                  terminal=segment["departure"].get("terminal")),
+            arrival=FlightPoint(airport=segment["arrival"]["iataCode"], time=segment["arrival"]["at"],
+                                terminal=segment["arrival"].get("terminal")),
+            airline=segment["carrierCode"],
+            flight_number=segment.get("number"),
+            duration=segment.get("duration"),
+            duration_minutes=duration_minutes(segment.get("duration")),
+        )
+
+
+class FlightOffer(BaseModel):
+    id: str
+    price: Optional[float] = None
+    currency: str = ""
+    segments: List[FlightSegment]
+    return_segments: Optional[List[FlightSegment]] = None
+    duration: Optional[str] = None
+    duration_minutes: Optional[int] = None
+    stops: int = 0
+    airlines: List[str] = []
+    seats: Optional[int] = None
+    departure_date: Optional[str] = None
+    return_date: Optional[str] = None
+
+    @classmethod
+    def from_amadeus(cls, offer: Dict[str, Any]) -> "FlightOffer":
+        # itinerary แรก = ขาไป (segments), itinerary ที่สอง = ขากลับ (return_segments)
+        itineraries = offer.get("itineraries") or []
+        legs = [[FlightSegment.from_amadeus(s) for s in itinerary["segments"]] for itinerary in itineraries]
+        outbound = itineraries[0] if itineraries else {}
+        price = offer.get("price") or {}
+        return cls(
+            id=str(offer.get("id", "")),
+            price=to_amount(price.get("grandTotal") or price.get("total")),
+            currency=price.get("currency", ""),
+            segments=legs[0] if legs else [],
+            return_segments=legs[1] if len(legs) > 1 else None,
+            duration=outbound.get("duration"),
+            duration_minutes=duration_minutes(outbound.get("duration")),
+            stops=max(0, len(legs[0]) - 1) if legs else 0,
+            airlines=sorted({s.airline for leg in legs for s in leg}),
+            seats=offer.get("numberOfBookableSeats"),
+        )
+
+
+class HotelRoomOffer(BaseModel):
+    id: Optional[str] = None
+    price: Optional[float] = None
+    currency: str = ""
+    room: str = "N/A"
+    check_in: Optional[str] = None
+    check_out: Optional[str] = None
+
+
+class HotelResult(BaseModel):
+    id: str
+    name: str
+    price: Optional[float] = None  # cheapest room offer
+    currency: str = ""
+    offers: List[HotelRoomOffer] = []
+
+    @classmethod
+    def from_amadeus(cls, hotel_data: Dict[str, Any]) -> Optional["HotelResult"]:
+        hotel_info = hotel_data.get("hotel")
+        offers_info = hotel_data.get("offers")
+        if not hotel_info or not offers_info:
+            return None  # ข้อมูลไม่ครบ
+        offers = []
+        for offer in offers_info:
+            price = offer.get("price") or {}
+            room = (offer.get("room") or {}).get("typeEstimated") or {}
+            offers.append(HotelRoomOffer(
+                id=offer.get("id"),
+                price=to_amount(price.get("total")),
+                currency=price.get("currency", ""),
+                room=room.get("category", "N/A"),
+                check_in=offer.get("checkInDate"),
+                check_out=offer.get("checkOutDate"),
+            ))
+        offers.sort(key=lambda o: (o.price is None, o.price or 0))
+        return cls(
+            id=hotel_info.get("hotelId") or "",
+            name=hotel_info.get("name", "N/A"),
+            price=offers[0].price if offers else None,
+            currency=offers[0].currency if offers else "",
+            offers=offers,
+        )
+
+
+class CarOffer(BaseModel):
+    id: str
+    provider_name: str = "N/A"
+    car_type: str = "N/A"
+    category: str = "N/A"
+    price: Optional[float] = None
+    currency: str = ""
+
+    @classmethod
+    def from_amadeus(cls, offer: Dict[str, Any], index: int = 0) -> "CarOffer":
+        price = offer.get("price") or {}
+        car = offer.get("car") or {}
+        return cls(
+            id=str(offer.get("id", index)),
+            provider_name=(offer.get("provider") or {}).get("name", "N/A"),
+            car_type=car.get("type", "N/A"),
+            category=car.get("category", "N/A"),
+            price=to_amount(price.get("total")),
+            currency=price.get("currency", ""),
+        )
+
+
+RESULT_MODELS = {"flights": FlightOffer, "hotels": HotelResult, "cars": CarOffer}
+
+
+# --- Sorting, field selection, cursors ---
+
+def _missing_last(field: str):
+    return lambda item: (item.get(field) is None, item.get(field) or 0)
+
+
+SORT_KEYS = {
+    "flights": {"price": _missing_last("price"), "duration": _missing_last("duration_minutes"),
+                "stops": _missing_last("stops")},
+    "hotels": {"price": _missing_last("price"), "name": lambda item: item.get("name") or ""},
+    "cars": {"price": _missing_last("price")},
+}
+
+
+def select_fields(item: Dict[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+    """Only the requested top-level fields (plus ``id``); unknown names are ignored"""
+    if not fields:
+        return item
+    return {k: v for k, v in item.items() if k in fields or k == "id"}
+
+
+def encode_cursor(result_id: str, offset: int, sort: Optional[str]) -> str:
+    raw = json.dumps({"r": result_id, "o": offset, "s": sort}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int, Optional[str]]:
+    """Raises ValueError for a cursor that was not produced by encode_cursor"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        result_id, offset, sort = str(data["r"]), int(data["o"]), data.get("s")
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+    if offset < 0 or not (sort is None or isinstance(sort, str)):
+        raise ValueError("invalid cursor")
+    return result_id, offset, sort
+
+
+class ResultSet:
+    __slots__ = ("result_id", "kind", "items", "created_at", "_orders")
+
+    def __init__(self, result_id: str, kind: str, items: List[Dict[str, Any]]):
+        self.result_id = result_id
+        self.kind = kind
+        self.items = items
+        self.created_at = time.time()
+        self._orders: Dict[str, List[int]] = {}
+
+    def order(self, sort: Optional[str]) -> List[int]:
+        """Item positions in ``sort`` order ("price", "-price", ...); computed once per sort"""
+        if not sort:
+            return list(range(len(self.items)))
+        if sort not in self._orders:
+            field = sort.lstrip("-")
+            key = SORT_KEYS.get(self.kind, {}).get(field)
+            if key is None:
+                raise ValueError(f"cannot sort {self.kind} by {field!r}")
+            self._orders[sort] = sorted(range(len(self.items)), key=lambda i: key(self.items[i]),
+                                        reverse=sort.startswith("-"))
+        return self._orders[sort]
+
+
+class ResultStore:
+    """In-memory LRU/TTL store of full search result lists."""
+
+    name = "memory"
+
+    def __init__(self, max_sets: int = RESULT_SET_MAX, ttl: int = RESULT_SET_TTL):
+        self.max_sets = max_sets
+        self.ttl = ttl
+        self.evictions = 0
+        self.pages_served = 0
+        self._sets: "OrderedDict[str, ResultSet]" = OrderedDict()
+
+    async def put(self, kind: str, items: List[Dict[str, Any]]) -> ResultSet:
+        result_set = ResultSet(uuid.uuid4().hex, kind, list(items))
+        self._sets[result_set.result_id] = result_set
+        while len(self._sets) > self.max_sets:
+            self._sets.popitem(last=False)
+            self.evictions += 1
+        return result_set
+
+    async def get(self, result_id: str) -> Optional[ResultSet]:
+        result_set = self._sets.get(result_id)
+        if result_set is None:
+            return None
+        if time.time() - result_set.created_at > self.ttl:
+            del self._sets[result_id]
+            return None
+        self._sets.move_to_end(result_id)
+        return result_set
+
+    def page(self, result_set: ResultSet, offset: int = 0, limit: int = RESULT_PAGE_SIZE,
+             sort: Optional[str] = None, fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        """One page of a result set; raises ValueError for an unknown sort field or a bad offset/limit"""
+        if offset < 0 or limit <= 0:
+            raise ValueError("offset must be >= 0 and limit > 0")
+        limit = min(limit, RESULT_MAX_PAGE_SIZE)
+        order = result_set.order(sort)
+        end = offset + limit
+        self.pages_served += 1
+        return {
+            "result_id": result_set.result_id,
+            "total": len(order),
+            "sort": sort,
+            "data": [select_fields(result_set.items[i], fields) for i in order[offset:end]],
+            "next_cursor": encode_cursor(result_set.result_id, end, sort) if end < len(order) else None,
+        }
+
+    async def first_page(self, kind: str, items: List[Dict[str, Any]], sort: Optional[str] = None,
+                         **extra) -> Dict[str, Any]:
+        """Store ``items`` and return the search payload: first page plus ``extra`` (query, calendar, ...)"""
+        return dict(extra, **self.page(await self.put(kind, items), sort=sort))
+
+    async def reshape(self, payload: Dict[str, Any], limit: Optional[int],
+                      fields: Optional[List[str]]) -> Dict[str, Any]:
+        """Re-cut a first-page payload for a client that asked for another page size or fields"""
+        result_set = await self.get(payload.get("result_id", ""))
+        if result_set is None:
+            return payload
+        return dict(payload, **self.page(result_set, limit=limit or RESULT_PAGE_SIZE,
+                                         sort=payload.get("sort"), fields=fields))
+
+    def size(self) -> int:
+        return len(self._sets)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "result_sets": self.size(),
+            "max_sets": self.max_sets,
+            "ttl": self.ttl,
+            "evictions": self.evictions,
+            "pages_served": self.pages_served,
+        }
+
+
+class SQLiteResultStore(ResultStore):
+    """Result sets in a SQLite file, shared between worker processes (sort orders are computed per read)."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = RESULT_SET_SQLITE_PATH, max_sets: int = RESULT_SET_MAX,
+                 ttl: int = RESULT_SET_TTL):
+        super().__init__(max_sets, ttl)
+        self.path = path
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._io = StoreThread("results")
+        self._db = connect_sqlite(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS result_sets ("
+            " result_id TEXT PRIMARY KEY, kind TEXT NOT NULL, items TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS result_sets_created ON result_sets (created_at)")
+        # Recounted at prunes and tracked between them, so stats() never queries from the loop
+        self._count = self._db.execute("SELECT COUNT(*) FROM result_sets").fetchone()[0]
+
+    async def put(self, kind: str, items: List[Dict[str, Any]]) -> ResultSet:
+        result_set = ResultSet(uuid.uuid4().hex, kind, list(items))
+        await self._io.run(self._put, result_set)
+        return result_set
+
+    def _put(self, result_set: ResultSet):
+        payload = json.dumps(result_set.items, ensure_ascii=False)
+        with self._lock:
+            self._db.execute("INSERT INTO result_sets (result_id, kind, items, created_at) VALUES (?, ?, ?, ?)",
+                             (result_set.result_id, result_set.kind, payload, result_set.created_at))
+            self._count += 1
+            self._puts += 1
+            if self._puts % 100 == 0:
+                self._prune(time.time())
+
+    def _prune(self, now: float):
+        self._db.execute("DELETE FROM result_sets WHERE created_at < ?", (now - self.ttl,))
+        self._count = self._db.execute("SELECT COUNT(*) FROM result_sets").fetchone()[0]
+        overflow = self._count - self.max_sets
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM result_sets WHERE result_id IN"
+                " (SELECT result_id FROM result_sets ORDER BY created_at LIMIT ?)", (overflow,)
+            )
+            self.evictions += overflow
+            self._count -= overflow
+
+    async def get(self, result_id: str) -> Optional[ResultSet]:
+        return await self._io.run(self._get, result_id)
+
+    def _get(self, result_id: str) -> Optional[ResultSet]:
+        with self._lock:
+            row = self._db.execute("SELECT kind, items, created_at FROM result_sets WHERE result_id = ?",
+                                   (result_id,)).fetchone()
+            if row is not None and time.time() - row[2] > self.ttl:
+                self._count -= self._db.execute("DELETE FROM result_sets WHERE result_id = ?",
+                                                (result_id,)).rowcount
+                row = None
+        if row is None:
+            return None
+        result_set = ResultSet(result_id, row[0], json.loads(row[1]))
+        result_set.created_at = row[2]
+        return result_set
+
+    def size(self) -> int:
+        return self._count
+
+
+def create_result_store(kind: str = RESULT_SET_BACKEND) -> ResultStore:
+    if kind == "sqlite":
+        return SQLiteResultStore(RESULT_SET_SQLITE_PATH)
+    if kind != "memory":
+        raise ValueError(f"Unknown RESULT_SET_BACKEND: {kind}")
+    return ResultStore()
+
+
+result_store = create_result_store()
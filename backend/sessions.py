@@ -0,0 +1,274 @@
+"""Server-side conversation state for /api/chat.
+
+Clients send only the new message plus a ``session_id``; the server keeps
+the recent turns, a compact summary of older turns and the trip slots
+(origin, destination, city, dates) extracted from executed plans, so
+follow-ups like "แล้วโรงแรมล่ะ" can reuse them.
+
+History is kept under ``SESSION_TOKEN_BUDGET`` (estimated tokens) by folding
+the oldest turns into a short extractive summary, which costs no LLM call.
+Sessions are evicted least-recently-used beyond ``SESSION_MAX_SESSIONS`` and
+expire after ``SESSION_TTL`` seconds of inactivity.
+
+``SESSION_BACKEND`` (default: ``STATE_BACKEND``, see state.py) is ``memory``
+or ``sqlite``: records as JSON rows in ``SESSION_SQLITE_PATH``, so a
+follow-up message can land on any worker. A record is read at the start of
+a turn and written back with ``save`` at its end (last writer wins); both
+run on the store's own thread, so a locked database never blocks the event
+loop.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from airports import airport_index
+from state import STATE_BACKEND, StoreThread, connect_sqlite, state_path
+
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(2 * 3600)))
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", "600"))
+SESSION_SUMMARY_MAX_CHARS = int(os.getenv("SESSION_SUMMARY_MAX_CHARS", "600"))
+# Replies are stored truncated; the cards they described are not needed for context
+SESSION_MAX_TURN_CHARS = 300
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", STATE_BACKEND)
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", state_path("sessions.sqlite3"))
+
+SLOT_NAMES = ("origin", "destination", "city", "start_date", "end_date")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (Thai and English average ~3 characters per token)"""
+    return len(text) // 3 + 1
+
+
+class SessionRecord:
+    __slots__ = ("session_id", "turns", "tokens", "summary", "slots", "updated_at")
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.turns: List[Tuple[str, str]] = []  # (role, text), oldest first
+        self.tokens = 0
+        self.summary = ""
+        self.slots: Dict[str, str] = {}
+        self.updated_at = time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"turns": self.turns, "tokens": self.tokens, "summary": self.summary, "slots": self.slots}
+
+    @classmethod
+    def from_dict(cls, session_id: str, data: Dict[str, Any]) -> "SessionRecord":
+        record = cls(session_id)
+        record.turns = [(role, text) for role, text in data.get("turns", [])]
+        record.tokens = data.get("tokens", 0)
+        record.summary = data.get("summary", "")
+        record.slots = data.get("slots", {})
+        return record
+
+    def has_context(self) -> bool:
+        return bool(self.turns or self.summary or self.slots)
+
+    def add_turn(self, role: str, text: str, token_budget: int = SESSION_TOKEN_BUDGET):
+        text = text.strip()[:SESSION_MAX_TURN_CHARS]
+        if not text:
+            return
+        self.turns.append((role, text))
+        self.tokens += estimate_tokens(text)
+        # Keep at least the latest exchange verbatim
+        while self.tokens > token_budget and len(self.turns) > 2:
+            old_role, old_text = self.turns.pop(0)
+            self.tokens -= estimate_tokens(old_text)
+            self._summarize(old_role, old_text)
+
+    def _summarize(self, role: str, text: str):
+        limit = 80 if role == "user" else 40
+        line = f"{'ผู้ใช้' if role == 'user' else 'AI'}: {text[:limit]}{'…' if len(text) > limit else ''}"
+        summary = f"{self.summary}\n{line}" if self.summary else line
+        if len(summary) > SESSION_SUMMARY_MAX_CHARS:
+            # Drop whole lines from the oldest end
+            cut = summary.find("\n", len(summary) - SESSION_SUMMARY_MAX_CHARS)
+            summary = summary[cut + 1:] if cut != -1 else summary[-SESSION_SUMMARY_MAX_CHARS:]
+        self.summary = summary
+
+    def update_slots(self, plan: List[Dict[str, Any]]):
+        """Remember the trip details of the plan that was just executed"""
+        for step in plan:
+            tool = step.get("tool")
+            if tool == "search_flights":
+                values = {
+                    "origin": step.get("origin"),
+                    "destination": step.get("destination"),
+                    "start_date": step.get("departure_date") or step.get("departure_date_from"),
+                    "end_date": step.get("return_date"),
+                }
+                if step.get("destination"):
+                    values["city"] = airport_index.city_of(step["destination"]) or step["destination"]
+            elif tool == "search_hotels":
+                values = {"city": step.get("city"), "start_date": step.get("check_in_date"),
+                          "end_date": step.get("check_out_date")}
+            elif tool == "search_car_rentals":
+                values = {"city": step.get("city"), "start_date": step.get("pick_up_date"),
+                          "end_date": step.get("drop_off_date")}
+            else:
+                continue
+            if values.get("start_date"):
+                # A new start date without an end date invalidates the old end date
+                self.slots.pop("end_date", None)
+            self.slots.update({k: v for k, v in values.items() if isinstance(v, str) and v})
+
+    def context_text(self) -> str:
+        """Compact context block for the Gemini prompts"""
+        parts = []
+        if self.slots:
+            known = ", ".join(f"{name}={self.slots[name]}" for name in SLOT_NAMES if name in self.slots)
+            parts.append(f"ข้อมูลทริปที่ทราบแล้ว: {known}")
+        if self.summary:
+            parts.append(f"สรุปบทสนทนาก่อนหน้า:\n{self.summary}")
+        if self.turns:
+            recent = "\n".join(f"{'ผู้ใช้' if role == 'user' else 'AI'}: {text}" for role, text in self.turns)
+            parts.append(f"บทสนทนาล่าสุด:\n{recent}")
+        return "\n".join(parts)
+
+
+class SessionStore:
+    """In-memory LRU/TTL store of SessionRecord objects."""
+
+    name = "memory"
+
+    def __init__(self, max_sessions: int = SESSION_MAX_SESSIONS, ttl: int = SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.evictions = 0
+        self.expirations = 0
+        self._sessions: "OrderedDict[str, SessionRecord]" = OrderedDict()
+
+    async def get_or_create(self, session_id: Optional[str]) -> SessionRecord:
+        now = time.time()
+        record = self._sessions.get(session_id) if session_id else None
+        if record is not None and now - record.updated_at > self.ttl:
+            del self._sessions[session_id]
+            self.expirations += 1
+            record = None
+        if record is None:
+            record = SessionRecord(session_id or uuid.uuid4().hex)
+            self._sessions[record.session_id] = record
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+        self._sessions.move_to_end(record.session_id)
+        record.updated_at = now
+        return record
+
+    async def save(self, record: SessionRecord):
+        """Records are the stored objects themselves; nothing to write"""
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "ttl": self.ttl,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SQLiteSessionStore:
+    """Sessions in a SQLite file, shared between worker processes."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = SESSION_SQLITE_PATH, max_sessions: int = SESSION_MAX_SESSIONS,
+                 ttl: int = SESSION_TTL):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.evictions = 0
+        self.expirations = 0
+        self._saves = 0
+        self._lock = threading.Lock()
+        self._io = StoreThread("sessions")
+        self._db = connect_sqlite(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated_at)")
+        # Recounted at prunes and tracked between them, so stats() never queries from the loop
+        self._count = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    async def get_or_create(self, session_id: Optional[str]) -> SessionRecord:
+        return await self._io.run(self._get_or_create, session_id)
+
+    def _get_or_create(self, session_id: Optional[str]) -> SessionRecord:
+        now = time.time()
+        record = None
+        if session_id:
+            with self._lock:
+                row = self._db.execute("SELECT data, updated_at FROM sessions WHERE session_id = ?",
+                                       (session_id,)).fetchone()
+                if row is not None and now - row[1] > self.ttl:
+                    self._count -= self._db.execute("DELETE FROM sessions WHERE session_id = ?",
+                                                    (session_id,)).rowcount
+                    self.expirations += 1
+                    row = None
+            if row is not None:
+                record = SessionRecord.from_dict(session_id, json.loads(row[0]))
+        if record is None:
+            record = SessionRecord(session_id or uuid.uuid4().hex)
+        record.updated_at = now
+        return record
+
+    async def save(self, record: SessionRecord):
+        payload = json.dumps(record.to_dict(), ensure_ascii=False)
+        await self._io.run(self._save, record.session_id, payload, record.updated_at)
+
+    def _save(self, session_id: str, payload: str, updated_at: float):
+        with self._lock:
+            updated = self._db.execute("UPDATE sessions SET data = ?, updated_at = ? WHERE session_id = ?",
+                                       (payload, updated_at, session_id)).rowcount
+            if not updated:
+                self._db.execute("INSERT OR REPLACE INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?)",
+                                 (session_id, payload, updated_at))
+                self._count += 1
+            self._saves += 1
+            if self._saves % 100 == 0:
+                self._prune(time.time())
+
+    def _prune(self, now: float):
+        expired = self._db.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl,)).rowcount
+        self.expirations += max(expired, 0)
+        self._count = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        overflow = self._count - self.max_sessions
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM sessions WHERE session_id IN"
+                " (SELECT session_id FROM sessions ORDER BY updated_at LIMIT ?)", (overflow,)
+            )
+            self.evictions += overflow
+            self._count -= overflow
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "sessions": self._count,
+            "max_sessions": self.max_sessions,
+            "ttl": self.ttl,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+def create_session_store(kind: str = SESSION_BACKEND):
+    if kind == "sqlite":
+        return SQLiteSessionStore(SESSION_SQLITE_PATH)
+    if kind != "memory":
+        raise ValueError(f"Unknown SESSION_BACKEND: {kind}")
+    return SessionStore()
+
+
+session_store = create_session_store()
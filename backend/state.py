@@ -0,0 +1,58 @@
+"""Where the state that worker processes can share is kept.
+
+``STATE_BACKEND`` (``memory`` or ``sqlite``) is the default backend of every
+store that can be shared between the workers of one machine:
+
+- the provider result cache (``CACHE_BACKEND``, cache.py);
+- client and provider rate-limit buckets (``RATE_LIMIT_BACKEND``, admission.py);
+- conversation sessions (``SESSION_BACKEND``, sessions.py);
+- paginated result sets (``RESULT_SET_BACKEND``, results.py);
+- batch jobs (``BATCH_JOB_BACKEND``, batch.py).
+
+Each can still be set on its own. SQLite files are created in ``STATE_DIR``
+in WAL mode, so readers in one worker never block writers in another. Every
+SQLite store runs its queries on its own ``StoreThread``, never on the event
+loop: a write waiting out another worker's lock (up to the 5 s busy timeout)
+delays only that store's calls.
+``python main.py --workers N`` with N > 1 defaults ``STATE_BACKEND`` to
+``sqlite``: any worker can then continue a session, serve the next page of
+a search or the status of a batch job, and the rate limits hold for the
+deployment as a whole.
+
+Kept per worker on purpose: the plan cache and hotel directory (only save
+upstream calls, each worker fills its own), the admission queue, prefetch
+pattern learning and the provider thread pool.
+"""
+import asyncio
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_DIR = os.getenv("STATE_DIR", ".")
+
+
+def state_path(filename: str) -> str:
+    return os.path.join(STATE_DIR, filename)
+
+
+def connect_sqlite(path: str) -> sqlite3.Connection:
+    """WAL-mode connection in autocommit mode, usable from any thread (callers serialize with a lock)"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+class StoreThread:
+    """A single thread for one store's blocking calls, run in submission order."""
+
+    def __init__(self, name: str):
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"state-{name}")
+
+    async def run(self, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
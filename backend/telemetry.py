@@ -0,0 +1,376 @@
+"""Logging, metrics and tracing for the chat pipeline.
+
+- Logging: ``log`` (logger "travel_agent") writes through a QueueHandler, so
+  the request path only enqueues records; a listener thread formats and
+  writes them to stderr. Level from ``LOG_LEVEL`` (default INFO).
+- Metrics: counters and histograms kept in process and rendered in the
+  Prometheus text format by ``render_metrics()`` (served on /metrics).
+  ``register_collector(fn)`` adds values read at scrape time, such as cache
+  hit ratios from the existing ``stats()`` methods.
+- Tracing: ``with span("name", key=value):`` times a stage. Spans nest through
+  a context variable, so steps running in their own asyncio tasks still
+  attach to the request's trace. Every finished span is observed in the
+  ``stage_duration_seconds`` histogram; finished traces are exported in the
+  OTLP JSON format when ``TRACE_EXPORT`` is ``file`` (JSON lines appended to
+  ``TRACE_EXPORT_PATH``) or ``otlp`` (POSTed to
+  ``OTEL_EXPORTER_OTLP_ENDPOINT``/v1/traces) by a background thread.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "")  # "", "file" or "otlp"
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "traces.jsonl")
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318").rstrip("/")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1"))
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "ai-travel-agent")
+# Traces waiting for export; beyond this they are dropped rather than slowing requests down
+TRACE_QUEUE_SIZE = 1000
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30)
+
+
+# --- Logging ---
+
+log = logging.getLogger("travel_agent")
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_queue_handler: Optional[logging.handlers.QueueHandler] = None
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging(level: str = LOG_LEVEL):
+    """Route "travel_agent" records through a queue to a background writer (idempotent)"""
+    global _log_queue_handler, _log_listener
+    log.setLevel(level)
+    log.propagate = False
+    if _log_listener is not None:
+        return
+    records = queue.SimpleQueue()
+    log.removeHandler(_log_handler)
+    _log_queue_handler = logging.handlers.QueueHandler(records)
+    log.addHandler(_log_queue_handler)
+    _log_listener = logging.handlers.QueueListener(records, _log_handler, respect_handler_level=True)
+    _log_listener.start()
+
+
+def stop_logging():
+    """Flush queued log records; later records are written directly (called on shutdown)"""
+    global _log_queue_handler, _log_listener
+    if _log_listener is None:
+        return
+    log.removeHandler(_log_queue_handler)
+    log.addHandler(_log_handler)
+    _log_listener.stop()
+    _log_queue_handler = _log_listener = None
+
+
+# --- Metrics ---
+
+def _label_key(labelnames: Sequence[str], labels: Dict[str, Any]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames: Sequence[str], key: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, key)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        _metrics.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # per label set: [count per bucket (+Inf last), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        _metrics.append(self)
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {round(total, 6)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# A collector returns (name, type, help, [(labels dict, value), ...]) tuples at scrape time
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]]]
+
+_metrics: List[Any] = []
+_collectors: List[Collector] = []
+
+
+def register_collector(collector: Collector):
+    _collectors.append(collector)
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        try:
+            families = list(collector())
+        except Exception as e:
+            log.warning("Metrics collector %s failed: %s", getattr(collector, "__name__", collector), e)
+            continue
+        for name, kind, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                names = tuple(labels)
+                lines.append(f"{name}{_format_labels(names, [labels[n] for n in names])} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_LATENCY = Histogram("chat_request_duration_seconds", "Chat request latency", ("endpoint", "status"))
+STAGE_LATENCY = Histogram("stage_duration_seconds", "Duration of traced stages (span name)", ("stage",))
+PROVIDER_CALLS = Counter("provider_calls_total", "Provider calls by outcome", ("provider", "endpoint", "outcome"))
+PROVIDER_ERRORS = Counter("provider_errors_total", "Failed provider attempts by error type",
+                          ("provider", "endpoint", "error"))
+PROVIDER_LATENCY = Histogram("provider_attempt_duration_seconds", "Duration of single provider attempts",
+                             ("provider", "endpoint"))
+TRACES_DROPPED = Counter("traces_dropped_total", "Traces not exported because the export queue was full")
+
+
+# --- Tracing ---
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "root", "attributes", "error",
+                 "start_ns", "end_ns", "_started", "duration_s", "children", "sampled")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = f"{random.getrandbits(64):016x}"
+        if parent is None:
+            self.trace_id = f"{random.getrandbits(128):032x}"
+            self.parent_id = None
+            self.root = self
+            self.sampled = bool(TRACE_EXPORT) and random.random() < TRACE_SAMPLE_RATE
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self.root = parent.root
+            self.sampled = parent.sampled
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self._started = time.perf_counter()
+        self.duration_s = 0.0
+        self.children: List["Span"] = []
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        self.duration_s = time.perf_counter() - self._started
+        self.end_ns = self.start_ns + int(self.duration_s * 1e9)
+        STAGE_LATENCY.observe(self.duration_s, stage=self.name)
+        if not self.sampled:
+            return
+        if self.root is not self:
+            self.root.children.append(self)
+        else:
+            _exporter.submit(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 2 if self.parent_id is None else 1,  # SERVER for the request, INTERNAL otherwise
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items() if v is not None],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a stage as a child of the current span (or as a new trace)"""
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            pass  # async generator finalized in another context
+        current.finish()
+
+
+class TraceExporter:
+    """Writes finished traces from a background thread (file or OTLP/HTTP JSON)."""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.exported = 0
+        self.failed = 0
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(TRACE_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, root: Span):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait(root)
+        except queue.Full:
+            TRACES_DROPPED.inc()
+
+    def _payload(self, roots: List[Span]) -> Dict[str, Any]:
+        spans = [s.to_otlp() for root in roots for s in [root] + root.children]
+        return {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "travel_agent"}, "spans": spans}],
+        }]}
+
+    def _write(self, roots: List[Span]):
+        if self.mode == "file":
+            with open(TRACE_EXPORT_PATH, "a", encoding="utf-8") as f:
+                for root in roots:
+                    f.write(json.dumps(self._payload([root]), ensure_ascii=False) + "\n")
+        else:
+            request = urllib.request.Request(
+                f"{OTLP_ENDPOINT}/v1/traces",
+                data=json.dumps(self._payload(roots)).encode(),
+                headers={"Content-Type": "application/json"},
+            )
+            urllib.request.urlopen(request, timeout=5).close()
+
+    def _run(self):
+        while True:
+            root = self._queue.get()
+            if root is None:
+                return
+            batch = [root]
+            while len(batch) < 100:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+            try:
+                self._write(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                log.warning("Trace export (%s) failed: %s", self.mode, e)
+
+    def flush(self, timeout: float = 5.0):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": self.mode or "off", "exported": self.exported, "failed": self.failed,
+                "queued": self._queue.qsize()}
+
+
+_exporter = TraceExporter(TRACE_EXPORT)
+
+
+def trace_stats() -> Dict[str, Any]:
+    return _exporter.stats()
+
+
+def shutdown():
+    """Flush pending traces and log records"""
+    _exporter.flush()
+    stop_logging()
+
+
+configure_logging()
+atexit.register(shutdown)
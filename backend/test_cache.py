@@ -0,0 +1,39 @@
+import asyncio
+
+from cache import MemoryBackend, ResultCache
+
+
+class FailingStore(MemoryBackend):
+    def set(self, key, value, ttl):
+        raise RuntimeError("database is locked")
+
+
+async def fetch_twice(cache, fetch):
+    first = asyncio.ensure_future(cache.get_or_fetch("flights", {"origin": "BKK"}, fetch))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(cache.get_or_fetch("flights", {"origin": "BKK"}, fetch))
+    return await asyncio.wait_for(asyncio.gather(first, second, return_exceptions=True), 2)
+
+
+def test_coalesced_callers_get_the_value_when_the_store_fails():
+    cache = ResultCache(FailingStore(), {"flights": 60})
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        return ["offer"]
+
+    assert asyncio.run(fetch_twice(cache, fetch)) == [["offer"], ["offer"]]
+    assert cache.stats()["tools"]["flights"]["store_errors"] == 1
+    assert not cache._inflight
+
+
+def test_coalesced_callers_see_a_failed_fetch():
+    cache = ResultCache(MemoryBackend(), {"flights": 60})
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise ConnectionError("upstream down")
+
+    results = asyncio.run(fetch_twice(cache, fetch))
+    assert all(isinstance(r, ConnectionError) for r in results)
+    assert not cache._inflight
@@ -0,0 +1,34 @@
+from datetime import date
+
+from intent_parser import parse_intent
+
+TODAY = date(2026, 10, 17)
+
+
+def steps(message):
+    return {step["tool"]: step for step in parse_intent(message, TODAY)["plan"]}
+
+
+def test_negated_request_falls_back_to_the_model():
+    assert parse_intent("flight BKK to NRT on 25 dec, no hotel needed", TODAY) is None
+    assert parse_intent("เที่ยวบิน BKK ไป NRT วันที่ 25 ธ.ค. ไม่ต้องหาโรงแรม", TODAY) is None
+
+
+def test_reversed_date_range_falls_back_to_the_model():
+    assert parse_intent("BKK to NRT flight 25 Dec to 20 Dec", TODAY) is None
+    assert parse_intent("hotel Tokyo 15-10 Dec", TODAY) is None
+    assert parse_intent("hotel Tokyo 10-10 Dec", TODAY) is None
+    assert steps("hotel Tokyo 10-15 Dec")["search_hotels"]["check_out_date"] == "2026-12-15"
+
+
+def test_stay_length_sets_the_check_out_date():
+    hotel = steps("hotel in Tokyo from 10 Dec for 3 nights")["search_hotels"]
+    assert (hotel["check_in_date"], hotel["check_out_date"]) == ("2026-12-10", "2026-12-13")
+    assert steps("โรงแรมที่โตเกียว 10 ธ.ค. 3 คืน")["search_hotels"]["check_out_date"] == "2026-12-13"
+    assert parse_intent("hotel in Tokyo 10-15 Dec for 3 nights", TODAY) is None
+    assert parse_intent("hotel in Tokyo 10 Dec for 5 days", TODAY) is None
+
+
+def test_unknown_upper_case_words_are_not_airports():
+    assert parse_intent("flight BKK to USA on 25 Dec", TODAY) is None  # no destination: left to the model
+    assert steps("VIP flight BKK to NRT on 25 Dec")["search_flights"]["origin"] == "BKK"
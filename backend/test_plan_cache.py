@@ -0,0 +1,72 @@
+from datetime import date
+
+from plan_cache import PlanCache, depends_on_context
+
+TODAY = date(2026, 10, 17)
+BKK_NRT = {"plan": [{"tool": "search_flights", "origin": "BKK", "destination": "NRT"}]}
+TYO_HOTEL = {"plan": [{"tool": "search_hotels", "city": "TYO"}]}
+
+
+def test_reversed_route_is_not_served_the_cached_plan():
+    cache = PlanCache()
+    cache.put("flight from Bangkok to Tokyo", BKK_NRT, 1.0, TODAY)
+    assert cache.get("flight to Bangkok from Tokyo", TODAY) is None
+    cache.put("เที่ยวบินจากกรุงเทพ ไปโตเกียว", BKK_NRT, 1.0, TODAY)
+    assert cache.get("เที่ยวบินไปกรุงเทพ จากโตเกียว", TODAY) is None
+
+
+def test_same_route_in_other_words_is_a_near_hit():
+    cache = PlanCache()
+    cache.put("flight from Bangkok to Tokyo", BKK_NRT, 1.0, TODAY)
+    assert cache.get("Flights from Bangkok to Tokyo!", TODAY) == BKK_NRT
+    assert cache.stats()["near_hits"] == 1
+
+
+def test_negated_request_does_not_reuse_the_plan():
+    cache = PlanCache()
+    cache.put("hotel in Tokyo", TYO_HOTEL, 1.0, TODAY)
+    assert cache.get("I do not want a hotel in Tokyo", TODAY) is None
+    assert cache.get("ไม่เอาโรงแรมที่โตเกียว", TODAY) is None
+    assert cache.get("a hotel in tokyo", TODAY) == TYO_HOTEL
+
+
+def test_same_entities_in_a_different_sentence_need_the_similarity_check():
+    cache = PlanCache()
+    cache.put("hotel in Tokyo", TYO_HOTEL, 1.0, TODAY)
+    assert cache.get("is there a hotel in Tokyo near the station with a pool", TODAY) is None
+
+
+def test_unparsed_dates_and_modifiers_are_part_of_the_signature():
+    cache = PlanCache()
+    cache.put("flight Bangkok to Tokyo in December", BKK_NRT, 1.0, TODAY)
+    assert cache.get("flight Bangkok to Tokyo in January", TODAY) is None
+    cache.put("flight Bangkok to Tokyo on 25 Dec", BKK_NRT, 1.0, TODAY)
+    assert cache.get("cheapest flight Bangkok to Tokyo on 25 Dec", TODAY) is None
+    assert cache.get("round trip flight Bangkok to Tokyo on 25 Dec", TODAY) is None
+    cache.put("hotel in Tokyo next month", TYO_HOTEL, 1.0, TODAY)
+    assert cache.get("hotel in Tokyo in two weeks", TODAY) is None
+    assert cache.stats()["near_hits"] == 0
+
+
+def test_plans_expire_with_the_day():
+    cache = PlanCache()
+    cache.put("hotel in Tokyo", TYO_HOTEL, 1.0, TODAY)
+    assert cache.get("hotel in Tokyo", date(2026, 10, 18)) is None
+
+
+def test_follow_ups_are_keyed_on_the_trip_slots():
+    cache = PlanCache()
+    tokyo = {"city": "TYO", "start_date": "2026-12-10"}
+    cache.put("แล้วโรงแรมล่ะ", TYO_HOTEL, 1.0, TODAY, slots=tokyo)
+    assert cache.get("แล้วโรงแรมล่ะ", TODAY, slots=dict(tokyo)) == TYO_HOTEL
+    assert cache.get("แล้วโรงแรมล่ะ", TODAY, slots={"city": "PAR", "start_date": "2026-12-10"}) is None
+    assert cache.get("แล้วโรงแรมล่ะ", TODAY) is None
+
+
+def test_self_contained_messages_do_not_depend_on_context():
+    assert not depends_on_context("flight from Bangkok to Tokyo on 25 Dec", TODAY)
+    assert not depends_on_context("hotel in Tokyo 10-15 Dec", TODAY)
+    assert depends_on_context("flight to Tokyo on 25 Dec", TODAY)
+    assert depends_on_context("hotel there on 25 Dec", TODAY)
+    assert depends_on_context("hotel in Tokyo for the same dates", TODAY)
+    assert depends_on_context("แล้วโรงแรมล่ะ", TODAY)
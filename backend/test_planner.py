@@ -0,0 +1,33 @@
+import asyncio
+
+from planner import execute_plan
+
+
+async def echo(step, inputs):
+    return step.get("name")
+
+
+async def fail(step, inputs):
+    raise RuntimeError("amadeus.flight_offers circuit is open")
+
+
+def test_implicit_ids_never_clash_with_explicit_ones():
+    plan = [
+        {"tool": "echo", "name": "a"},
+        {"tool": "echo", "name": "b", "id": "0"},
+        {"tool": "echo", "name": "c", "id": "0"},
+        {"tool": "echo", "name": "d", "id": "2", "depends_on": ["0"]},
+    ]
+    results = asyncio.run(execute_plan(plan, {"echo": echo}))
+    ids = [result.id for result in results]
+    assert len(set(ids)) == len(plan)
+    assert ids[1] == "0" and ids[3] == "2"
+    assert [result.value for result in results] == ["a", "b", "c", "d"]
+    assert all(result.status == "ok" for result in results)
+
+
+def test_provider_failure_is_reported_as_a_step_error():
+    plan = [{"tool": "search", "id": "flights"}, {"tool": "echo", "depends_on": "flights"}]
+    failed, dependent = asyncio.run(execute_plan(plan, {"search": fail, "echo": echo}))
+    assert failed.status == "error" and "circuit is open" in failed.error
+    assert dependent.status == "skipped"
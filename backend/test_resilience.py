@@ -0,0 +1,78 @@
+import asyncio
+
+import resilience
+from resilience import CircuitBreaker, call, get_breaker
+
+
+def test_cancelled_half_open_probe_releases_the_breaker():
+    breaker = get_breaker("amadeus", "test_cancelled_probe")
+    breaker.state, breaker.opened_at = "open", -1e9  # reset timeout long over
+
+    async def scenario():
+        probe = asyncio.create_task(call("amadeus", "test_cancelled_probe", lambda: asyncio.sleep(5),
+                                         idempotent=True))
+        await asyncio.sleep(0.05)
+        probe.cancel()
+        try:
+            await probe
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(scenario())
+    assert breaker.state == "half_open"
+    assert breaker.failures == 0 and breaker.successes == 0
+    assert breaker.allow()  # the next call may probe
+
+
+def test_half_open_allows_a_single_probe():
+    breaker = CircuitBreaker("test.single_probe", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_plan_step_timeout_covers_every_retry():
+    import planner
+    assert planner.PLAN_STEP_TIMEOUT >= resilience.max_call_seconds("amadeus")
+
+
+def test_waiting_for_a_local_pool_slot_is_not_a_provider_timeout():
+    import time
+    from providers import ProviderExecutor
+
+    executor = ProviderExecutor({"amadeus": 1})
+    policy = resilience.CallPolicy(timeout=0.3)
+    breaker = get_breaker("amadeus", "test_local_queue")
+
+    async def scenario():
+        def search():
+            time.sleep(0.2)
+            return "ok"
+        # the second call queues 0.2 s behind the first; each runs well within its own timeout
+        calls = [call("amadeus", "test_local_queue", lambda: executor.run("amadeus", search), policy=policy)
+                 for _ in range(2)]
+        return await asyncio.gather(*calls)
+
+    assert asyncio.run(scenario()) == ["ok", "ok"]
+    assert breaker.failures == 0
+
+
+def test_hedge_is_not_sent_while_the_breaker_rejects_calls():
+    breaker = get_breaker("amadeus", "test_gated_hedge")
+    policy = resilience.CallPolicy(timeout=1, hedge_after=0.05)
+    started = []
+
+    async def run():
+        started.append(1)
+        if len(started) == 1:
+            breaker.state, breaker.opened_at = "open", 1e18  # opens while the first request is in flight
+        await asyncio.sleep(0.1)
+        return "ok"
+
+    before = resilience.hedges_skipped
+    assert asyncio.run(call("amadeus", "test_gated_hedge", run, idempotent=True, policy=policy)) == "ok"
+    assert len(started) == 1
+    assert resilience.hedges_skipped == before + 1
@@ -0,0 +1,36 @@
+import asyncio
+import base64
+import json
+
+import pytest
+
+from results import ResultStore, decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor("abc", 5, "-price")) == ("abc", 5, "-price")
+
+
+def crafted_cursor(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+
+def test_negative_cursor_offset_is_rejected():
+    with pytest.raises(ValueError):
+        decode_cursor(crafted_cursor({"r": "abc", "o": -3, "s": None}))
+
+
+@pytest.mark.parametrize("sort", [5, ["price"], {"by": "price"}])
+def test_non_string_cursor_sort_is_rejected(sort):
+    with pytest.raises(ValueError):
+        decode_cursor(crafted_cursor({"r": "abc", "o": 0, "s": sort}))
+
+
+def test_page_rejects_negative_offset_and_empty_limit():
+    store = ResultStore()
+    result_set = asyncio.run(store.put("cars", [{"id": str(i), "price": i} for i in range(10)]))
+    with pytest.raises(ValueError):
+        store.page(result_set, offset=-3)
+    with pytest.raises(ValueError):
+        store.page(result_set, limit=0)
+    assert [item["id"] for item in store.page(result_set, offset=8)["data"]] == ["8", "9"]
@@ -6,6 +6,17 @@ import CarCard from './CarCard';       // <-- เพิ่ม
 
 const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://localhost:8000';
 
+// แยก "event:" และ "data:" ของ Server-Sent Event หนึ่งก้อน
+const parseSseEvent = (rawEvent) => {
+  let event = 'message';
+  const dataLines = [];
+  rawEvent.split('\n').forEach(line => {
+    if (line.startsWith('event:')) event = line.slice(6).trim();
+    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+  });
+  return { event, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : null };
+};
+
 export default function AITravelChat({ user, onLogout }) {
   const [messages, setMessages] = useState([
     {
@@ -19,6 +30,8 @@ export default function AITravelChat({ user, onLogout }) {
   const [isRecording, setIsRecording] = useState(false);
   const [isConnected, setIsConnected] = useState(true);
   const messagesEndRef = useRef(null);
+  // ประวัติแชทเก็บไว้ที่ backend ตาม session_id ส่งแค่ข้อความใหม่ไปแต่ละครั้ง
+  const sessionIdRef = useRef(null);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
@@ -63,36 +76,69 @@ export default function AITravelChat({ user, onLogout }) {
     setInputText('');
     setIsTyping(true);
 
+    const botId = Date.now() + 1;
+    // สร้าง/อัปเดตข้อความของบอทที่กำลัง stream อยู่
+    const updateBotMessage = (update) => {
+      setMessages(prev => prev.some(m => m.id === botId)
+        ? prev.map(m => (m.id === botId ? update(m) : m))
+        : [...prev, update({ id: botId, type: 'bot', text: '', searchResults: {} })]);
+    };
+
+    const handleStreamEvent = (event, data) => {
+      switch (event) {
+        case 'result':
+          // ผลค้นหาแต่ละประเภท (flights / hotels / cars) มาทันทีที่เสร็จ
+          setIsTyping(false);
+          updateBotMessage(m => ({ ...m, searchResults: { ...m.searchResults, [data.key]: data.data } }));
+          break;
+        case 'token':
+          setIsTyping(false);
+          updateBotMessage(m => ({ ...m, text: m.text + data.text }));
+          break;
+        case 'done':
+          updateBotMessage(m => ({ ...m, text: data.response, searchResults: data.search_results }));
+          break;
+        case 'error':
+          throw new Error(data.detail);
+        case 'session':
+          sessionIdRef.current = data.session_id;
+          break;
+        default:
+          break; // 'plan', 'step'
+      }
+    };
+
     try {
-      const response = await fetch(`${API_BASE_URL}/api/chat`, {
+      const response = await fetch(`${API_BASE_URL}/api/chat/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
         body: JSON.stringify({
           message: currentInput,
-          conversation_history: messages.map(m => ({
-            role: m.type === 'user' ? 'user' : 'assistant',
-            content: m.text
-          }))
+          session_id: sessionIdRef.current
         })
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         throw new Error(`API Error: ${response.status}`);
       }
 
-      const data = await response.json();
-      
-      // Add AI text response
-      const botMessage = {
-        id: Date.now() + 1,
-        type: 'bot',
-        text: data.response,
-        searchResults: data.search_results // <-- โครงสร้างใหม่ { flights: ..., hotels: ..., cars: ... }
-      };
-      
-      setMessages(prev => [...prev, botMessage]);
+      // อ่าน Server-Sent Events ทีละ chunk
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const rawEvents = buffer.split('\n\n');
+        buffer = rawEvents.pop();
+        for (const rawEvent of rawEvents) {
+          const { event, data } = parseSseEvent(rawEvent);
+          handleStreamEvent(event, data);
+        }
+      }
 
     } catch (error) {
       console.error('Error calling API:', error);
@@ -110,6 +156,36 @@ export default function AITravelChat({ user, onLogout }) {
     }
   };
 
+  // "ดูเพิ่มเติม": ขอหน้าถัดไปจากผลค้นหาที่ backend เก็บไว้ (ไม่ค้นหาใหม่)
+  const loadMoreResults = async (messageId, key) => {
+    const message = messages.find(m => m.id === messageId);
+    const current = message && message.searchResults && message.searchResults[key];
+    if (!current || !current.next_cursor) return;
+    try {
+      const params = new URLSearchParams({ cursor: current.next_cursor });
+      const response = await fetch(`${API_BASE_URL}/api/results/${current.result_id}?${params}`);
+      if (!response.ok) throw new Error(`API Error: ${response.status}`);
+      const page = await response.json();
+      setMessages(prev => prev.map(m => (m.id !== messageId ? m : {
+        ...m,
+        searchResults: {
+          ...m.searchResults,
+          [key]: { ...m.searchResults[key], data: [...m.searchResults[key].data, ...page.data], next_cursor: page.next_cursor }
+        }
+      })));
+    } catch (error) {
+      console.error('Error loading more results:', error);
+    }
+  };
+
+  const renderLoadMore = (message, key) => (
+    message.searchResults[key].next_cursor && (
+      <button className="btn-load-more" onClick={() => loadMoreResults(message.id, key)}>
+        ดูเพิ่มเติม ({message.searchResults[key].data.length}/{message.searchResults[key].total})
+      </button>
+    )
+  );
+
   const getFollowUpMessage = (intentType) => {
     switch(intentType) {
       case 'flight':
@@ -240,12 +316,32 @@ export default function AITravelChat({ user, onLogout }) {
                     {/* 1. แสดงข้อความแชท (เหมือนเดิม) */}
                     <p className="message-text">{message.text}</p>
                     
+                    {/* 2a. ปฏิทินราคา (flexible-date search) */}
+                    {message.searchResults && message.searchResults.flights && message.searchResults.flights.calendar && (
+                      <div className="price-calendar">
+                        {message.searchResults.flights.calendar.map((day) => {
+                          const cheapest = message.searchResults.flights.cheapest_day;
+                          const isCheapest = cheapest && cheapest.departure_date === day.departure_date;
+                          return (
+                            <div
+                              key={`day-${day.departure_date}`}
+                              className={`price-calendar-day ${isCheapest ? 'cheapest' : ''}`}
+                            >
+                              <span>{day.departure_date}{day.return_date ? ` → ${day.return_date}` : ''}</span>
+                              <span className="price-calendar-price">{day.price != null ? `${day.price} ${day.currency}` : '-'}</span>
+                            </div>
+                          );
+                        })}
+                      </div>
+                    )}
+
                     {/* 2. แสดง FlightCard (ถ้ามี) */}
                     {message.searchResults && message.searchResults.flights && message.searchResults.flights.data && (
                       <div className="search-results-container">
                         {message.searchResults.flights.data.map((flight, index) => (
                           <FlightCard key={`flight-${index}`} flight={flight} />
                         ))}
+                        {renderLoadMore(message, 'flights')}
                       </div>
                     )}
 
@@ -255,6 +351,7 @@ export default function AITravelChat({ user, onLogout }) {
                         {message.searchResults.hotels.data.map((hotel, index) => (
                           <HotelCard key={`hotel-${index}`} hotel={hotel} />
                         ))}
+                        {renderLoadMore(message, 'hotels')}
                       </div>
                     )}
 
@@ -264,6 +361,7 @@ export default function AITravelChat({ user, onLogout }) {
                         {message.searchResults.cars.data.map((car, index) => (
                           <CarCard key={`car-${index}`} car={car} />
                         ))}
+                        {renderLoadMore(message, 'cars')}
                       </div>
                     )}
                     
@@ -31,7 +31,7 @@ export default function CarCard({ car }) {
       {/* ส่วน Header (ผู้ให้บริการ) */}
       <div className="car-card-header">
         <span className="car-provider">{car.provider_name}</span>
-        <span className="car-price">{car.price}</span>
+        <span className="car-price">{car.price} {car.currency}</span>
       </div>
 
       {/* ส่วน Body (รายละเอียดรถ) */}
@@ -25,7 +25,7 @@ const formatDuration = (duration) => {
 };
 
 export default function FlightCard({ flight }) {
-  // `flight` คือ object ที่มี 'price' และ 'segments' จาก main.py
+  // `flight` คือ FlightOffer จาก results.py: 'price' (ตัวเลข), 'currency', 'segments', 'stops'
 
   // เราจะแสดงข้อมูลของ segment แรกสุด (สำหรับการ์ดสรุป)
   const firstSegment = flight.segments[0];
@@ -33,14 +33,14 @@ export default function FlightCard({ flight }) {
   const lastSegment = flight.segments[flight.segments.length - 1];
   
   // นับจำนวนการต่อเครื่อง
-  const stops = flight.segments.length - 1;
+  const stops = flight.stops ?? flight.segments.length - 1;
 
   return (
     <div className="flight-card">
       
       {/* ส่วนราคา (Header) */}
       <div className="flight-card-header">
-        <span className="flight-price">{flight.price}</span>
+        <span className="flight-price">{flight.price} {flight.currency}</span>
         <span className="flight-stops">
           {stops === 0 ? 'Direct (บินตรง)' : `${stops} Stop(s)`}
         </span>
@@ -1,7 +1,7 @@
 import React from 'react';
 
 export default function HotelCard({ hotel }) {
-  // `hotel` คือ object ที่มี 'name' และ 'offers' จาก main.py
+  // `hotel` คือ HotelResult จาก results.py: 'name' และ 'offers' (เรียงจากถูกไปแพง)
 
   return (
     <div className="hotel-card">
@@ -15,14 +15,14 @@ export default function HotelCard({ hotel }) {
       {/* ส่วน Body (รายการข้อเสนอห้องพัก) */}
       <div className="hotel-card-body">
         {hotel.offers.length > 0 ? (
-          hotel.offers.map((offer, index) => (
+          hotel.offers.slice(0, 2).map((offer, index) => (
             <div className="hotel-offer" key={index}>
               <span className="hotel-room-type">
                 {/* Amadeus อาจส่ง 'category' มาเป็น 'STANDARD', 'DELUXE' ฯลฯ */}
                 {offer.room || 'Standard Room'}
               </span>
               <span className="hotel-price">
-                {offer.price}
+                {offer.price} {offer.currency}
               </span>
             </div>
           ))